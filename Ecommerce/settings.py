@@ -138,6 +138,11 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles_build', 'static')
 MEDIA_URL = '/image/'
 MEDIA_ROOT = BASE_DIR/'static/image'
 
+STORAGES = {
+    'default': {'BACKEND': 'FashionPlace.storage.HashedMediaStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -149,6 +154,10 @@ REST_FRAMEWORK = {
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
+    "DEFAULT_RENDERER_CLASSES": (
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
     # "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     # "PAGE_SIZE": 4,
 }
@@ -170,4 +179,123 @@ SWAGGER_SETTINGS = {
             'in': 'header'
         }
     }
-}
\ No newline at end of file
+}
+
+
+# Category navigation
+# Seconds a process keeps its cached category tree; edits made through
+# this process are visible immediately.
+
+CATEGORY_CACHE_TTL = config('CATEGORY_CACHE_TTL', default=300, cast=int)
+
+
+# Product facets
+# Default lower bounds of the price buckets and how long computed facet
+# counts are reused for the same filters.
+
+FACET_PRICE_BUCKETS = [0, 25, 50, 100, 200, 500]
+
+FACET_CACHE_TTL = config('FACET_CACHE_TTL', default=30, cast=int)
+
+
+# Product collections
+# Size of the new arrivals / top rated / trending lists and how long a
+# ranked list is kept when none of its products change.
+
+COLLECTION_SIZE = config('COLLECTION_SIZE', default=50, cast=int)
+
+COLLECTION_CACHE_TTL = config('COLLECTION_CACHE_TTL', default=3600, cast=int)
+
+
+# Catalog export
+# Rows fetched and serialized per batch by /products/export/.
+
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+
+# Product image renditions
+# Widths of the WebP/JPEG renditions generated for every product image and
+# the size of the process pool rendering them (0 renders inline).
+
+IMAGE_RENDITION_WIDTHS = [200, 400, 800]
+
+IMAGE_RENDITION_WORKERS = config('IMAGE_RENDITION_WORKERS', default=2, cast=int)
+
+
+# Media serving
+# Cache lifetime of media files without a content hash in their name, and
+# whether to hand files to the fronting server ('x-sendfile' or
+# 'x-accel-redirect', with the internal nginx location for the latter).
+
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=3600, cast=int)
+
+MEDIA_SENDFILE = config('MEDIA_SENDFILE', default='')
+
+MEDIA_SENDFILE_PREFIX = config('MEDIA_SENDFILE_PREFIX', default='/protected-media/')
+
+
+# Fast list serialization
+# Render read-only listings from .values() rows instead of model instances.
+
+FAST_LIST_SERIALIZATION = config('FAST_LIST_SERIALIZATION', default=True, cast=bool)
+
+
+# Bulk cart edits
+# Maximum number of operations accepted by /carts/{cart_pk}/items/bulk/.
+
+BULK_CART_MAX_ITEMS = config('BULK_CART_MAX_ITEMS', default=200, cast=int)
+
+
+# Cart store
+# FashionPlace.carts.DatabaseCartStore writes every cart change as it
+# happens; FashionPlace.carts.BufferedCartStore keeps carts in process
+# memory and writes them in batches (see the README before enabling it).
+
+CART_STORE = config('CART_STORE', default='FashionPlace.carts.DatabaseCartStore')
+CART_STORE_FLUSH_INTERVAL = config('CART_STORE_FLUSH_INTERVAL', default=5, cast=float)
+CART_STORE_MAX_PENDING = config('CART_STORE_MAX_PENDING', default=1000, cast=int)
+CART_STORE_ID_BLOCK = config('CART_STORE_ID_BLOCK', default=100, cast=int)
+
+
+# Abandoned carts
+# Anonymous carts untouched for this many days are deleted by
+# `manage.py reap_carts`.
+
+CART_ABANDONED_DAYS = config('CART_ABANDONED_DAYS', default=30, cast=int)
+
+
+# Idempotency keys
+# Seconds during which a POST retried with the same Idempotency-Key header
+# replays the first response.
+
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=86400, cast=int)
+
+
+# Background tasks
+# Workers started by `manage.py run_workers`, whether they are threads or
+# processes, and how often idle workers look for due tasks. Failed tasks
+# are retried TASK_MAX_ATTEMPTS times in all, TASK_RETRY_BACKOFF seconds
+# after the first failure and twice as long after each of the next ones.
+# Tasks still running after TASK_LOCK_TIMEOUT seconds are given to
+# another worker.
+
+TASK_WORKERS = config('TASK_WORKERS', default=4, cast=int)
+TASK_POOL = config('TASK_POOL', default='thread')
+TASK_POLL_INTERVAL = config('TASK_POLL_INTERVAL', default=1, cast=float)
+TASK_MAX_ATTEMPTS = config('TASK_MAX_ATTEMPTS', default=5, cast=int)
+TASK_RETRY_BACKOFF = config('TASK_RETRY_BACKOFF', default=10, cast=float)
+TASK_RETRY_BACKOFF_MAX = config('TASK_RETRY_BACKOFF_MAX', default=3600, cast=float)
+TASK_LOCK_TIMEOUT = config('TASK_LOCK_TIMEOUT', default=600, cast=int)
+
+
+# Email
+# Order confirmations are printed to the console unless an SMTP server is
+# configured.
+
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='webmaster@localhost')
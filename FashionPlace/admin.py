@@ -37,4 +37,5 @@ admin.site.register(Cart)
 admin.site.register(CartItem)
 admin.site.register(Order)
 admin.site.register(OrderItem)
-admin.site.register(Profile)
\ No newline at end of file
+admin.site.register(Profile)
+admin.site.register(Task)
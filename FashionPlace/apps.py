@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FashionplaceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'FashionPlace'
+
+    def ready(self):
+        from FashionPlace import signals  # noqa: F401
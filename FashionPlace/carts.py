@@ -0,0 +1,458 @@
+"""
+Cart stores: where the carts behind the /carts/ endpoints are written.
+
+`DatabaseCartStore`, the default, writes every change to Cart and
+CartItem as it happens. `BufferedCartStore` keeps the carts it touches in
+process memory and writes them in batches: every
+CART_STORE_FLUSH_INTERVAL seconds, as soon as CART_STORE_MAX_PENDING carts
+are buffered, before one of them is read through the API, at checkout and
+when the process exits. A cart that is created and abandoned between two
+flushes is never written at all.
+
+Line ids are reserved from the CartItem sequence in blocks of
+CART_STORE_ID_BLOCK, so buffered lines are returned with the id they will
+be stored under. The README lists the durability trade-offs.
+"""
+import atexit
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+from django.db import DataError, IntegrityError, connections, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from FashionPlace.models import MAX_QUANTITY, Cart, CartItem, Customer, Product, Profile, QuantityLimitExceeded
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_pk(model, value):
+    """Return `value` as a primary key of `model`, or raise model.DoesNotExist."""
+    try:
+        return model._meta.pk.to_python(value)
+    except ValidationError:
+        raise model.DoesNotExist
+
+
+def parse_cart_id(value):
+    return parse_pk(Cart, value)
+
+
+def empty_cart(cart_id):
+    """A Cart known to have no lines, rendered without querying its items."""
+    cart = Cart(id=cart_id)
+    cart._prefetched_objects_cache = {'items': CartItem.objects.none()}
+    cart.grand_total = 0
+    return cart
+
+
+class CartStore:
+    """
+    The cart writes made through the API. Unknown carts raise
+    Cart.DoesNotExist and unknown lines CartItem.DoesNotExist.
+    """
+
+    def create_cart(self):
+        raise NotImplementedError
+
+    def delete_cart(self, cart_id):
+        raise NotImplementedError
+
+    def add_item(self, cart_id, product_id, quantity):
+        """
+        Add to a line and return it, or None if the product does not exist.
+        May raise QuantityLimitExceeded rather than overflow the line.
+        """
+        raise NotImplementedError
+
+    def set_quantities(self, cart_id, quantities):
+        """Set the quantity of each {product_id: quantity}; 0 removes the line."""
+        raise NotImplementedError
+
+    def update_item(self, cart_id, item_id, quantity):
+        raise NotImplementedError
+
+    def remove_item(self, cart_id, item_id):
+        raise NotImplementedError
+
+    def flush(self, cart_ids=None):
+        """Write the pending changes of the given carts, or of every cart."""
+        return 0
+
+    def close(self, flush=True):
+        """Stop the store, writing or dropping its pending changes."""
+
+
+class DatabaseCartStore(CartStore):
+
+    def create_cart(self):
+        return Cart.objects.create()
+
+    def delete_cart(self, cart_id):
+        deleted, _ = Cart.objects.filter(pk=parse_cart_id(cart_id)).delete()
+        if not deleted:
+            raise Cart.DoesNotExist
+
+    def add_item(self, cart_id, product_id, quantity):
+        cart_id = parse_cart_id(cart_id)
+        # One statement creates the line or increments it, and checks that
+        # the cart and the product exist
+        item = CartItem.objects.add(cart_id, product_id, quantity)
+        # The raw upsert bypasses auto_now; touching the cart doubles as its
+        # existence check
+        if not Cart.objects.filter(pk=cart_id).touch():
+            raise Cart.DoesNotExist
+        return item
+
+    def set_quantities(self, cart_id, quantities):
+        cart_id = parse_cart_id(cart_id)
+        with transaction.atomic():
+            # Touching the cart locks it against concurrent bulk writes
+            if not Cart.objects.filter(pk=cart_id).touch():
+                raise Cart.DoesNotExist
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                    for product_id, quantity in quantities.items()
+                    if quantity > 0
+                ],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity'],
+            )
+            removed = [product_id for product_id, quantity in quantities.items() if quantity == 0]
+            if removed:
+                CartItem.objects.filter(cart_id=cart_id, product_id__in=removed).delete()
+
+    def update_item(self, cart_id, item_id, quantity):
+        cart_id = parse_cart_id(cart_id)
+        item = CartItem.objects.get(cart_id=cart_id, pk=parse_pk(CartItem, item_id))
+        item.quantity = quantity
+        item.save(update_fields=['quantity'])
+        Cart.objects.filter(pk=cart_id).touch()
+        return item
+
+    def remove_item(self, cart_id, item_id):
+        cart_id = parse_cart_id(cart_id)
+        deleted, _ = CartItem.objects.filter(cart_id=cart_id, pk=parse_pk(CartItem, item_id)).delete()
+        if not deleted:
+            raise CartItem.DoesNotExist
+        Cart.objects.filter(pk=cart_id).touch()
+
+
+class PendingCart:
+    """The full state of a buffered cart: its lines by product, and the lines to delete."""
+
+    def __init__(self, cart_id, persisted, lines=()):
+        self.cart_id = cart_id
+        self.persisted = persisted
+        self.lines = {line.product_id: line for line in lines}
+        self.removed = set()
+
+    @classmethod
+    def load(cls, cart_id):
+        if not Cart.objects.filter(pk=cart_id).exists():
+            raise Cart.DoesNotExist
+        return cls(cart_id, True, CartItem.objects.filter(cart_id=cart_id).only('id', 'cart', 'product', 'quantity'))
+
+    def line(self, item_id):
+        item_id = parse_pk(CartItem, item_id)
+        for line in self.lines.values():
+            if line.pk == item_id:
+                return line
+        raise CartItem.DoesNotExist
+
+    def remove(self, line):
+        del self.lines[line.product_id]
+        self.removed.add(line.pk)
+
+
+def copy_line(line):
+    return CartItem(id=line.id, cart_id=line.cart_id, product_id=line.product_id, quantity=line.quantity)
+
+
+class BufferedCartStore(CartStore):
+    """
+    Keeps carts in process memory between flushes. Every request for a
+    cart must reach the same process, so this store suits a single server
+    process or sticky routing; other deployments should keep the database
+    store.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._carts = {}
+        self._ids = []
+        self._flusher = None
+        self._stopped = threading.Event()
+        atexit.register(self.close)
+
+    def _pending(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        cart = self._carts.get(cart_id)
+        if cart is None:
+            cart = self._carts[cart_id] = PendingCart.load(cart_id)
+        return cart
+
+    def _next_id(self):
+        if not self._ids:
+            self._ids = CartItem.objects.reserve_ids(settings.CART_STORE_ID_BLOCK)[::-1]
+        return self._ids.pop()
+
+    def _changed(self):
+        if len(self._carts) >= settings.CART_STORE_MAX_PENDING:
+            self.flush()
+        elif self._flusher is None and settings.CART_STORE_FLUSH_INTERVAL > 0:
+            self._flusher = threading.Thread(target=self._run, name='cart-store-flusher', daemon=True)
+            self._flusher.start()
+
+    def create_cart(self):
+        cart_id = uuid.uuid4()
+        with self._lock:
+            self._carts[cart_id] = PendingCart(cart_id, False)
+            self._changed()
+        return empty_cart(cart_id)
+
+    def delete_cart(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        with self._lock:
+            cart = self._carts.pop(cart_id, None)
+            if cart is not None and not cart.persisted:
+                return
+            deleted, _ = Cart.objects.filter(pk=cart_id).delete()
+        if not deleted:
+            raise Cart.DoesNotExist
+
+    def add_item(self, cart_id, product_id, quantity):
+        with self._lock:
+            cart = self._pending(cart_id)
+            line = cart.lines.get(product_id)
+            if line is None:
+                if not Product.objects.filter(pk=product_id).exists():
+                    return None
+                line = cart.lines[product_id] = CartItem(
+                    id=self._next_id(), cart_id=cart.cart_id, product_id=product_id, quantity=0)
+            if line.quantity + quantity > MAX_QUANTITY:
+                raise QuantityLimitExceeded
+            line.quantity += quantity
+            self._changed()
+            return copy_line(line)
+
+    def set_quantities(self, cart_id, quantities):
+        with self._lock:
+            cart = self._pending(cart_id)
+            for product_id, quantity in quantities.items():
+                line = cart.lines.get(product_id)
+                if quantity == 0:
+                    if line is not None:
+                        cart.remove(line)
+                elif line is None:
+                    cart.lines[product_id] = CartItem(
+                        id=self._next_id(), cart_id=cart.cart_id, product_id=product_id, quantity=quantity)
+                else:
+                    line.quantity = quantity
+            self._changed()
+
+    def update_item(self, cart_id, item_id, quantity):
+        with self._lock:
+            line = self._pending(cart_id).line(item_id)
+            line.quantity = quantity
+            self._changed()
+            return copy_line(line)
+
+    def remove_item(self, cart_id, item_id):
+        with self._lock:
+            cart = self._pending(cart_id)
+            cart.remove(cart.line(item_id))
+            self._changed()
+
+    def flush(self, cart_ids=None):
+        with self._lock:
+            if cart_ids is None:
+                carts = list(self._carts.values())
+            else:
+                carts = []
+                for cart_id in cart_ids:
+                    try:
+                        cart = self._carts.get(parse_cart_id(cart_id))
+                    except Cart.DoesNotExist:
+                        continue
+                    if cart is not None:
+                        carts.append(cart)
+            if not carts:
+                return 0
+            # Carts stay buffered until they are written or dropped as
+            # unwritable, so a failed flush is retried by the next one
+            self._write(carts)
+            for cart in carts:
+                del self._carts[cart.cart_id]
+            return len(carts)
+
+    def _write(self, carts):
+        """
+        Write the carts in one batch. If the database rejects the batch's
+        data, write them again one per savepoint and drop, with an error
+        logged, the carts it still rejects, so that one bad cart does not
+        keep every other one buffered. Other errors, e.g. a lost connection,
+        propagate and leave every cart buffered.
+        """
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    self._write_batch(carts)
+                return
+            except (DataError, IntegrityError):
+                logger.warning("Could not write %d buffered carts at once, writing them one by one", len(carts))
+            for cart in carts:
+                try:
+                    with transaction.atomic():
+                        self._write_batch([cart])
+                except (DataError, IntegrityError):
+                    logger.exception("Dropping buffered cart %s, which could not be written", cart.cart_id)
+
+    def _write_batch(self, carts):
+        lines = [line for cart in carts for line in cart.lines.values()]
+        removed = [item_id for cart in carts for item_id in cart.removed]
+        # Carts or products deleted since they were buffered are dropped
+        # rather than failing the whole batch on a foreign key
+        deleted = {cart.cart_id for cart in carts if cart.persisted} - set(
+            Cart.objects.filter(pk__in=[cart.cart_id for cart in carts if cart.persisted])
+            .values_list('pk', flat=True))
+        products = set(
+            Product.objects.filter(pk__in={line.product_id for line in lines}).values_list('pk', flat=True))
+
+        Cart.objects.bulk_create(
+            [Cart(id=cart.cart_id) for cart in carts if not cart.persisted], ignore_conflicts=True)
+        Cart.objects.filter(pk__in=[cart.cart_id for cart in carts if cart.persisted]).touch()
+        # Removed lines go first: a product removed and added again in
+        # the same batch gets a new line id
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        CartItem.objects.bulk_create(
+            [
+                copy_line(line) for line in lines
+                if line.cart_id not in deleted and line.product_id in products
+            ],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity'],
+        )
+
+    def _run(self):
+        while not self._stopped.wait(settings.CART_STORE_FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not flush the buffered carts")
+            finally:
+                connections.close_all()
+
+    def close(self, flush=True):
+        self._stopped.set()
+        if not flush:
+            with self._lock:
+                self._carts.clear()
+            return
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not flush the buffered carts")
+
+
+def user_cart(user):
+    """Return the open cart of `user`, through their Customer or Profile, creating it if needed."""
+    cart = (
+        Cart.objects.filter(Q(customer__user=user) | Q(profile__user=user), completed=False)
+        .order_by('-updated_at').first()
+    )
+    if cart is None:
+        customer, _ = Customer.objects.get_or_create(user=user)
+        cart = Cart.objects.create(customer=customer, profile=Profile.objects.filter(user=user).first())
+    return cart
+
+
+def merge_cart(user, cart_id=None, session_id=None):
+    """
+    Fold the anonymous cart `cart_id`, or the anonymous carts of
+    `session_id`, into the open cart of `user` and delete them, in one
+    transaction. Quantities of the same product are summed by a single
+    upsert, capped at MAX_QUANTITY. Returns the user's cart, or None when there was nothing to
+    merge.
+    """
+    sources = Cart.objects.filter(customer__isnull=True, profile__isnull=True)
+    if cart_id is not None:
+        sources = sources.filter(pk=cart_id)
+    elif session_id:
+        sources = sources.filter(session_id=session_id)
+    else:
+        return None
+
+    cart_store().flush([cart_id] if cart_id is not None else sources.values_list('pk', flat=True))
+    with transaction.atomic():
+        # Locks the anonymous carts against adds racing with the merge
+        source_ids = list(sources.select_for_update().values_list('pk', flat=True))
+        if not source_ids:
+            return None
+        cart = user_cart(user)
+        cart_store().flush([cart.pk])
+        CartItem.objects.merge(cart.pk, source_ids)
+        Cart.objects.filter(pk__in=source_ids).delete()
+        Cart.objects.filter(pk=cart.pk).touch()
+    return cart
+
+
+def reap_carts(before, batch_size=500):
+    """
+    Delete anonymous carts untouched since `before` with their lines, then
+    orphaned lines, `batch_size` rows per transaction so that no lock is
+    held for long. Yields the (carts, lines) deleted by each batch.
+
+    Each batch re-checks its rows when deleting them, so a cart touched or
+    a line refilled in the meantime is kept. Where the database supports
+    it, carts locked by a request in flight are skipped.
+    """
+    connection = connections[Cart.objects.db]
+    while True:
+        with transaction.atomic():
+            carts = Cart.objects.abandoned(before).order_by('updated_at')
+            if connection.features.has_select_for_update_skip_locked:
+                carts = carts.select_for_update(skip_locked=True)
+            cart_ids = list(carts.values_list('pk', flat=True)[:batch_size])
+            if not cart_ids:
+                break
+            _, deleted = Cart.objects.abandoned(before).filter(pk__in=cart_ids).delete()
+        yield deleted.get(Cart._meta.label, 0), deleted.get(CartItem._meta.label, 0)
+
+    while True:
+        with transaction.atomic():
+            item_ids = list(CartItem.objects.orphaned().order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not item_ids:
+                break
+            deleted, _ = CartItem.objects.orphaned().filter(pk__in=item_ids).delete()
+        yield 0, deleted
+
+
+_store = None
+
+
+def cart_store():
+    """Return the CART_STORE instance of this process."""
+    global _store
+    if _store is None:
+        _store = import_string(settings.CART_STORE)()
+    return _store
+
+
+@receiver(setting_changed)
+def reset_cart_store(setting, **kwargs):
+    global _store
+    # Settings only change under tests, whose buffered carts are thrown away
+    if setting.startswith('CART_STORE') and _store is not None:
+        _store.close(flush=False)
+        _store = None
@@ -0,0 +1,196 @@
+"""
+Maintenance of the CatalogEntry read model, of the catalog version used
+for conditional GET on the catalog endpoints, of the cached category
+tree and of the pre-ranked product collections.
+"""
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+
+from FashionPlace.models import CatalogEntry, CatalogVersion, Category, Product
+
+
+ENTRY_FIELDS = ['name', 'price', 'image', 'categories', 'new_arrivals', 'top_rated', 'trending']
+
+
+def build_entry(product):
+    """Build the CatalogEntry for a product whose categories are prefetched."""
+    return CatalogEntry(
+        product_id=product.pk,
+        name=product.name,
+        price=product.price,
+        image=product.image.name or '',
+        categories=[
+            {'id': category.id, 'name': category.name, 'slug': category.slug}
+            for category in product.category.all()
+        ],
+        new_arrivals=product.new_arrivals,
+        top_rated=product.top_rated,
+        trending=product.trending,
+    )
+
+
+def refresh_entries(product_ids):
+    """Upsert the catalog entries of the given products in two queries plus the write."""
+    products = Product.objects.filter(pk__in=list(product_ids)).prefetch_related('category')
+    entries = [build_entry(product) for product in products]
+    if entries:
+        CatalogEntry.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=ENTRY_FIELDS,
+        )
+    return len(entries)
+
+
+def rebuild_entries(chunk_size=1000):
+    """
+    Refresh every catalog entry, walking products by primary key in chunks
+    so that memory stays bounded. Yields the number of entries written per
+    chunk.
+    """
+    last_pk = None
+    while True:
+        products = Product.objects.order_by('pk')
+        if last_pk is not None:
+            products = products.filter(pk__gt=last_pk)
+        product_ids = list(products.values_list('pk', flat=True)[:chunk_size])
+        if not product_ids:
+            return
+        yield refresh_entries(product_ids)
+        last_pk = product_ids[-1]
+
+
+def bump_version():
+    """Record a deletion, which no remaining `updated_at` can reflect."""
+    updated = CatalogVersion.objects.filter(pk=1).update(
+        deletions=F('deletions') + 1, deleted_at=timezone.now())
+    if not updated:
+        CatalogVersion.objects.create(pk=1, deletions=1, deleted_at=timezone.now())
+
+
+def touch_products(product_ids):
+    """Advance `updated_at` for products whose categories changed."""
+    Product.objects.filter(pk__in=list(product_ids)).update(updated_at=timezone.now())
+
+
+def current_version():
+    """
+    Return `(token, last_modified)` for the whole catalog in one query: the
+    newest product and category `updated_at` (both indexed) and the
+    deletion counter.
+    """
+    newest_product = Product.objects.order_by('-updated_at').values('updated_at')[:1]
+    newest_category = Category.objects.order_by('-updated_at').values('updated_at')[:1]
+    version = (
+        CatalogVersion.objects
+        .filter(pk=1)
+        .annotate(product_at=Subquery(newest_product), category_at=Subquery(newest_category))
+        .values_list('deletions', 'deleted_at', 'product_at', 'category_at')
+    )
+    row = version.first()
+    if row is None:
+        CatalogVersion.objects.get_or_create(pk=1)
+        row = version.first()
+
+    stamps = [stamp for stamp in row[1:] if stamp is not None]
+    token = ':'.join(str(value) for value in row)
+    return token, max(stamps) if stamps else None
+
+
+CategoryTree = namedtuple('CategoryTree', ['categories', 'etag', 'last_modified', 'expires'])
+
+
+class CategoryTreeCache:
+    """
+    Process-local cache of every category, shared by the `category_links`
+    context processor and the category listing.
+
+    Entries live for `CATEGORY_CACHE_TTL` seconds. Category saves and
+    deletes clear it immediately and again once their transaction commits,
+    so this process never keeps serving a stale tree after an admin edit;
+    other processes catch up within the TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'CATEGORY_CACHE_TTL', 300)
+
+    def get(self):
+        tree = self._tree
+        if tree is not None and tree.expires > time.monotonic():
+            return tree
+        with self._lock:
+            tree = self._tree
+            if tree is None or tree.expires <= time.monotonic():
+                tree = self._tree = self._load()
+            return tree
+
+    def clear(self):
+        self._tree = None
+
+    def invalidate(self):
+        self.clear()
+        transaction.on_commit(self.clear)
+
+    def _load(self):
+        categories = list(Category.objects.order_by('id'))
+        deleted_at = CatalogVersion.objects.filter(pk=1).values_list('deleted_at', flat=True).first()
+
+        stamps = [category.updated_at for category in categories]
+        if deleted_at is not None:
+            stamps.append(deleted_at)
+        digest = hashlib.sha1(repr([
+            (category.id, category.name, category.slug, category.updated_at) for category in categories
+        ]).encode('utf-8')).hexdigest()
+
+        return CategoryTree(
+            categories=categories,
+            etag=digest,
+            last_modified=max(stamps) if stamps else None,
+            expires=time.monotonic() + self.ttl,
+        )
+
+
+category_cache = CategoryTreeCache()
+
+
+def _collection_key(name, version):
+    digest = hashlib.sha1(version.encode('utf-8')).hexdigest()
+    return 'product-collection:%s:%s' % (name, digest)
+
+
+def collection_ids(name, version=None):
+    """
+    Return the ranked product ids of a collection, newest first, so that
+    editing a product does not move it (there is no per-product rating or
+    sales signal to rank by). The list is computed from the collection's
+    partial index and cached under the catalog `version` token it was
+    computed at, so every process sharing the cache stops serving it as
+    soon as the catalog changes, whatever cache backend is configured.
+    """
+    if version is None:
+        version, _ = current_version()
+    key = _collection_key(name, version)
+    product_ids = cache.get(key)
+    if product_ids is None:
+        size = getattr(settings, 'COLLECTION_SIZE', 50)
+        product_ids = list(
+            Product.objects.filter(**{name: True})
+            .order_by('-created_at', 'product_id')
+            .values_list('pk', flat=True)[:size]
+        )
+        cache.set(key, product_ids, getattr(settings, 'COLLECTION_CACHE_TTL', 3600))
+    return product_ids
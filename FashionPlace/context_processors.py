@@ -1,6 +1,5 @@
-from FashionPlace.models import *
+from FashionPlace.catalog import category_cache
 
 
 def category_links(request):
-    category = Category.objects.all()
-    return {'categories': category}
\ No newline at end of file
+    return {'categories': category_cache.get().categories}
\ No newline at end of file
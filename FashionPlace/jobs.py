@@ -0,0 +1,30 @@
+"""
+Work queued by FashionPlace.signals and run by `manage.py run_workers`
+instead of in the request.
+"""
+from django.conf import settings
+from django.core.mail import send_mail
+
+from FashionPlace.models import Order
+from FashionPlace.tasks import task
+
+
+@task
+def send_order_confirmation(order_id):
+    order = (
+        Order.objects.select_related('owner')
+        .prefetch_related('items__product')
+        .filter(pk=order_id)
+        .first()
+    )
+    if order is None or not order.owner.email:
+        # Deleted before it could be confirmed
+        return
+    lines = ['%d x %s at %d' % (item.quantity, item.product.name, item.unit_price) for item in order.items.all()]
+    send_mail(
+        'Your FashionPlace order #%d' % order.pk,
+        'Thank you for your order.\n\n%s\n\nTotal: %d\n' % ('\n'.join(lines), order.total),
+        settings.DEFAULT_FROM_EMAIL,
+        [order.owner.email],
+    )
+
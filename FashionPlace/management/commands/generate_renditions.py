@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from FashionPlace.models import Product
+from FashionPlace.renditions import has_renditions, render_renditions, rendition_job, renditions_written
+
+
+class Command(BaseCommand):
+    help = "Generate the WebP and JPEG renditions of product images in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Worker processes, IMAGE_RENDITION_WORKERS by default; 0 renders inline.")
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Regenerate renditions that already exist.")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if workers is None:
+            workers = settings.IMAGE_RENDITION_WORKERS
+        if workers < 0:
+            raise CommandError("--workers cannot be negative")
+
+        started = time.monotonic()
+        names = (
+            Product.objects.exclude(image='').order_by('image')
+            .values_list('image', flat=True).distinct().iterator()
+        )
+        jobs = [
+            job for job in (rendition_job(name) for name in names
+                            if options['force'] or not has_renditions(name))
+            if job is not None
+        ]
+
+        rendered, failed = [], 0
+        for job, error in self.render(jobs, workers):
+            if error is not None:
+                failed += 1
+                self.stderr.write("Could not render %s: %s" % (job[2], error))
+                continue
+            rendered.append(job[2])
+            if options['verbosity'] > 1:
+                self.stdout.write("Rendered %s" % job[2])
+        renditions_written(rendered)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Rendered %d images (%d failed) in %.2fs" % (len(rendered), failed, elapsed)))
+
+    def render(self, jobs, workers):
+        """Yield (job, exception or None) as the renditions are written."""
+        if not workers:
+            for job in jobs:
+                try:
+                    render_renditions(*job)
+                except Exception as error:
+                    yield job, error
+                else:
+                    yield job, None
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(render_renditions, *job) for job in jobs]
+            for job, future in zip(jobs, futures):
+                yield job, future.exception()
@@ -0,0 +1,238 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+
+from FashionPlace.catalog import category_cache
+from FashionPlace.models import Category, Product
+from FashionPlace.signals import products_changed
+
+
+FLAGS = ['new_arrivals', 'top_rated', 'trending']
+
+UPSERT_FIELDS = ['name', 'price', 'image', 'new_arrivals', 'top_rated', 'trending', 'updated_at']
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+
+# Product.price is an IntegerField; SQLite would store larger values, which
+# PostgreSQL then rejects with the whole chunk
+PRICE_RANGE = BaseDatabaseOperations.integer_field_ranges['IntegerField']
+
+
+def read_csv(handle):
+    """Yield (line number, row) for every CSV record."""
+    reader = csv.DictReader(handle)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(handle):
+    """
+    Yield (line number, row) for every non-blank line. A line that is not a
+    JSON object yields the ValueError describing it in place of the row,
+    so that it is skipped like any other invalid row.
+    """
+    for number, line in enumerate(handle, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as error:
+            row = ValueError("invalid JSON: %s" % error)
+        else:
+            if not isinstance(row, dict):
+                row = ValueError("expected a JSON object, got %s" % type(row).__name__)
+        yield number, row
+
+
+def parse_flag(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+def check_length(field_name, value):
+    max_length = Product._meta.get_field(field_name).max_length
+    if len(value) > max_length:
+        raise ValueError("%s is longer than %d characters" % (field_name, max_length))
+    return value
+
+
+def parse_price(value):
+    price = int(value or 0)
+    if not PRICE_RANGE[0] <= price <= PRICE_RANGE[1]:
+        raise ValueError("price %d is out of range" % price)
+    return price
+
+
+def parse_categories(value):
+    """Category slugs from a '|' separated string (CSV, or JSONL) or a list of slugs (JSONL)."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        slugs = value.split('|')
+    elif isinstance(value, list) and all(isinstance(slug, str) for slug in value):
+        slugs = value
+    else:
+        raise ValueError("categories must be a list of slugs or a '|' separated string")
+    return [slug.strip() for slug in slugs if slug.strip()]
+
+
+class CategoryResolver:
+    """
+    Cached slug -> Category id lookup. Unknown slugs are looked up once per
+    chunk in a single IN query and, if asked to, created in bulk.
+    """
+
+    def __init__(self, create_missing=False):
+        self.create_missing = create_missing
+        self.ids = {}
+        self.unknown = set()
+
+    def resolve(self, slugs):
+        missing = {slug for slug in slugs if slug not in self.ids and slug not in self.unknown}
+        if missing:
+            found = dict(Category.objects.filter(slug__in=missing).values_list('slug', 'id'))
+            self.ids.update(found)
+            missing -= set(found)
+        if missing and self.create_missing:
+            Category.objects.bulk_create(
+                [Category(name=slug.replace('-', ' ').title(), slug=slug) for slug in sorted(missing)],
+                ignore_conflicts=True,
+            )
+            self.ids.update(Category.objects.filter(slug__in=missing).values_list('slug', 'id'))
+            missing -= set(self.ids)
+            category_cache.invalidate()
+        self.unknown |= missing
+        return self.ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream products from a CSV or JSONL file into the catalog in chunks. "
+        "Columns: sku, name, price, image, categories (slugs, '|' separated in CSV, "
+        "a list or a '|' separated string in JSONL), new_arrivals, top_rated, trending. Rows with a SKU are "
+        "upserted by SKU and their categories replaced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file to import.")
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help="Input format, guessed from the file extension by default.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Number of rows written per transaction.")
+        parser.add_argument(
+            '--create-categories', action='store_true',
+            help="Create categories for unknown slugs instead of skipping them.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        reader = read_jsonl if file_format == 'jsonl' else read_csv
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        self.resolver = CategoryResolver(create_missing=options['create_categories'])
+        self.skipped = 0
+        imported = 0
+        started = time.monotonic()
+
+        try:
+            handle = open(path, newline='', encoding='utf-8')
+        except OSError as error:
+            raise CommandError(str(error))
+
+        with handle:
+            rows = reader(handle)
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                imported += self.import_chunk(chunk)
+                if options['verbosity'] > 1:
+                    elapsed = time.monotonic() - started
+                    self.stdout.write("%d products, %.0f rows/s" % (imported, imported / max(elapsed, 1e-6)))
+
+        elapsed = time.monotonic() - started
+        if self.resolver.unknown:
+            self.stderr.write("Unknown categories skipped: %s" % ', '.join(sorted(self.resolver.unknown)))
+        self.stdout.write(self.style.SUCCESS(
+            "Imported %d products (%d rows skipped) in %.2fs, %.0f rows/s"
+            % (imported, self.skipped, elapsed, imported / max(elapsed, 1e-6))))
+
+    def build_line(self, number, row):
+        """Return (product, category slugs) for a row, or None if the row is skipped."""
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            name = row.get('name')
+            name = str(name).strip() if name is not None else ''
+            if not name:
+                raise ValueError("name is missing")
+            product = Product(
+                sku=check_length('sku', str(row.get('sku') or '').strip()) or None,
+                name=name[:100],
+                price=parse_price(row.get('price')),
+                image=check_length('image', str(row.get('image') or '')),
+                **{flag: parse_flag(row.get(flag)) for flag in FLAGS}
+            )
+            return product, parse_categories(row.get('categories'))
+        except (TypeError, ValueError) as error:
+            self.skipped += 1
+            self.stderr.write("Skipping line %d: %s" % (number, error))
+            return None
+
+    def import_chunk(self, chunk):
+        with_sku, without_sku = {}, []
+        for number, row in chunk:
+            line = self.build_line(number, row)
+            if line is None:
+                continue
+            product, slugs = line
+            if product.sku:
+                # The last row wins when a SKU repeats within a chunk
+                with_sku[product.sku] = (product, slugs)
+            else:
+                without_sku.append((product, slugs))
+
+        lines = list(with_sku.values()) + without_sku
+        category_ids = self.resolver.resolve({slug for _, slugs in lines for slug in slugs})
+
+        with transaction.atomic():
+            if with_sku:
+                Product.objects.bulk_create(
+                    [product for product, _ in with_sku.values()],
+                    update_conflicts=True,
+                    unique_fields=['sku'],
+                    update_fields=UPSERT_FIELDS,
+                )
+                # Rows that hit an existing SKU keep their original primary key
+                existing = dict(Product.objects.filter(sku__in=list(with_sku)).values_list('sku', 'pk'))
+                for sku, (product, _) in with_sku.items():
+                    product.pk = existing[sku]
+            if without_sku:
+                Product.objects.bulk_create([product for product, _ in without_sku])
+
+            product_ids = [product.pk for product, _ in lines]
+            Through = Product.category.through
+            Through.objects.filter(product_id__in=[product.pk for product, _ in with_sku.values()]).delete()
+            Through.objects.bulk_create(
+                [
+                    Through(product_id=product.pk, category_id=category_ids[slug])
+                    for product, slugs in lines
+                    for slug in set(slugs)
+                    if slug in category_ids
+                ],
+                ignore_conflicts=True,
+            )
+            products_changed(product_ids)
+
+        return len(lines)
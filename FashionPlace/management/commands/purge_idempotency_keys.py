@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from FashionPlace.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete the idempotency keys older than IDEMPOTENCY_KEY_TTL."
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        deleted, _ = IdempotencyKey.objects.expired(before).delete()
+        self.stdout.write(self.style.SUCCESS("Deleted %d idempotency keys" % deleted))
@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from FashionPlace.carts import reap_carts
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned anonymous carts and orphaned cart lines in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help="Age in days of the last change of a cart to reap, CART_ABANDONED_DAYS by default.")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of carts or lines deleted per transaction.")
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help="Seconds to pause between batches.")
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = settings.CART_ABANDONED_DAYS
+        if days < 0 or options['batch_size'] < 1:
+            raise CommandError("--days cannot be negative and --batch-size must be positive")
+
+        started = time.monotonic()
+        carts = items = 0
+        for deleted_carts, deleted_items in reap_carts(
+                timezone.now() - timedelta(days=days), batch_size=options['batch_size']):
+            carts += deleted_carts
+            items += deleted_items
+            if options['verbosity'] > 1:
+                self.stdout.write("Deleted %d carts and %d lines" % (carts, items))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Deleted %d carts and %d lines in %.2fs (%d rows/s)" % (
+                carts, items, elapsed, (carts + items) / elapsed if elapsed else 0)))
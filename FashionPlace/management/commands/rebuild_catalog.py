@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from FashionPlace.catalog import rebuild_entries
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized product catalog read table in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help="Number of products loaded and written per batch.")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        total = 0
+        for written in rebuild_entries(chunk_size=options['chunk_size']):
+            total += written
+            if options['verbosity'] > 1:
+                self.stdout.write("Refreshed %d entries" % total)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt %d catalog entries in %.2fs" % (total, elapsed)))
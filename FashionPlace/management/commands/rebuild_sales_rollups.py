@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from FashionPlace.sales import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily and per-category sales rollups from the orders, in one transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of orders counted per query batch.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+
+        started = time.monotonic()
+        counted = 0
+        for counted in rebuild(batch_size=options['batch_size']):
+            if options['verbosity'] > 1:
+                self.stdout.write("Counted %d orders" % counted)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt the sales rollups from %d orders in %.2fs" % (counted, time.monotonic() - started)))
@@ -0,0 +1,63 @@
+import multiprocessing
+import signal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from FashionPlace.tasks import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks in a pool of threads or processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help="Number of tasks run at the same time, TASK_WORKERS by default.")
+        parser.add_argument(
+            '--pool', choices=['thread', 'process'], default=None,
+            help="Run tasks in threads or in processes, TASK_POOL by default.")
+        parser.add_argument(
+            '--poll-interval', type=float, default=None,
+            help="Seconds between looks for due tasks when idle, TASK_POLL_INTERVAL by default.")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Exit once no task is due instead of waiting for more, e.g. when run from cron.")
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or settings.TASK_WORKERS
+        pool = options['pool'] or settings.TASK_POOL
+        poll_interval = options['poll_interval']
+        if poll_interval is None:
+            poll_interval = settings.TASK_POLL_INTERVAL
+        if workers < 1 or poll_interval < 0 or pool not in ('thread', 'process'):
+            raise CommandError("--workers must be positive, --poll-interval not negative "
+                               "and --pool thread or process")
+
+        if pool == 'process':
+            # Fresh processes rather than forks, which would share this
+            # process's database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='task')
+
+        worker = Worker(executor, workers, poll_interval=poll_interval, once=options['once'])
+        if not options['once']:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *args: worker.stop())
+            self.stdout.write("Running tasks in %d %ss as %s" % (workers, pool, worker.name))
+
+        with executor:
+            stats = worker.run()
+
+        for row in stats.rows():
+            self.stdout.write(
+                "%(name)s: %(runs)d runs, %(failures)d failed, "
+                "%(mean_ms).1f ms mean, %(p95_ms).1f ms p95, %(max_ms).1f ms max" % row)
+        self.stdout.write(self.style.SUCCESS(
+            "Ran %d tasks" % sum(row['runs'] for row in stats.rows())))
@@ -0,0 +1,171 @@
+"""
+Serve MEDIA_ROOT files with caching headers and byte-range support.
+
+Content-hashed names (see `FashionPlace.storage`) never change, so they
+are served with a one year `immutable` Cache-Control and browsers or CDNs
+never ask for them again. Other files get MEDIA_CACHE_MAX_AGE and are
+revalidated with their ETag. Files are streamed through FileResponse, or
+handed to the fronting server when MEDIA_SENDFILE is set to
+'x-sendfile' (Apache, lighttpd) or 'x-accel-redirect' (nginx).
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from FashionPlace.storage import name_hash
+
+
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+
+class RangeFile:
+    """Read at most `length` bytes of `file` starting at `start`."""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def media_etag(name, stat):
+    digest = name_hash(name)
+    if digest:
+        # Stable across servers, unlike the modification time
+        return quote_etag('%s-%x' % (digest, stat.st_size))
+    return quote_etag('%x-%x' % (stat.st_size, stat.st_mtime_ns))
+
+
+def cache_control(name):
+    if name_hash(name):
+        return 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    return 'public, max-age=%d' % settings.MEDIA_CACHE_MAX_AGE
+
+
+def parse_range(header, size):
+    """
+    Return the (start, end) of a single `bytes=` range, inclusive, None for
+    a header that should be ignored, or raise ValueError when the range
+    cannot be satisfied. Multiple ranges are answered with the whole file.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.group('start'), match.group('end')
+    if not start:
+        if not end:
+            return None
+        # Suffix range: the last `end` bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def sendfile_response(name, path, content_type):
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        # nginx takes a URI and decodes it, so names with spaces, '%', '?'
+        # or non-ASCII characters must be percent-encoded
+        response['X-Accel-Redirect'] = quote(posixpath.join(settings.MEDIA_SENDFILE_PREFIX, name), safe='/')
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def file_response(request, path, size, etag):
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    # A stale If-Range validator means the client gets the whole new file
+    if range_header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    handle = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(handle, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangeFile(handle, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = media_etag(name, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control(name),
+    }
+
+    if not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_SENDFILE:
+        # The fronting server handles ranges itself
+        content_type, _ = mimetypes.guess_type(full_path)
+        response = sendfile_response(name, full_path, content_type or 'application/octet-stream')
+    else:
+        response = file_response(request, full_path, stat.st_size, etag)
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
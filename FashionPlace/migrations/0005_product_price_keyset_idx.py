@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0004_cart_profile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'product_id'], name='product_price_keyset_idx'),
+        ),
+    ]
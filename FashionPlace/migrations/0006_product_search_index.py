@@ -0,0 +1,66 @@
+import uuid
+
+from django.db import migrations
+
+
+def sqlite_rowid(product_id):
+    return int.from_bytes(uuid.UUID(str(product_id)).bytes[:8], 'big', signed=True)
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE "FashionPlace_productsearch" USING fts5('
+            'product_id UNINDEXED, name, categories, '
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE "FashionPlace_productsearch" ('
+            'product_id uuid PRIMARY KEY REFERENCES "FashionPlace_product" (product_id) '
+            'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX "FashionPlace_productsearch_document_gin" '
+            'ON "FashionPlace_productsearch" USING GIN (document)'
+        )
+    else:
+        return
+
+    Product = apps.get_model('FashionPlace', 'Product')
+    rows = []
+    for product in Product.objects.prefetch_related('category').iterator(chunk_size=2000):
+        categories = ' '.join(category.name for category in product.category.all())
+        rows.append((product.pk, product.name, categories))
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.executemany(
+                'INSERT INTO "FashionPlace_productsearch" (rowid, product_id, name, categories) '
+                'VALUES (%s, %s, %s, %s)',
+                [(sqlite_rowid(pk), pk.hex, name, categories) for pk, name, categories in rows],
+            )
+        else:
+            cursor.executemany(
+                'INSERT INTO "FashionPlace_productsearch" (product_id, document) VALUES '
+                "(%s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B'))",
+                rows,
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS "FashionPlace_productsearch"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0005_product_price_keyset_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2 on 2026-10-18 15:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_catalog(apps, schema_editor):
+    Product = apps.get_model('FashionPlace', 'Product')
+    CatalogEntry = apps.get_model('FashionPlace', 'CatalogEntry')
+    entries = []
+    for product in Product.objects.prefetch_related('category').iterator(chunk_size=1000):
+        entries.append(CatalogEntry(
+            product_id=product.pk,
+            name=product.name,
+            price=product.price,
+            image=product.image.name or '',
+            categories=[
+                {'id': category.id, 'name': category.name, 'slug': category.slug}
+                for category in product.category.all()
+            ],
+            new_arrivals=product.new_arrivals,
+            top_rated=product.top_rated,
+            trending=product.trending,
+        ))
+    CatalogEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0006_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_entry', serialize=False, to='FashionPlace.product')),
+                ('name', models.CharField(max_length=100)),
+                ('price', models.IntegerField()),
+                ('image', models.CharField(blank=True, max_length=100)),
+                ('categories', models.JSONField(default=list)),
+                ('new_arrivals', models.BooleanField(default=False)),
+                ('top_rated', models.BooleanField(default=False)),
+                ('trending', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['price', 'product'], name='catalog_price_keyset_idx'),
+        ),
+        migrations.RunPython(populate_catalog, migrations.RunPython.noop),
+    ]
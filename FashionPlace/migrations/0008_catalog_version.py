@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 15:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_catalog_version(apps, schema_editor):
+    CatalogVersion = apps.get_model('FashionPlace', 'CatalogVersion')
+    CatalogVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0007_catalogentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deletions', models.PositiveIntegerField(default=0)),
+                ('deleted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(create_catalog_version, migrations.RunPython.noop),
+    ]
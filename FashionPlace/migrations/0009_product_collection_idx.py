@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0008_catalog_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('new_arrivals', True)), fields=['-updated_at', '-product_id'], name='product_new_arrivals_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('top_rated', True)), fields=['-updated_at', '-product_id'], name='product_top_rated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('trending', True)), fields=['-updated_at', '-product_id'], name='product_trending_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 16:26
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Fold duplicate (cart, product) lines into the oldest one, summing quantities."""
+    CartItem = apps.get_model('FashionPlace', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(lines=Count('id'), keep=Min('id'), quantity=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates:
+        lines = CartItem.objects.filter(cart_id=duplicate['cart_id'], product_id=duplicate['product_id'])
+        lines.exclude(id=duplicate['keep']).delete()
+        lines.filter(id=duplicate['keep']).update(quantity=duplicate['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0010_product_sku'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartitem_unique_cart_product'),
+        ),
+    ]
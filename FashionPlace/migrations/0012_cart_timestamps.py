@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 16:24
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0011_cartitem_unique_cart_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('customer__isnull', True), ('profile__isnull', True)), fields=['updated_at'], name='cart_anonymous_updated_idx'),
+        ),
+    ]
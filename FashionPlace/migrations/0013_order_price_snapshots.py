@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 16:27
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def snapshot_prices(apps, schema_editor):
+    """Give existing order lines the current product price, and orders their total."""
+    Order = apps.get_model('FashionPlace', 'Order')
+    OrderItem = apps.get_model('FashionPlace', 'OrderItem')
+    Product = apps.get_model('FashionPlace', 'Product')
+    OrderItem.objects.update(unit_price=Subquery(
+        Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]))
+    totals = (
+        OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+        .annotate(total=Sum(F('quantity') * F('unit_price'))).values('total')
+    )
+    Order.objects.update(total=Coalesce(Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0012_cart_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(snapshot_prices, migrations.RunPython.noop),
+    ]
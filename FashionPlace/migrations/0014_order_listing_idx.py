@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0013_order_price_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['owner', '-placed_at', '-id'], name='order_owner_placed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-placed_at', '-id'], name='order_placed_idx'),
+        ),
+    ]
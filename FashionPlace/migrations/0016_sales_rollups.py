@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-18 16:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0015_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=50)),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=50)),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailysales',
+            constraint=models.UniqueConstraint(fields=('day', 'status'), name='daily_sales_day_status_uniq'),
+        ),
+        migrations.AddField(
+            model_name='categorysales',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='FashionPlace.category'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorysales',
+            constraint=models.UniqueConstraint(fields=('day', 'category', 'status'), name='category_sales_uniq'),
+        ),
+    ]
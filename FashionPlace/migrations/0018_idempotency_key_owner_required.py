@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 17:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_anonymous_keys(apps, schema_editor):
+    IdempotencyKey = apps.get_model('FashionPlace', 'IdempotencyKey')
+    IdempotencyKey.objects.filter(owner__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0017_task_queue'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='idempotencykey',
+            name='idempotency_anonymous_key_uniq',
+        ),
+        migrations.RunPython(delete_anonymous_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+def count_existing_orders(apps, schema_editor):
+    # The rollups are taken to count every existing order under its status,
+    # as rebuild_sales_rollups leaves them
+    Order = apps.get_model('FashionPlace', 'Order')
+    Order.objects.update(sales_status=models.F('pending_status'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0018_idempotency_key_owner_required'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='sales_status',
+            field=models.CharField(blank=True, editable=False, max_length=50, null=True),
+        ),
+        migrations.RunPython(count_existing_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_sales_status(apps, schema_editor):
+    Order = apps.get_model('FashionPlace', 'Order')
+    SalesStatus = apps.get_model('FashionPlace', 'SalesStatus')
+    SalesStatus.objects.bulk_create(
+        SalesStatus(order_id=order_id, status=status)
+        for order_id, status in Order.objects.filter(counted_status__isnull=False).values_list('id', 'counted_status')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0019_order_sales_status'),
+    ]
+
+    operations = [
+        # Out of the way of the reverse accessor of SalesStatus.order
+        migrations.RenameField(
+            model_name='order',
+            old_name='sales_status',
+            new_name='counted_status',
+        ),
+        migrations.CreateModel(
+            name='SalesStatus',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_status', serialize=False, to='FashionPlace.order')),
+                ('status', models.CharField(max_length=50)),
+            ],
+        ),
+        migrations.RunPython(copy_sales_status, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='order',
+            name='counted_status',
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_created_at(apps, schema_editor):
+    # The last update is the closest record of when existing products were added
+    Product = apps.get_model('FashionPlace', 'Product')
+    Product.objects.update(created_at=models.F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('FashionPlace', '0020_sales_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_new_arrivals_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_top_rated_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_trending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('new_arrivals', True)), fields=['-created_at', 'product_id'], name='product_new_arrivals_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('top_rated', True)), fields=['-created_at', 'product_id'], name='product_top_rated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('trending', True)), fields=['-created_at', 'product_id'], name='product_trending_idx'),
+        ),
+    ]
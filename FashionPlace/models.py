@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import IntegrityError, NotSupportedError, connections, models, transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import uuid
 from django.db.models.lookups import IntegerFieldFloatRounding
 from  django.conf import settings
@@ -82,36 +86,11 @@ class Profile(models.Model):
     def __str__(self):
         return self.username
 
-@receiver(post_delete, sender=Profile)
-def delete_related_orders(sender, instance, **kwargs):
-    user = instance.user
-    
-    # Delete related orders and items for the user's customer
-    orders = Order.objects.filter(owner=user)
-    for order in orders:
-        order_items = OrderItem.objects.filter(order=order)
-        order_items.delete()
-        order.delete()
-
-    # Delete related cart items and the cart
-    try:
-        cart = Cart.objects.get(profile=instance)
-        cart_items = CartItem.objects.filter(cart=cart)
-        cart_items.delete()
-        cart.delete()
-    except Cart.DoesNotExist:
-        pass
-
-    # Delete the associated user's customer
-    if user.customer:
-        user.customer.delete()
-
-    user.delete()
-
 
 class Category(models.Model):
     name = models.CharField('Categories', max_length=255)
     slug = models.SlugField('Slug', max_length=255, unique=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return self.name
@@ -126,32 +105,275 @@ class Product(models.Model):
     new_arrivals = models.BooleanField(default=False)
     top_rated= models.BooleanField(default=False)
     trending = models.BooleanField(default=False)
+    sku = models.CharField('SKU', max_length=64, unique=True, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'product_id'], name='product_price_keyset_idx'),
+            models.Index(fields=['-created_at', 'product_id'], condition=models.Q(new_arrivals=True),
+                         name='product_new_arrivals_idx'),
+            models.Index(fields=['-created_at', 'product_id'], condition=models.Q(top_rated=True),
+                         name='product_top_rated_idx'),
+            models.Index(fields=['-created_at', 'product_id'], condition=models.Q(trending=True),
+                         name='product_trending_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class CatalogVersion(models.Model):
+    """
+    Single row bumped whenever a product or category is deleted.
+
+    Together with the newest Product/Category `updated_at` it versions the
+    whole catalog for conditional GET; deletions leave no timestamp behind,
+    so they are counted here instead.
+    """
+    deletions = models.PositiveIntegerField(default=0)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return str(self.deletions)
+
+
+class CatalogEntry(models.Model):
+    """
+    Denormalized read model of a product, its categories and its flags.
+
+    One row per product, maintained by the receivers in FashionPlace.signals
+    and rebuilt in bulk with `manage.py rebuild_catalog`. The product
+    listing reads from this table only, so it never joins through the
+    category M2M.
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='catalog_entry')
+    name = models.CharField(max_length=100)
+    price = models.IntegerField()
+    image = models.CharField(max_length=100, blank=True)
+    categories = models.JSONField(default=list)
+    new_arrivals = models.BooleanField(default=False)
+    top_rated = models.BooleanField(default=False)
+    trending = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'product'], name='catalog_price_keyset_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate each cart with the `grand_total` of its lines, computed in SQL."""
+        return self.annotate(grand_total=Coalesce(Sum(F('items__quantity') * F('items__product__price')), 0))
+
+    def touch(self):
+        """Record a change to the carts' lines, which `auto_now` does not see."""
+        return self.update(updated_at=timezone.now())
+
+    def abandoned(self, before):
+        """Anonymous carts left untouched since `before`."""
+        return self.filter(customer__isnull=True, profile__isnull=True, updated_at__lt=before)
+
+
 class Cart(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null = True, blank=True)
     profile = models.ForeignKey(Profile, on_delete=models.CASCADE, null = True, blank=True)
     id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False, primary_key=True)
     completed = models.BooleanField(default=False)
     session_id = models.CharField(max_length=100, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], condition=models.Q(customer__isnull=True, profile__isnull=True),
+                         name='cart_anonymous_updated_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
 
     @property
     def get_cart_total(self):
-        cartitems = self.items.all()
-        total = sum([item.get_total for item in cartitems])
-        return total
+        if hasattr(self, 'grand_total'):
+            return self.grand_total
+        return self.items.aggregate(
+            total=Coalesce(Sum(F('quantity') * F('product__price')), 0))['total']
     
     @property
     def get_cart_item(self):
-        cartitems = self.items.all()
-        total = sum(item.quantity for item in cartitems)
-        return total
+        return self.items.aggregate(count=Coalesce(Sum('quantity'), 0))['count']
+
+
+# Upper bound of CartItem.quantity, a PositiveSmallIntegerField
+MAX_QUANTITY = 32767
+
+
+class QuantityLimitExceeded(ValueError):
+    """An add would take a line past MAX_QUANTITY."""
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_sub_total(self):
+        """Annotate each line with its `sub_total`, computed in SQL."""
+        return self.annotate(sub_total=F('quantity') * F('product__price'))
+
+    def orphaned(self):
+        """Lines without a cart or a product, and emptied lines."""
+        return self.filter(models.Q(cart__isnull=True) | models.Q(product__isnull=True) | models.Q(quantity=0))
+
+    def add(self, cart_id, product_id, quantity):
+        """
+        Add `quantity` of a product to a cart in one atomic statement and
+        return the resulting line, or None if the cart or the product does
+        not exist. Raises QuantityLimitExceeded, leaving the line as it was,
+        if the line would pass MAX_QUANTITY.
+
+        The row is inserted from a SELECT over the cart and the product,
+        which doubles as the existence check, and an existing line for the
+        same (cart, product) is incremented in place by ON CONFLICT, so
+        concurrent adds never lose an update.
+        """
+        connection = connections[self.db]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return self._add_fallback(cart_id, product_id, quantity)
+
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        cart_pk = Cart._meta.pk.get_db_prep_value(cart_id, connection)
+        product_pk = Product._meta.pk.get_db_prep_value(product_id, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} ({cart}, {product}, {quantity}) '
+                'SELECT cart.{cart_pk}, product.{product_pk}, %s '
+                'FROM {cart_table} cart, {product_table} product '
+                'WHERE cart.{cart_pk} = %s AND product.{product_pk} = %s '
+                'ON CONFLICT ({cart}, {product}) DO UPDATE SET {quantity} = {table}.{quantity} + excluded.{quantity} '
+                # Summed as integers: smallint + smallint overflows on PostgreSQL
+                'WHERE CAST({table}.{quantity} AS integer) + excluded.{quantity} <= %s '
+                'RETURNING {id}, {quantity}'.format(
+                    table=table,
+                    id=quote(self.model._meta.pk.column),
+                    cart=quote(self.model._meta.get_field('cart').column),
+                    product=quote(self.model._meta.get_field('product').column),
+                    quantity=quote(self.model._meta.get_field('quantity').column),
+                    cart_table=quote(Cart._meta.db_table),
+                    product_table=quote(Product._meta.db_table),
+                    cart_pk=quote(Cart._meta.pk.column),
+                    product_pk=quote(Product._meta.pk.column),
+                ),
+                [quantity, cart_pk, product_pk, MAX_QUANTITY],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            # Either the cart or the product is missing, or the line is full
+            if self.filter(cart_id=cart_id, product_id=product_id).exists():
+                raise QuantityLimitExceeded
+            return None
+        return self.model(id=row[0], cart_id=cart_id, product_id=product_id, quantity=row[1])
+
+    def _add_fallback(self, cart_id, product_id, quantity):
+        if not (Cart.objects.filter(pk=cart_id).exists() and Product.objects.filter(pk=product_id).exists()):
+            return None
+        line = self.filter(cart_id=cart_id, product_id=product_id)
+        with transaction.atomic(using=self.db):
+            updated = line.filter(quantity__lte=MAX_QUANTITY - quantity).update(quantity=F('quantity') + quantity)
+            if not updated:
+                try:
+                    with transaction.atomic(using=self.db):
+                        return self.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                except IntegrityError:
+                    updated = line.filter(quantity__lte=MAX_QUANTITY - quantity).update(
+                        quantity=F('quantity') + quantity)
+                    if not updated:
+                        raise QuantityLimitExceeded
+        return line.get()
+
+    def merge(self, cart_id, source_ids):
+        """
+        Fold the lines of the `source_ids` carts into `cart_id` in one
+        statement: one line per product with the summed quantities, added
+        to the quantity of any line the cart already has, capped at
+        MAX_QUANTITY. The source lines are left in place for the caller to
+        delete.
+        """
+        connection = connections[self.db]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            lines = (
+                self.filter(cart_id__in=source_ids, product__isnull=False)
+                .values_list('product_id').annotate(quantity=Sum('quantity')).order_by()
+            )
+            for product_id, quantity in lines:
+                try:
+                    self.add(cart_id, product_id, min(quantity, MAX_QUANTITY))
+                except QuantityLimitExceeded:
+                    self.filter(cart_id=cart_id, product_id=product_id).update(quantity=MAX_QUANTITY)
+            return len(lines)
+
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        cart_field = Cart._meta.pk
+        cart = quote(self.model._meta.get_field('cart').column)
+        product = quote(self.model._meta.get_field('product').column)
+        quantity = quote(self.model._meta.get_field('quantity').column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} ({cart}, {product}, {quantity}) '
+                'SELECT %s, {product}, CASE WHEN SUM({quantity}) > {limit} THEN {limit} ELSE SUM({quantity}) END '
+                'FROM {table} '
+                'WHERE {cart} IN ({sources}) AND {product} IS NOT NULL '
+                'GROUP BY {product} '
+                'ON CONFLICT ({cart}, {product}) DO UPDATE SET {quantity} = CASE '
+                'WHEN CAST({table}.{quantity} AS integer) + excluded.{quantity} > {limit} THEN {limit} '
+                'ELSE CAST({table}.{quantity} AS integer) + excluded.{quantity} END'.format(
+                    table=table, cart=cart, product=product, quantity=quantity, limit=MAX_QUANTITY,
+                    sources=', '.join(['%s'] * len(source_ids)),
+                ),
+                [cart_field.get_db_prep_value(cart_id, connection)]
+                + [cart_field.get_db_prep_value(source_id, connection) for source_id in source_ids],
+            )
+            return cursor.rowcount
+
+    def reserve_ids(self, count):
+        """
+        Reserve `count` primary keys from the table's id sequence, so that
+        lines can be given their final id before they are written. Reserved
+        ids that are never used leave gaps, as rolled back inserts do. On
+        SQLite the reservation is part of the current transaction, so it
+        must not run inside one that may roll back.
+        """
+        connection = connections[self.db]
+        table = self.model._meta.db_table
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                    [connection.ops.quote_name(table), self.model._meta.pk.column, count],
+                )
+                return [row[0] for row in cursor.fetchall()]
+            if connection.vendor != 'sqlite':
+                raise NotSupportedError('Reserving ids is not supported on %s' % connection.vendor)
+            # AUTOINCREMENT tables only get their sqlite_sequence row on the first insert
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) '
+                'SELECT %s, COALESCE(MAX({id}), 0) FROM {table} '
+                'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)'.format(
+                    id=connection.ops.quote_name(self.model._meta.pk.column),
+                    table=connection.ops.quote_name(table),
+                ),
+                [table, table],
+            )
+            cursor.execute('UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s RETURNING seq', [count, table])
+            last = cursor.fetchone()[0]
+        return list(range(last - count + 1, last + 1))
 
 
 class CartItem(models.Model):
@@ -159,12 +381,18 @@ class CartItem(models.Model):
     product =  models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cartitems', null=True, blank=True)
     quantity = models.PositiveSmallIntegerField(default=0)
 
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_unique_cart_product'),
+        ]
+
     @property
     def get_total(self):
-        total = self.quantity * self.product.price
-        if total == 0.00:
-            self.delete()
-        return total
+        if hasattr(self, 'sub_total'):
+            return self.sub_total
+        return self.quantity * self.product.price
 
     def __str__(self):
         return self.product.name
@@ -184,7 +412,15 @@ class Order(models.Model):
     pending_status = models.CharField(
         max_length=50, choices=PAYMENT_STATUS_CHOICES, default='PAYMENT_STATUS_PENDING')
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT)
-    
+    # Sum of the lines' quantity * unit_price, computed when the order is placed
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', '-placed_at', '-id'], name='order_owner_placed_idx'),
+            models.Index(fields=['-placed_at', '-id'], name='order_placed_idx'),
+        ]
+
     def __str__(self):
         return self.pending_status
 
@@ -193,6 +429,211 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name = "items")
     product = models.ForeignKey(Product, on_delete=models.PROTECT)
     quantity = models.PositiveSmallIntegerField()
+    # Product.price when the order was placed
+    unit_price = models.IntegerField(default=0)
     
     def __str__(self):
-        return self.product.name
\ No newline at end of file
+        return self.product.name
+
+SALES_MEASURES = ('orders', 'units', 'revenue')
+
+
+class SalesRollupQuerySet(models.QuerySet):
+    def increment(self, rows):
+        """
+        Add the orders, units and revenue of each row, a dict keyed by
+        field attname, to the rollup with the same KEYS, creating it if
+        needed. Rows are written in multi-row INSERT ... ON CONFLICT DO
+        UPDATE statements, so concurrent increments never lose an update.
+        """
+        rows = list(rows)
+        connection = connections[self.db]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return self._increment_fallback(rows)
+
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        keys = [self.model._meta.get_field(name) for name in self.model.KEYS]
+        fields = keys + [self.model._meta.get_field(name) for name in SALES_MEASURES]
+        # Stay below SQLite's limit of 999 parameters per statement
+        batch_size = 999 // len(fields)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(
+                    'INSERT INTO {table} ({columns}) VALUES {values} '
+                    'ON CONFLICT ({keys}) DO UPDATE SET {increments}'.format(
+                        table=table,
+                        columns=', '.join(quote(field.column) for field in fields),
+                        values=', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(batch)),
+                        keys=', '.join(quote(field.column) for field in keys),
+                        increments=', '.join(
+                            '{measure} = {table}.{measure} + excluded.{measure}'.format(
+                                table=table, measure=quote(name))
+                            for name in SALES_MEASURES
+                        ),
+                    ),
+                    [field.get_db_prep_save(row[field.attname], connection) for row in batch for field in fields],
+                )
+
+    def _increment_fallback(self, rows):
+        for row in rows:
+            keys = {name: row[self.model._meta.get_field(name).attname] for name in self.model.KEYS}
+            increments = {name: F(name) + row[name] for name in SALES_MEASURES}
+            with transaction.atomic(using=self.db):
+                if self.filter(**keys).update(**increments):
+                    continue
+                try:
+                    with transaction.atomic(using=self.db):
+                        self.create(**keys, **{name: row[name] for name in SALES_MEASURES})
+                except IntegrityError:
+                    self.filter(**keys).update(**increments)
+
+
+class SalesRollup(models.Model):
+    """
+    Orders, units and revenue of the orders placed on a day, by payment
+    status. Maintained by FashionPlace.sales.
+    """
+    day = models.DateField()
+    status = models.CharField(max_length=50)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    objects = SalesRollupQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    KEYS = ('day', 'status')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='daily_sales_day_status_uniq'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.day, self.status)
+
+
+class CategorySales(SalesRollup):
+    """
+    A product in several categories counts in each of them, so the
+    categories of a day add up to more than its DailySales.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='sales')
+
+    KEYS = ('day', 'category', 'status')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category', 'status'], name='category_sales_uniq'),
+        ]
+
+    def __str__(self):
+        return '%s %s %s' % (self.day, self.category_id, self.status)
+
+
+class SalesStatus(models.Model):
+    """
+    The payment status the sales rollups count an order under; orders
+    without one are not counted. Kept out of Order so that saving an order,
+    even a copy loaded before it was counted or moved, never changes it.
+    Maintained by FashionPlace.sales.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True, related_name='sales_status')
+    status = models.CharField(max_length=50)
+
+    def __str__(self):
+        return '%s %s' % (self.order_id, self.status)
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def expired(self, before):
+        """Keys first used before `before`, which no longer replay."""
+        return self.filter(created_at__lt=before)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response of the first POST sent with an `Idempotency-Key` header.
+
+    Keys are scoped to the user sending them; anonymous requests are not
+    deduplicated. See api.idempotency.
+    """
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # SHA-256 of the method, path and body the key was first sent with
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='idempotency_owner_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.key
+
+
+class TaskQuerySet(models.QuerySet):
+    def due(self, now):
+        """Queued tasks whose time has come, oldest first."""
+        return self.filter(status=Task.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+
+    def stale(self, before):
+        """Running tasks claimed before `before`, whose worker is presumed dead."""
+        return self.filter(status=Task.RUNNING, locked_at__lt=before)
+
+
+class Task(models.Model):
+    """
+    A call of a function decorated with FashionPlace.tasks.task, run by
+    `manage.py run_workers` outside of the request.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    # Dotted path of the task function, and its keyword arguments
+    name = models.CharField(max_length=255)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    # Seconds taken by the last attempt
+    duration = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status='queued'), name='task_due_idx'),
+            models.Index(fields=['locked_at'], condition=models.Q(status='running'), name='task_running_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%s' % (self.name, self.pk)
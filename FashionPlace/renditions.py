@@ -0,0 +1,179 @@
+"""
+Fixed-width WebP and JPEG renditions of product images.
+
+Renditions are written next to the original under `renditions/` with
+names derived from the original's name, so their URLs can be computed
+without touching the database. An image is only given a srcset once its
+last rendition exists, which `render_renditions` writes after all the
+others, so clients fall back to the original image until then; the
+products showing it are touched once it is written, so that catalog
+validators and cached collections change with their srcset. New
+uploads are rendered in a process pool once the saving transaction
+commits; `manage.py generate_renditions` backfills existing images.
+
+`render_renditions` only takes plain paths and settings values so that it
+can run in a worker process without Django being set up.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+
+from FashionPlace.models import Product
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMATS = {
+    'webp': ('WEBP', '.webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', '.jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+
+def rendition_widths():
+    return list(getattr(settings, 'IMAGE_RENDITION_WIDTHS', [200, 400, 800]))
+
+
+def rendition_name(name, width, image_format):
+    stem = os.path.splitext(name)[0]
+    return 'renditions/%s-%dw%s' % (stem, width, FORMATS[image_format][1])
+
+
+def rendition_srcset(name, request=None):
+    """
+    Return `{'webp': '<url> 200w, <url> 400w, ...', 'jpeg': ...}` for an
+    image name, or None when there is no image or its renditions have not
+    been generated yet.
+    """
+    if not name or not has_renditions(name):
+        return None
+    if isinstance(default_storage, FileSystemStorage):
+        # Rendition URLs only differ in their ASCII suffix, so the storage
+        # and the request are asked for one URL per image instead of one
+        # per rendition
+        prefix = default_storage.url('renditions/%s' % os.path.splitext(name)[0])
+        if request is not None:
+            prefix = request.build_absolute_uri(prefix)
+
+        def url(width, image_format):
+            return '%s-%dw%s' % (prefix, width, FORMATS[image_format][1])
+    else:
+        def url(width, image_format):
+            location = default_storage.url(rendition_name(name, width, image_format))
+            return request.build_absolute_uri(location) if request is not None else location
+
+    widths = rendition_widths()
+    return {
+        image_format: ', '.join('%s %dw' % (url(width, image_format), width) for width in widths)
+        for image_format in FORMATS
+    }
+
+
+def render_renditions(source_path, media_root, name, widths):
+    """
+    Write every rendition of one image and return their names. Each file is
+    written under a temporary name and then moved into place, widest last,
+    so that once the last rendition exists every other one does too.
+    """
+    from PIL import Image
+
+    written = []
+    with Image.open(source_path) as original:
+        original.load()
+        image = original.convert('RGB')
+
+    for width in sorted(widths):
+        resized = image
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+        for image_format, (pil_format, _, options) in FORMATS.items():
+            target = rendition_name(name, width, image_format)
+            path = os.path.join(media_root, target)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            resized.save(path + '.tmp', pil_format, **options)
+            os.replace(path + '.tmp', path)
+            written.append(target)
+    return written
+
+
+def has_renditions(name):
+    """Whether every rendition of `name` was written, by checking the one written last."""
+    widths = rendition_widths()
+    if not widths:
+        return False
+    return default_storage.exists(rendition_name(name, max(widths), list(FORMATS)[-1]))
+
+
+def renditions_written(names, batch_size=500):
+    """
+    Touch the products showing the images `names`, whose renditions were
+    just written, so that the catalog version (and the ETags and cached
+    collections derived from it) changes with their srcset.
+    """
+    names = list(names)
+    now = timezone.now()
+    for start in range(0, len(names), batch_size):
+        Product.objects.filter(image__in=names[start:start + batch_size]).update(updated_at=now)
+
+
+def _pool_rendered(name):
+    def done(future):
+        # Runs in the executor's result thread, with its own connection
+        try:
+            if future.exception() is None:
+                renditions_written([name])
+            else:
+                logger.error("Could not render %s", name, exc_info=future.exception())
+        except Exception:
+            logger.exception("Could not record the renditions of %s", name)
+        finally:
+            connections.close_all()
+    return done
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_RENDITION_WORKERS)
+    return _executor
+
+
+def rendition_job(name):
+    """Return the arguments of `render_renditions` for a stored image, or None."""
+    try:
+        source_path = default_storage.path(name)
+    except NotImplementedError:
+        # Only local storages expose paths
+        return None
+    if not os.path.exists(source_path):
+        return None
+    return (source_path, str(settings.MEDIA_ROOT), name, rendition_widths())
+
+
+def schedule_renditions(name):
+    """
+    Render the renditions of `name` after the current transaction commits,
+    in the process pool, or inline when IMAGE_RENDITION_WORKERS is 0.
+    """
+    if not name or has_renditions(name):
+        return
+
+    def submit():
+        job = rendition_job(name)
+        if job is None:
+            return
+        if settings.IMAGE_RENDITION_WORKERS:
+            get_executor().submit(render_renditions, *job).add_done_callback(_pool_rendered(name))
+        else:
+            render_renditions(*job)
+            renditions_written([name])
+
+    transaction.on_commit(submit)
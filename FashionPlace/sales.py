@@ -0,0 +1,196 @@
+"""
+Maintenance of the DailySales and CategorySales rollups behind
+/reports/sales/.
+
+Orders are added to the rollups of the day they were placed, under their
+payment status, once the transaction placing them commits, and moved to
+the new status when it changes. Lines count in the categories their product
+belongs to when they are recorded. The SalesStatus of an order is the
+status it is counted under, missing while it is not counted, and every
+write below locks the orders it changes and checks it, so an order is
+never counted twice however recordings, moves, rebuilds and saves of
+stale copies interleave.
+
+`manage.py rebuild_sales_rollups` recomputes both tables from the orders,
+which also corrects orders changed by queryset updates or deleted outside
+the API. On PostgreSQL it holds an advisory lock that the other writes
+share, so that they wait for it instead of writing to half rebuilt
+tables; elsewhere (SQLite) writers are serialized by the database.
+"""
+from django.db import connections, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+from FashionPlace.models import SALES_MEASURES, CategorySales, DailySales, Order, OrderItem, SalesStatus
+
+
+# Key of the PostgreSQL advisory lock taken by `lock_rollups`
+ROLLUP_LOCK_KEY = 0x5a1e5
+
+
+def lock_rollups(exclusive=False):
+    """
+    Take the rollup lock until the end of the current transaction: shared
+    by the writes of single orders, exclusive for `rebuild`.
+    """
+    connection = connections[DailySales.objects.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock%s(%%s)' % ('' if exclusive else '_shared'), [ROLLUP_LOCK_KEY])
+
+
+def order_sales(orders, status='pending_status'):
+    """
+    Daily and category rollup rows of an Order queryset, in two queries,
+    under the orders' `status` field: `pending_status` to record them,
+    `sales_status__status` for the status they are counted under.
+    """
+    daily = (
+        orders.annotate(day=TruncDate('placed_at'), status=F(status))
+        .values('day', 'status')
+        .annotate(
+            orders=Count('id', distinct=True),
+            units=Coalesce(Sum('items__quantity'), 0),
+            revenue=Coalesce(Sum(F('items__quantity') * F('items__unit_price')), 0),
+        )
+        .order_by()
+    )
+    categories = (
+        OrderItem.objects.filter(order__in=orders, product__category__isnull=False)
+        .annotate(day=TruncDate('order__placed_at'), status=F('order__%s' % status),
+                  category_id=F('product__category'))
+        .values('day', 'status', 'category_id')
+        .annotate(
+            orders=Count('order', distinct=True),
+            units=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('unit_price')),
+        )
+        .order_by()
+    )
+    return list(daily), list(categories)
+
+
+def negate(rows):
+    return [dict(row, **{name: -row[name] for name in SALES_MEASURES}) for row in rows]
+
+
+def _increment(daily, categories):
+    with transaction.atomic():
+        DailySales.objects.increment(daily)
+        CategorySales.objects.increment(categories)
+
+
+def _locked(orders):
+    """
+    Lock the orders of an Order queryset and return a queryset of exactly
+    those that still match it once locked, with their ids.
+    """
+    locked = list(orders.select_for_update(of=('self',)).values_list('pk', flat=True))
+    # Their SalesStatus may have changed while waiting for the locks; a new
+    # statement sees the committed change
+    order_ids = list(orders.filter(pk__in=locked).values_list('pk', flat=True))
+    return Order.objects.filter(pk__in=order_ids), order_ids
+
+
+def _count(orders):
+    """Mark locked, uncounted orders as counted under their current status."""
+    SalesStatus.objects.bulk_create(
+        SalesStatus(order_id=order_id, status=status)
+        for order_id, status in orders.values_list('pk', 'pending_status')
+    )
+
+
+def record_orders(order_ids):
+    """Add newly placed orders, with their lines, to the rollups, unless they are counted already."""
+    with transaction.atomic():
+        lock_rollups()
+        orders, order_ids = _locked(Order.objects.filter(pk__in=list(order_ids), sales_status__isnull=True))
+        if order_ids:
+            _increment(*order_sales(orders))
+            _count(orders)
+
+
+def remove_orders(order_ids):
+    """Take orders out of the rollups, before their lines are deleted."""
+    with transaction.atomic():
+        lock_rollups()
+        orders, order_ids = _locked(Order.objects.filter(pk__in=list(order_ids), sales_status__isnull=False))
+        if order_ids:
+            daily, categories = order_sales(orders, status='sales_status__status')
+            _increment(negate(daily), negate(categories))
+            SalesStatus.objects.filter(order_id__in=order_ids).delete()
+
+
+def move_order(order_id):
+    """Move an order from the rollups of the status it is counted under to those of its current status."""
+    with transaction.atomic():
+        lock_rollups()
+        orders, order_ids = _locked(
+            Order.objects.filter(pk=order_id, sales_status__isnull=False)
+            .exclude(sales_status__status=F('pending_status')))
+        if order_ids:
+            daily, categories = order_sales(orders, status='sales_status__status')
+            current_daily, current_categories = order_sales(orders)
+            _increment(negate(daily) + current_daily, negate(categories) + current_categories)
+            SalesStatus.objects.filter(order_id__in=order_ids).update(
+                status=Subquery(Order.objects.filter(pk=OuterRef('order_id')).values('pending_status')))
+
+
+def rebuild(batch_size=1000):
+    """
+    Recompute the rollups from every order, `batch_size` orders at a time,
+    and yield the number of orders counted so far.
+
+    The tables are replaced in one transaction holding the rollup lock, so
+    reports read the previous rollups until it commits, and orders placed,
+    moved or deleted meanwhile are written before it starts or after it
+    commits, never into half rebuilt tables.
+    """
+    with transaction.atomic():
+        lock_rollups(exclusive=True)
+        DailySales.objects.all().delete()
+        CategorySales.objects.all().delete()
+        SalesStatus.objects.all().delete()
+        last_id = Order.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        counted = start = 0
+        while start < last_id:
+            end = min(start + batch_size, last_id)
+            # Orders committed after this point are left to their own
+            # recording, which waits for the rebuild to commit
+            orders, order_ids = _locked(Order.objects.filter(pk__gt=start, pk__lte=end))
+            if order_ids:
+                _increment(*order_sales(orders))
+                _count(orders)
+            counted += len(order_ids)
+            start = end
+            yield counted
+
+
+def report(start, end, status=None):
+    """
+    Sales of the orders placed from `start` to `end` inclusive, by day and
+    by category, read from the rollups alone in two queries.
+    """
+    daily = DailySales.objects.filter(day__range=(start, end)).exclude(orders=0)
+    categories = CategorySales.objects.filter(day__range=(start, end)).exclude(orders=0)
+    if status is not None:
+        daily = daily.filter(status=status)
+        categories = categories.filter(status=status)
+    measures = {name: Sum(name) for name in SALES_MEASURES}
+
+    days = list(daily.values('day').annotate(**measures).order_by('day'))
+    by_category = [
+        {'category': row.pop('category_id'), **row}
+        for row in categories.values('category_id', name=F('category__name'))
+        .annotate(**measures).order_by('-revenue', 'category_id')
+    ]
+    return {
+        'start': start,
+        'end': end,
+        'status': status,
+        **{name: sum(row[name] for row in days) for name in SALES_MEASURES},
+        'days': days,
+        'categories': by_category,
+    }
@@ -0,0 +1,254 @@
+"""
+Inverted index over product names and category names.
+
+SQLite databases use an FTS5 virtual table ranked with bm25(), Postgres
+databases use a tsvector column behind a GIN index ranked with ts_rank().
+Any other backend falls back to case-insensitive LIKE lookups. The index
+lives in the `FashionPlace_productsearch` table created by migration 0006
+and is kept in sync by the receivers in `FashionPlace.signals`.
+"""
+import re
+import uuid
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import Expression, F, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+
+from FashionPlace.models import CatalogEntry, Product
+
+
+SEARCH_TABLE = 'FashionPlace_productsearch'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SQLITE_ROWID_FUNCTION = 'fashionplace_search_rowid'
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+def product_documents(product_ids):
+    """
+    Return (product_id, name, category names) for the given products, read
+    from their already refreshed catalog entries.
+    """
+    entries = CatalogEntry.objects.filter(pk__in=product_ids).values_list('pk', 'name', 'categories')
+    return [
+        (pk, name, ' '.join(category['name'] for category in categories))
+        for pk, name, categories in entries
+    ]
+
+
+class SearchRank(Expression):
+    """
+    Rank of the outer row's product for a search (lower is better), a
+    correlated lookup of that one product in the index table.
+    """
+    output_field = FloatField()
+
+    def __init__(self, backend, query, product=None):
+        super().__init__()
+        self.backend = backend
+        self.query = query
+        self.product = product if product is not None else F('pk')
+
+    def get_source_expressions(self):
+        return [self.product]
+
+    def set_source_expressions(self, expressions):
+        self.product, = expressions
+
+    def as_sql(self, compiler, connection):
+        product_sql, product_params = compiler.compile(self.product)
+        sql, params = self.backend.rank_sql(self.query, product_sql)
+        return '(%s)' % sql, list(params) + list(product_params)
+
+
+class BaseSearchBackend:
+    def __init__(self, connection):
+        self.connection = connection
+        self.table = connection.ops.quote_name(SEARCH_TABLE)
+
+    def index(self, product_ids):
+        """Add or refresh the index entries for the given products."""
+        raise NotImplementedError
+
+    def remove(self, product_ids):
+        """Drop the index entries for the given products."""
+        raise NotImplementedError
+
+    def match_sql(self, query):
+        """SQL and params selecting the product_id of every match."""
+        raise NotImplementedError
+
+    def rank_sql(self, query, product_sql):
+        """SQL and params ranking the product given by the `product_sql` column."""
+        raise NotImplementedError
+
+    def filter_queryset(self, queryset, query):
+        """
+        Restrict `queryset` to the products matching `query` and annotate
+        each row with its `search_rank` (lower is better), ordered by it.
+
+        The match is a subquery of the caller's query, so the other filters
+        apply in the same statement and every match is found, not only the
+        best ranked ones overall.
+        """
+        if not tokenize(query):
+            return queryset
+
+        sql, params = self.match_sql(query)
+        return (
+            queryset.filter(pk__in=RawSQL(sql, params))
+            .annotate(search_rank=SearchRank(self, query))
+            .order_by('search_rank')
+        )
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    FTS5 backend. The FTS rowid is derived from the first 64 bits of the
+    product UUID so that refreshing, removing or ranking an entry is a
+    rowid lookup rather than a scan of the UNINDEXED product_id column.
+    """
+
+    @staticmethod
+    def rowid(product_id):
+        return int.from_bytes(uuid.UUID(str(product_id)).bytes[:8], 'big', signed=True)
+
+    def index(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        documents = product_documents(product_ids)
+        with self.connection.cursor() as cursor:
+            self._delete(cursor, product_ids)
+            cursor.executemany(
+                'INSERT INTO %s (rowid, product_id, name, categories) VALUES (%%s, %%s, %%s, %%s)' % self.table,
+                [(self.rowid(pk), pk.hex, name, categories) for pk, name, categories in documents],
+            )
+
+    def remove(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids:
+            with self.connection.cursor() as cursor:
+                self._delete(cursor, product_ids)
+
+    def expression(self, query):
+        return ' '.join('"%s"*' % token for token in tokenize(query))
+
+    def match_sql(self, query):
+        return 'SELECT product_id FROM %s WHERE %s MATCH %%s' % (self.table, self.table), [self.expression(query)]
+
+    def rank_sql(self, query, product_sql):
+        # Product names weigh more than category names
+        return (
+            'SELECT bm25({table}, 0.0, 10.0, 3.0) FROM {table} '
+            'WHERE {table} MATCH %s AND rowid = {function}({product})'.format(
+                table=self.table, function=SQLITE_ROWID_FUNCTION, product=product_sql),
+            [self.expression(query)],
+        )
+
+    def _delete(self, cursor, product_ids):
+        cursor.executemany(
+            'DELETE FROM %s WHERE rowid = %%s' % self.table,
+            [(self.rowid(pk),) for pk in product_ids],
+        )
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector backend; product names weigh more than category names."""
+
+    config = 'simple'
+
+    def index(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        documents = product_documents(product_ids)
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (product_id, document) VALUES '
+                '(%%s, setweight(to_tsvector(%%s, %%s), \'A\') || setweight(to_tsvector(%%s, %%s), \'B\')) '
+                'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document' % self.table,
+                [(pk, self.config, name, self.config, categories) for pk, name, categories in documents],
+            )
+
+    def remove(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM %s WHERE product_id = ANY(%%s)' % self.table,
+                    [product_ids],
+                )
+
+    def expression(self, query):
+        return ' & '.join('%s:*' % token for token in tokenize(query))
+
+    def match_sql(self, query):
+        return (
+            'SELECT product_id FROM %s WHERE document @@ to_tsquery(%%s, %%s)' % self.table,
+            [self.config, self.expression(query)],
+        )
+
+    def rank_sql(self, query, product_sql):
+        return (
+            'SELECT -ts_rank(document, to_tsquery(%%s, %%s)) FROM %s WHERE product_id = %s' % (
+                self.table, product_sql),
+            [self.config, self.expression(query)],
+        )
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """No index: every term must appear in the product or a category name."""
+
+    def index(self, product_ids):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def filter_queryset(self, queryset, query):
+        for token in tokenize(query):
+            matching = Product.objects.filter(
+                Q(name__icontains=token) | Q(category__name__icontains=token)
+            ).values('pk')
+            queryset = queryset.filter(pk__in=matching)
+        return queryset
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using=None):
+    using = using or connection
+    return BACKENDS.get(using.vendor, FallbackSearchBackend)(using)
+
+
+def index_products(product_ids):
+    get_search_backend().index(product_ids)
+
+
+def remove_products(product_ids):
+    get_search_backend().remove(product_ids)
+
+
+def sqlite_rowid(product_id):
+    """SQLiteSearchBackend.rowid of a product id stored as 32 hex digits."""
+    if product_id is None:
+        return None
+    return int.from_bytes(bytes.fromhex(product_id[:16]), 'big', signed=True)
+
+
+@receiver(connection_created)
+def register_sqlite_functions(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(SQLITE_ROWID_FUNCTION, 1, sqlite_rowid, deterministic=True)
+
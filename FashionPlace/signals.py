@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from FashionPlace import catalog, jobs, renditions, sales, search
+from FashionPlace.models import Category, Order, OrderItem, Product, Profile, User
+from FashionPlace.tasks import enqueue
+
+
+def products_changed(product_ids):
+    """Refresh every structure derived from the given products."""
+    product_ids = list(product_ids)
+    if product_ids:
+        catalog.refresh_entries(product_ids)
+        search.index_products(product_ids)
+
+
+def products_removed(product_ids):
+    """
+    Drop the given products from every structure derived from them. Catalog
+    entries go away with the product through the ON DELETE cascade.
+    """
+    product_ids = list(product_ids)
+    if product_ids:
+        search.remove_products(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        products_changed([instance.pk])
+        renditions.schedule_renditions(instance.image.name)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    products_removed([instance.pk])
+    catalog.bump_version()
+
+
+@receiver(m2m_changed, sender=Product.category.through)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # The cleared products are no longer reachable once post_clear fires
+        instance._cleared_product_ids = list(instance.products.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        product_ids = [instance.pk]
+    elif action == 'post_clear':
+        product_ids = getattr(instance, '_cleared_product_ids', [])
+    else:
+        product_ids = pk_set or []
+    catalog.touch_products(product_ids)
+    products_changed(product_ids)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, raw=False, **kwargs):
+    catalog.category_cache.invalidate()
+    if not created and not raw:
+        products_changed(instance.products.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleting(sender, instance, **kwargs):
+    instance._deleted_product_ids = list(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    products_changed(getattr(instance, '_deleted_product_ids', []))
+    catalog.bump_version()
+    catalog.category_cache.invalidate()
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    # New orders are recorded in the sales rollups by CreateOrderSerializer
+    # once their lines are written. After any other save the order is moved
+    # if its status changed, once the save commits: the move locks the
+    # rollups before the order, as `sales.rebuild` does
+    if not created and not raw:
+        order_id = instance.pk
+        transaction.on_commit(lambda: sales.move_order(order_id))
+    if created and not raw:
+        enqueue(jobs.send_order_confirmation, order_id=instance.pk)
+
+
+@receiver(post_delete, sender=Profile)
+def profile_deleted(sender, instance, **kwargs):
+    # The user's personal data goes with the profile, in a few queries
+    # whatever the number of orders: the orders, taken out of the sales
+    # rollups first, then the account, with its customer record and carts
+    with transaction.atomic():
+        orders = Order.objects.filter(owner_id=instance.user_id)
+        order_ids = list(orders.values_list('id', flat=True))
+        sales.remove_orders(order_ids)
+        OrderItem.objects.filter(order_id__in=order_ids).delete()
+        orders.delete()
+        User.objects.filter(pk=instance.user_id).delete()
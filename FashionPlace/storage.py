@@ -0,0 +1,66 @@
+"""
+Content-addressed media storage.
+
+Every saved file gets the first 12 hex digits of its SHA-256 inserted
+before the extension (`shoe.png` becomes `shoe.3f2a9c0b81d4.png`), so a
+name always refers to the same bytes and can be cached forever. Saving
+identical content twice reuses the existing file.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+HASH_LENGTH = 12
+
+# `<stem>.<hash>.<ext>`, optionally followed by a rendition width suffix
+HASHED_NAME_RE = re.compile(r'\.(?P<hash>[0-9a-f]{%d})(?:-\d+w)?\.[A-Za-z0-9]+$' % HASH_LENGTH)
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(name, digest):
+    """
+    Return `name` carrying `digest`. A name that already embeds a hash,
+    e.g. when copying between storages, is kept only if that hash is the
+    content's; any other embedded hash is replaced rather than trusted.
+    """
+    match = HASHED_NAME_RE.search(name)
+    if match:
+        if match.group('hash') == digest:
+            return name
+        name = name[:match.start('hash') - 1] + name[match.end('hash'):]
+    stem, extension = os.path.splitext(name)
+    return '%s.%s%s' % (stem, digest, extension)
+
+
+def name_hash(name):
+    """Return the content hash embedded in `name`, or None."""
+    match = HASHED_NAME_RE.search(name)
+    return match.group('hash') if match else None
+
+
+class HashedMediaStorage(FileSystemStorage):
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = hashed_name(name, content_hash(content))
+        if self.exists(name):
+            return name.replace('\\', '/')
+        return super().save(name, content, max_length=max_length)
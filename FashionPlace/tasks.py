@@ -0,0 +1,236 @@
+"""
+A small durable task queue on the Task table.
+
+Functions decorated with `task` are queued with `enqueue`, in the
+caller's transaction, so a task exists exactly when the change that asked
+for it is committed. `manage.py run_workers` claims due tasks and runs
+them in a thread or process pool, each in its own transaction.
+
+Workers claim tasks with SELECT ... FOR UPDATE SKIP LOCKED where the
+database supports it (PostgreSQL), so that they never wait on each other.
+Elsewhere (SQLite) they poll and claim each task with a compare-and-set
+UPDATE, which only one of them can win. A failed task is retried after an
+exponential backoff until it has used its attempts. Tasks left running by
+a worker that died are queued again after TASK_LOCK_TIMEOUT seconds, or
+failed if that was their last attempt, so a task may run more than once
+and should be safe to repeat.
+"""
+import logging
+import math
+import os
+import random
+import socket
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from FashionPlace.models import Task
+
+
+logger = logging.getLogger(__name__)
+
+
+def task(function=None, max_attempts=None):
+    """Mark a function as a task, optionally with its own number of attempts."""
+    def decorate(function):
+        function.task_max_attempts = max_attempts
+        return function
+    return decorate(function) if function is not None else decorate
+
+
+def task_name(function):
+    return '%s.%s' % (function.__module__, function.__qualname__)
+
+
+def get_task(name):
+    function = import_string(name)
+    if not hasattr(function, 'task_max_attempts'):
+        raise ValueError('%s is not a task' % name)
+    return function
+
+
+def enqueue(function, run_at=None, **kwargs):
+    """Queue a call of the task `function` with JSON serializable `kwargs`."""
+    if not hasattr(function, 'task_max_attempts'):
+        raise ValueError('%s is not a task' % task_name(function))
+    return Task.objects.create(
+        name=task_name(function),
+        kwargs=kwargs,
+        run_at=run_at or timezone.now(),
+        max_attempts=function.task_max_attempts or settings.TASK_MAX_ATTEMPTS,
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before the next attempt, doubling with each failure, with jitter."""
+    delay = min(settings.TASK_RETRY_BACKOFF * 2 ** (attempts - 1), settings.TASK_RETRY_BACKOFF_MAX)
+    return delay * random.uniform(0.75, 1)
+
+
+def claim(limit, worker):
+    """Claim up to `limit` due tasks for `worker` and return their ids."""
+    now = timezone.now()
+    due = Task.objects.due(now)
+    claimed = dict(status=Task.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1)
+    if connections[Task.objects.db].features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            task_ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+            Task.objects.filter(pk__in=task_ids).update(**claimed)
+        return task_ids
+
+    task_ids = []
+    for task_id in due.values_list('id', flat=True)[:limit]:
+        # Another worker may have claimed the task since it was listed
+        if Task.objects.filter(pk=task_id, status=Task.QUEUED).update(**claimed):
+            task_ids.append(task_id)
+    return task_ids
+
+
+def requeue_stale():
+    """
+    Queue again the tasks whose worker stopped before finishing them, and
+    fail those that have used their attempts, as a run that raised would.
+    Returns the number of tasks queued again.
+    """
+    now = timezone.now()
+    stale = Task.objects.stale(now - timedelta(seconds=settings.TASK_LOCK_TIMEOUT))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.FAILED, locked_by='', locked_at=None, finished_at=now,
+        last_error='The worker stopped before finishing the last attempt')
+    if failed:
+        logger.error('%d stale tasks failed for good, their attempts used', failed)
+    return stale.filter(attempts__lt=F('max_attempts')).update(status=Task.QUEUED, locked_by='', locked_at=None)
+
+
+def run(task_id):
+    """
+    Run a claimed task and record its outcome. Returns the task's name,
+    whether it succeeded and the seconds it took.
+    """
+    task = Task.objects.get(pk=task_id)
+    started = time.perf_counter()
+    try:
+        function = get_task(task.name)
+        with transaction.atomic():
+            function(**task.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        succeeded = False
+    else:
+        error = ''
+        succeeded = True
+    duration = time.perf_counter() - started
+
+    now = timezone.now()
+    if succeeded:
+        outcome = dict(status=Task.DONE, finished_at=now)
+    elif task.attempts < task.max_attempts:
+        outcome = dict(status=Task.QUEUED, run_at=now + timedelta(seconds=backoff(task.attempts)))
+        logger.warning('Task %s failed, attempt %d of %d', task, task.attempts, task.max_attempts)
+    else:
+        outcome = dict(status=Task.FAILED, finished_at=now)
+        logger.error('Task %s failed for good after %d attempts', task, task.attempts)
+    # A task requeued as stale meanwhile belongs to its new worker
+    Task.objects.filter(pk=task.pk, status=Task.RUNNING, locked_at=task.locked_at).update(
+        locked_by='', locked_at=None, last_error=error, duration=duration, **outcome)
+    logger.info('Task %s ran in %.1f ms', task, duration * 1000)
+    return task.name, succeeded, duration
+
+
+def execute(task_id):
+    """`run` in a pool thread or process, which manages its own connections like a request does."""
+    close_old_connections()
+    try:
+        return run(task_id)
+    finally:
+        close_old_connections()
+
+
+def worker_id():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class TaskStats:
+    """Runs, failures and timings of each task name, as seen by one worker."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.failures = defaultdict(int)
+
+    def add(self, name, succeeded, duration):
+        self.durations[name].append(duration)
+        if not succeeded:
+            self.failures[name] += 1
+
+    def rows(self):
+        for name, durations in sorted(self.durations.items()):
+            durations = sorted(durations)
+            yield {
+                'name': name,
+                'runs': len(durations),
+                'failures': self.failures[name],
+                'mean_ms': sum(durations) / len(durations) * 1000,
+                'p95_ms': durations[math.ceil(len(durations) * 0.95) - 1] * 1000,
+                'max_ms': durations[-1] * 1000,
+            }
+
+
+class Worker:
+    """
+    Claims due tasks as slots of `executor` free up and collects their
+    outcomes in `stats`. With `once`, stops when no task is due and none
+    is running; otherwise polls every `poll_interval` seconds until
+    `stop()`.
+    """
+
+    def __init__(self, executor, slots, poll_interval=1.0, once=False):
+        self.executor = executor
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self.once = once
+        self.name = worker_id()
+        self.stats = TaskStats()
+        self.stopping = False
+
+    def stop(self):
+        self.stopping = True
+
+    def run(self):
+        running = set()
+        last_requeue = None
+        while True:
+            claimed = []
+            if not self.stopping:
+                try:
+                    if last_requeue is None or time.monotonic() - last_requeue > settings.TASK_LOCK_TIMEOUT / 2:
+                        requeue_stale()
+                        last_requeue = time.monotonic()
+                    if len(running) < self.slots:
+                        claimed = claim(self.slots - len(running), self.name)
+                except OperationalError:
+                    # SQLite is locked by another writer; claim at the next poll
+                    logger.debug('Claiming tasks failed', exc_info=True)
+                running.update(self.executor.submit(execute, task_id) for task_id in claimed)
+
+            if not running and (self.stopping or (self.once and not claimed)):
+                return self.stats
+            if running:
+                done, running = wait(running, timeout=0 if claimed else self.poll_interval,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        self.stats.add(*future.result())
+                    except Exception:
+                        # The outcome could not be recorded; the task is
+                        # requeued once its lock times out
+                        logger.exception('Task runner failed')
+            elif not claimed:
+                time.sleep(self.poll_interval)
@@ -10,6 +10,7 @@ from rest_framework import status
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from api.serializers import merge_login_cart
 
 
 
@@ -44,6 +45,8 @@ class JWTCreateView(TokenObtainPairView):
             properties={
                 "email": openapi.Schema(type=openapi.TYPE_STRING),
                 "password": openapi.Schema(type=openapi.TYPE_STRING),
+                "cart_id": openapi.Schema(type=openapi.TYPE_STRING),
+                "session_id": openapi.Schema(type=openapi.TYPE_STRING),
             },
         ),
         responses={200: openapi.Schema(
@@ -64,6 +67,9 @@ class JWTCreateView(TokenObtainPairView):
             response = {
                 "tokens": tokens
             }
+            cart = merge_login_cart(request.data, user)
+            if cart is not None:
+                response["cart_id"] = cart.pk
             return Response(data=response, status=status.HTTP_200_OK)
         else:
             return Response(data={"message": "Invalid email or password"}, status=status.HTTP_401_UNAUTHORIZED)
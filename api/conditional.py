@@ -0,0 +1,55 @@
+"""
+Conditional GET for the catalog endpoints.
+
+`catalog_condition` wraps a viewset action in Django's `condition()`
+decorator so that a request carrying a matching `If-None-Match` or a
+recent enough `If-Modified-Since` is answered with 304 Not Modified
+before the queryset or the serializer is touched. `category_condition`
+does the same from the cached category tree, without any query.
+"""
+import hashlib
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from FashionPlace.catalog import category_cache, current_version
+
+
+def _request_etag(request, token):
+    seed = '%s|%s|%s' % (token, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''))
+    return hashlib.sha1(seed.encode('utf-8')).hexdigest()
+
+
+def catalog_version(request):
+    # condition() asks for the ETag and Last-Modified separately
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = current_version()
+    return request._catalog_version
+
+
+def catalog_etag(request, *args, **kwargs):
+    token, _ = catalog_version(request)
+    return _request_etag(request, token)
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    _, last_modified = catalog_version(request)
+    return last_modified
+
+
+catalog_condition = method_decorator(
+    condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+)
+
+
+def category_etag(request, *args, **kwargs):
+    return _request_etag(request, category_cache.get().etag)
+
+
+def category_last_modified(request, *args, **kwargs):
+    return category_cache.get().last_modified
+
+
+category_condition = method_decorator(
+    condition(etag_func=category_etag, last_modified_func=category_last_modified)
+)
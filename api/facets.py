@@ -0,0 +1,107 @@
+"""
+Facet counts for the product listing.
+
+Everything is computed from the filtered listing queryset in two
+queries: one conditional aggregate for the total, the price buckets and
+the collection flags, and one GROUP BY over the category through table.
+Category names come from the cached category tree.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from rest_framework.exceptions import ValidationError
+
+from FashionPlace.catalog import category_cache
+from FashionPlace.models import Product
+
+
+FLAGS = ['new_arrivals', 'top_rated', 'trending']
+
+MAX_PRICE_BUCKETS = 20
+
+# Parameters that change how the listing is paged, sorted or rendered, not what it contains
+IGNORED_PARAMS = {'cursor', 'page_size', 'ordering', 'format', 'fields', 'expand'}
+
+
+def parse_price_buckets(value):
+    if not value:
+        return list(getattr(settings, 'FACET_PRICE_BUCKETS', [0, 25, 50, 100, 200, 500]))
+    try:
+        bounds = sorted({int(bound) for bound in value.split(',') if bound.strip()})
+    except ValueError:
+        raise ValidationError({'price_buckets': 'Expected a comma separated list of integers.'})
+    if not bounds or len(bounds) > MAX_PRICE_BUCKETS:
+        raise ValidationError({'price_buckets': 'Expected between 1 and %d bounds.' % MAX_PRICE_BUCKETS})
+    return bounds
+
+
+def cache_key(request):
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        if key not in IGNORED_PARAMS
+        for value in values
+    )
+    digest = hashlib.sha1(repr(params).encode('utf-8')).hexdigest()
+    return 'product-facets:%s' % digest
+
+
+def compute_facets(queryset, bounds):
+    queryset = queryset.order_by()
+
+    aggregates = {'total': Count('pk')}
+    for flag in FLAGS:
+        aggregates[flag] = Count('pk', filter=Q(**{flag: True}))
+    buckets = list(zip(bounds, bounds[1:] + [None]))
+    for index, (low, high) in enumerate(buckets):
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        aggregates['bucket_%d' % index] = Count('pk', filter=condition)
+    counts = queryset.aggregate(**aggregates)
+
+    category_counts = (
+        Product.category.through.objects
+        .filter(product_id__in=queryset.values('pk'))
+        .values('category_id')
+        .annotate(count=Count('product_id'))
+    )
+    categories = {category.id: category for category in category_cache.get().categories}
+    category_facets = []
+    for row in category_counts:
+        category = categories.get(row['category_id'])
+        if category is not None:
+            category_facets.append({
+                'id': category.id,
+                'name': category.name,
+                'slug': category.slug,
+                'count': row['count'],
+            })
+    category_facets.sort(key=lambda facet: (-facet['count'], facet['name']))
+
+    return {
+        'count': counts['total'],
+        'categories': category_facets,
+        'price': [
+            {'min': low, 'max': high, 'count': counts['bucket_%d' % index]}
+            for index, (low, high) in enumerate(buckets)
+        ],
+        'flags': {flag: counts[flag] for flag in FLAGS},
+    }
+
+
+def get_facets(request, view):
+    """
+    Return the facets of the view's filtered listing, cached for
+    FACET_CACHE_TTL seconds. The filters only run on a cache miss.
+    """
+    bounds = parse_price_buckets(request.query_params.get('price_buckets'))
+    key = cache_key(request)
+    facets = cache.get(key)
+    if facets is None:
+        queryset = view.filter_queryset(view.get_queryset())
+        facets = compute_facets(queryset, bounds)
+        cache.set(key, facets, getattr(settings, 'FACET_CACHE_TTL', 30))
+    return facets
@@ -0,0 +1,226 @@
+"""
+Sparse fieldsets: `?fields=` and `?expand=`.
+
+`?fields=id,items.quantity` keeps only the listed fields; dotted names
+select fields of nested serializers. A nested serializer listed without
+dotted names is collapsed to the primary key(s) of its objects unless it
+is also named in `?expand=`. Without `?fields=` every field is rendered
+as before.
+
+The same field selection drives the query: the listed columns are loaded
+with `.only()`, rendered foreign keys are joined with `select_related()`
+and rendered reverse or many-to-many relations are prefetched, each with
+its own narrowed queryset.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_fieldset(value):
+    """Turn `'id,items.quantity'` into `{'id': {}, 'items': {'quantity': {}}}`."""
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def nested_serializer(field):
+    if isinstance(field, serializers.ListSerializer):
+        field = field.child
+    return field if isinstance(field, serializers.BaseSerializer) else None
+
+
+def collapse(field):
+    """Replace a nested serializer with the primary key(s) of its objects."""
+    many = isinstance(field, serializers.ListSerializer)
+    kwargs = {'read_only': True, 'many': many}
+    if field.source != field.field_name:
+        kwargs['source'] = field.source
+    return serializers.PrimaryKeyRelatedField(**kwargs)
+
+
+def prune_fields(fields, selected, expand):
+    for name in list(fields):
+        if name not in selected:
+            fields.pop(name)
+
+    for name, subfields in selected.items():
+        field = fields.get(name)
+        nested = nested_serializer(field) if field is not None else None
+        if nested is None:
+            continue
+        if subfields:
+            prune_fields(nested.fields, subfields, expand.get(name, {}))
+        elif name not in expand:
+            fields[name] = collapse(field)
+    return fields
+
+
+class QueryPlan:
+    """The columns and relations of one model that a serializer reads."""
+
+    def __init__(self, model, joined=False):
+        self.model = model
+        self.joined = joined
+        self.columns = {model._meta.pk.attname}
+        self.relations = {}
+        self.serializer = None
+        self.narrow = True
+
+    def add_path(self, path):
+        """Record a dotted model path such as `items.product.price`."""
+        name, _, rest = path.partition('.')
+        if name == 'pk':
+            return
+        try:
+            model_field = self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            self.narrow = False
+            return
+        if not model_field.is_relation:
+            self.columns.add(model_field.attname)
+            return
+        if model_field.concrete and not model_field.many_to_many:
+            self.columns.add(model_field.attname)
+            if not rest:
+                return
+        related = self.relation(name, model_field)
+        if rest:
+            related.add_path(rest)
+
+    def relation(self, name, model_field):
+        if name not in self.relations:
+            # Single-valued forward relations are joined, the others prefetched
+            joined = model_field.many_to_one or (model_field.one_to_one and model_field.concrete)
+            related = QueryPlan(model_field.related_model, joined=joined)
+            if model_field.one_to_many:
+                # The reverse foreign key is needed to attach prefetched rows
+                related.columns.add(model_field.field.attname)
+            self.relations[name] = related
+        return self.relations[name]
+
+    def add_serializer(self, serializer):
+        self.serializer = serializer
+        requirements = getattr(serializer, 'field_requirements', {})
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in requirements:
+                for path in requirements[name]:
+                    self.add_path(path)
+                continue
+            source = field.source.replace('__', '.')
+            if source == '*':
+                self.narrow = False
+                continue
+            nested = nested_serializer(field)
+            if nested is None:
+                self.add_path(source)
+                continue
+            try:
+                model_field = self.model._meta.get_field(source.split('.')[0])
+            except FieldDoesNotExist:
+                self.narrow = False
+                continue
+            if model_field.concrete and not model_field.many_to_many:
+                self.columns.add(model_field.attname)
+            self.relation(source, model_field).add_serializer(nested)
+        return self
+
+    def collect(self, prefix=''):
+        """Return the only() columns, select_related() paths and prefetches of this plan."""
+        columns = [prefix + column for column in self.columns]
+        selects, prefetches, narrow = [], [], self.narrow
+        for name, plan in self.relations.items():
+            if plan.joined:
+                selects.append(prefix + name)
+                related = plan.collect(prefix + name + '__')
+                columns += related[0]
+                selects += related[1]
+                prefetches += related[2]
+                narrow = narrow and related[3]
+            else:
+                queryset = plan.apply(plan.model._default_manager.all())
+                prefetches.append(Prefetch(prefix + name, queryset=queryset))
+        return columns, selects, prefetches, narrow
+
+    def apply(self, queryset):
+        if self.serializer is not None and hasattr(self.serializer, 'prepare_queryset'):
+            queryset = self.serializer.prepare_queryset(queryset)
+        columns, selects, prefetches, narrow = self.collect()
+        if selects:
+            queryset = queryset.select_related(*selects)
+        if narrow:
+            queryset = queryset.only(*columns)
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        return queryset
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin reading `?fields=` and `?expand=` from the request in
+    the serializer context. Only the top level serializer applies them.
+
+    `field_requirements` maps fields that are not plain model attributes
+    (method fields, totals) to the dotted model paths they read, so that
+    `plan_queryset` can still load them. `prepare_queryset` can add the
+    annotations such fields read instead.
+    """
+
+    field_requirements = {}
+
+    def prepare_queryset(self, queryset):
+        return queryset
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.requested_fieldset()
+        if fieldset is not None:
+            prune_fields(fields, *fieldset)
+        return fields
+
+    def requested_fieldset(self):
+        parent = getattr(self, 'parent', None)
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        request = self.context.get('request')
+        if parent is not None or request is None:
+            return None
+        params = getattr(request, 'query_params', request.GET)
+        if 'fields' not in params:
+            return None
+        return parse_fieldset(params['fields']), parse_fieldset(params.get('expand'))
+
+    def plan_queryset(self, queryset, extra_columns=()):
+        plan = QueryPlan(queryset.model).add_serializer(self)
+        for path in extra_columns:
+            plan.add_path(path)
+        return plan.apply(queryset)
+
+
+class SparseFieldsetViewMixin:
+    """
+    View mixin narrowing the filtered queryset to what the serializer will
+    render, for read requests whose serializer uses SparseFieldsetMixin.
+    """
+
+    def filter_queryset(self, queryset):
+        return self.sparse_queryset(super().filter_queryset(queryset))
+
+    def sparse_queryset(self, queryset):
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        serializer = self.get_serializer()
+        if not isinstance(serializer, SparseFieldsetMixin):
+            return queryset
+        # Ordering fields are read back by the cursor pagination
+        ordering = [field.lstrip('-') for field in queryset.query.order_by if isinstance(field, str)]
+        return serializer.plan_queryset(queryset, extra_columns=[
+            field for field in ordering if field != '?' and field not in queryset.query.annotations
+        ])
@@ -1,17 +1,37 @@
 from django_filters import rest_framework as filters
-from FashionPlace.models import Product, Category
+from rest_framework.filters import SearchFilter
+from FashionPlace.models import CatalogEntry, Product, Category
+from FashionPlace.search import get_search_backend
 
 class ProductFilter(filters.FilterSet):
     category = filters.ModelChoiceFilter(
         queryset=Category.objects.all(),
-        field_name='category',
+        method='filter_category',
         to_field_name='slug',
         empty_label='All Categories'
     )
 
     class Meta:
-        model = Product
+        model = CatalogEntry
         fields = {
-            'category': ['exact'],
             'price': ['gt', 'lt']
-        }
\ No newline at end of file
+        }
+
+    def filter_category(self, queryset, name, value):
+        # Semi-join on the indexed through table, so products never repeat
+        members = Product.category.through.objects.filter(category=value).values('product_id')
+        return queryset.filter(pk__in=members)
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    `?search=` backed by the product full-text index instead of LIKE
+    lookups on `search_fields`. Results are ranked by relevance unless an
+    explicit `?ordering=` is given, and every term is prefix-matched.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = ' '.join(self.get_search_terms(request))
+        if not query:
+            return queryset
+        return get_search_backend().filter_queryset(queryset, query)
@@ -0,0 +1,90 @@
+"""
+`Idempotency-Key` support for POST endpoints.
+
+`idempotent` wraps a viewset action so that a request sent again with the
+same `Idempotency-Key` header gets the response of the first one replayed,
+without the action running twice. The key is claimed in the same
+transaction as the action's own writes: a concurrent duplicate blocks on
+the key's unique index until the first request commits, then replays its
+response. Only successful responses are kept; when the action fails the
+key is released with its transaction and a retry runs it again.
+
+Keys are scoped to the authenticated user. The header is ignored on
+anonymous requests: with no user to scope them to, a client that learned
+or guessed another's key would be replayed that client's response. A key
+reused with a different method, path or body is answered with
+422 Unprocessable Entity. After IDEMPOTENCY_KEY_TTL seconds a key may be
+reused for a new request; `manage.py purge_idempotency_keys` deletes the
+expired ones.
+"""
+import functools
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from drf_yasg import openapi
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from FashionPlace.models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+
+IDEMPOTENCY_KEY_PARAMETER = openapi.Parameter(
+    HEADER, openapi.IN_HEADER, type=openapi.TYPE_STRING, required=False,
+    description="Unique key of the request; authenticated retries sent with the same key replay the first response")
+
+
+class IdempotencyKeyMismatch(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was used with a different request."
+    default_code = 'idempotency_key_mismatch'
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.path.encode(), request.body):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def idempotent(action):
+    @functools.wraps(action)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or not request.user.is_authenticated:
+            return action(self, request, *args, **kwargs)
+        if not key or len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            raise ValidationError({HEADER: "Send a key of 1 to 255 characters."})
+
+        owner = request.user
+        fingerprint = request_fingerprint(request)
+        now = timezone.now()
+        with transaction.atomic():
+            record, created = IdempotencyKey.objects.select_for_update().get_or_create(
+                owner=owner, key=key, defaults={'fingerprint': fingerprint, 'created_at': now})
+            if not created and record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL):
+                # An expired key starts over as if it had never been used
+                record.fingerprint, record.created_at = fingerprint, now
+                record.status_code = record.response = None
+                created = True
+            if not created:
+                if record.fingerprint != fingerprint:
+                    raise IdempotencyKeyMismatch()
+                return Response(record.response, status=record.status_code,
+                                headers={'Idempotent-Replayed': 'true'})
+
+            response = action(self, request, *args, **kwargs)
+            if status.is_success(response.status_code):
+                record.status_code, record.response = response.status_code, response.data
+                record.save()
+            else:
+                transaction.set_rollback(True)
+            return response
+
+    return wrapper
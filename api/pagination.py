@@ -0,0 +1,171 @@
+import json
+from base64 import b64decode, b64encode
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on the full ordering key.
+
+    The cursor holds the values of every ordering field for the last (or
+    first) row of the page, so the next page is fetched with a
+    `WHERE (price, product_id) > (...)` style condition instead of an OFFSET,
+    and no COUNT(*) is ever issued. Whatever ordering the filter backends
+    have already applied (OrderingFilter, search ranking) is kept and the
+    `tiebreaker` field is appended so that every position is unique.
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('id',)
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request, queryset)
+
+        if self.cursor is None:
+            values, self.reverse = None, False
+        else:
+            values, self.reverse = self.cursor
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [self._flip(field) for field in ordering]
+
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek(ordering, values))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        ordering = [str(field) for field in queryset.query.order_by] or list(self.ordering)
+        ordering = [field for field in ordering if field.lstrip('-') not in ('pk', '?')]
+
+        if not any(field.lstrip('-') == self.tiebreaker for field in ordering):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-' + self.tiebreaker if descending else self.tiebreaker)
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def decode_cursor(self, request, queryset=None):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            data = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            values = data['v']
+            reverse = bool(data.get('r', False))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        if queryset is not None:
+            # A tampered value would otherwise fail in the query, as a 500
+            try:
+                values = [
+                    self._ordering_field(queryset, field.lstrip('-')).to_python(value)
+                    for field, value in zip(self.ordering, values)
+                ]
+            except (DjangoValidationError, FieldDoesNotExist, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+            if any(value is None for value in values):
+                raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, instance, reverse):
+        values = [self._position(instance, field.lstrip('-')) for field in self.ordering]
+        data = {'v': values}
+        if reverse:
+            data['r'] = 1
+        encoded = b64encode(json.dumps(data, default=str).encode('utf-8')).decode('ascii')
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def _seek(self, ordering, values):
+        """
+        Build the row-value comparison for the given ordering as an OR of
+        ANDs, e.g. `price > p OR (price = p AND product_id > id)`.
+        """
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            branch = Q(**{'%s__%s' % (name, lookup): values[index]})
+            for previous, value in zip(ordering[:index], values):
+                branch &= Q(**{previous.lstrip('-'): value})
+            condition |= branch
+        return condition
+
+    @staticmethod
+    def _ordering_field(queryset, name):
+        """The model field or annotation output field an ordering name refers to."""
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model, parts = queryset.model, name.split(LOOKUP_SEP)
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+        return model._meta.get_field(parts[-1])
+
+    def _position(self, instance, field):
+        if isinstance(instance, dict):
+            return instance[field]
+        return getattr(instance, field)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    ordering = ('product_id',)
+    tiebreaker = 'product_id'
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    ordering = ('-placed_at', '-id')
@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    orjson's compact UTF-8 output matches the stock renderer's defaults
+    (COMPACT_JSON, UNICODE_JSON, STRICT_JSON) once U+2028/U+2029 are
+    escaped the same way. Indented output, other settings, and anything
+    orjson rejects (non-string keys, integers over 64 bits) go through
+    JSONRenderer unchanged. Floats are the one difference: orjson writes
+    1e-7 where json writes 1e-07 and NaN as null, and no endpoint renders
+    floats.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii or not self.strict:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class NDJSONRenderer(BaseRenderer):
+    """One compact JSON document per line."""
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.render_row(row) for row in rows).encode(self.charset)
+
+    def render_row(self, row):
+        return json.dumps(row, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Flat CSV. Lists of nested objects (such as a product's categories) are
+    written as their `slug` values joined with '|', other nested objects as
+    compact JSON.
+    """
+
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        if not rows:
+            return b''
+        header = list(rows[0])
+        return (self.render_header(header) + self.render_rows(header, rows)).encode(self.charset)
+
+    def render_header(self, header):
+        return self._write([header])
+
+    def render_rows(self, header, rows):
+        return self._write([[self.flatten(row.get(column)) for column in header] for row in rows])
+
+    @staticmethod
+    def flatten(value):
+        if isinstance(value, list):
+            return '|'.join(str(item.get('slug', '') if isinstance(item, dict) else item) for item in value)
+        if isinstance(value, dict):
+            return json.dumps(value, cls=encoders.JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+        if value is None:
+            return ''
+        return value
+
+    @staticmethod
+    def _write(rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
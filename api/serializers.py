@@ -1,8 +1,16 @@
 from FashionPlace.models import *
 from rest_framework import serializers
 from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
 from rest_framework.validators import ValidationError
+from rest_framework.exceptions import NotFound
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from FashionPlace.carts import MAX_QUANTITY, QuantityLimitExceeded, cart_store, merge_cart
+from FashionPlace.renditions import rendition_srcset
+from FashionPlace.sales import record_orders
+from api.fieldsets import SparseFieldsetMixin
 
 
 User = get_user_model()
@@ -35,14 +43,72 @@ class SignUpSerializer(serializers.ModelSerializer):
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = '__all__'
+        exclude = ['updated_at']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class RenditionsField(serializers.Field):
+    """
+    Render an image as a srcset per format of its fixed-width renditions,
+    e.g. `{"webp": "<url> 200w, <url> 400w", "jpeg": ...}`, or null until
+    they have been generated.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'image')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return rendition_srcset(getattr(value, 'name', value), self.context.get('request', None))
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category = CategorySerializer(many=True)
+    renditions = RenditionsField()
     class Meta:
         model = Product
-        fields = '__all__'
+        fields = ['product_id', 'category', 'name', 'price', 'image', 'new_arrivals', 'top_rated', 'trending',
+                  'renditions']
+
+
+
+class StorageURLField(serializers.CharField):
+    """Render a stored file name as its (absolute) URL, like ImageField does."""
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = default_storage.url(value)
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class CatalogCategoryField(serializers.Field):
+    """Render the denormalized categories exactly like CategorySerializer(many=True)."""
+
+    def to_representation(self, value):
+        return [
+            {'id': category['id'], 'name': category['name'], 'slug': category['slug']}
+            for category in value
+        ]
+
+
+class CatalogEntrySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Serializes the CatalogEntry read model with the same shape as
+    ProductSerializer, without touching Product or Category.
+    """
+    product_id = serializers.UUIDField(source='pk', read_only=True)
+    category = CatalogCategoryField(source='categories', read_only=True)
+    image = StorageURLField(read_only=True)
+    renditions = RenditionsField()
+
+    class Meta:
+        model = CatalogEntry
+        fields = ['product_id', 'category', 'name', 'price', 'image', 'new_arrivals', 'top_rated', 'trending',
+                  'renditions']
 
     
 class SimpleProductSerializer(serializers.ModelSerializer):
@@ -51,45 +117,42 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         fields = ["product_id","name", "price"]
         
         
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = SimpleProductSerializer(many=False)
     sub_total = serializers.SerializerMethodField( method_name="cart_quantity")
+    field_requirements = {"sub_total": []}
     class Meta:
         model= CartItem
         fields = ["id", "cart", "product", "quantity", "sub_total"]
+
+    def prepare_queryset(self, queryset):
+        if "sub_total" in self.fields:
+            queryset = queryset.with_sub_total()
+        return queryset
         
     def cart_quantity(self, cartitem:CartItem):
-        return cartitem.quantity * cartitem.product.price
+        return cartitem.get_total
 
 
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.UUIDField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError("There is no product associated with the given ID")
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Quantity cannot be zero or negative")
         return value
     
     def save(self, **kwargs):
-        cart_id = self.context["cart_id"]
-        product_id = self.validated_data["product_id"]
-        quantity = self.validated_data["quantity"]
-
         try:
-            cartitem = CartItem.objects.get(product_id=product_id, cart_id=cart_id)
-            cartitem.quantity += quantity
-            
-            if cartitem.quantity <= 0:
-                cartitem.delete()
-                raise serializers.ValidationError("Cartitem cannot be zero or negative")
-            cartitem.save()
-
-            self.instance = cartitem
-        except:
-            if quantity > 0:
-                self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-            else:
-                raise serializers.ValidationError("Quantity cannot be zero or negative")
+            self.instance = cart_store().add_item(
+                self.context["cart_id"], self.validated_data["product_id"], self.validated_data["quantity"])
+        except Cart.DoesNotExist:
+            raise NotFound("There is no cart associated with the given ID")
+        except QuantityLimitExceeded:
+            raise serializers.ValidationError(
+                {"quantity": ["A cart line cannot hold more than %d items" % MAX_QUANTITY]})
+        if self.instance is None:
+            raise serializers.ValidationError({"product_id": ["There is no product associated with the given ID"]})
 
         return self.instance
 
@@ -104,58 +167,134 @@ class UpdateCartItemSerializer(serializers.ModelSerializer):
         fields = ["quantity"]
 
 
-class CartSerializer(serializers.ModelSerializer):
+class BulkCartItemListSerializer(serializers.ListSerializer):
+    """
+    Applies a list of {product_id, quantity} operations to one cart: each
+    line is created or set to the given quantity, and a quantity of 0
+    removes it. When a product appears twice the last operation wins.
+    """
+
+    def validate(self, attrs):
+        quantities = {item["product_id"]: item["quantity"] for item in attrs}
+        found = set(Product.objects.filter(pk__in=list(quantities)).values_list("pk", flat=True))
+        missing = [str(product_id) for product_id in quantities if product_id not in found]
+        if missing:
+            raise serializers.ValidationError(
+                {"product_id": ["There is no product associated with the IDs %s" % ", ".join(missing)]})
+        return quantities
+
+    def save(self, **kwargs):
+        cart_id = self.context["cart_id"]
+        try:
+            cart_store().set_quantities(cart_id, self.validated_data)
+        except Cart.DoesNotExist:
+            raise NotFound("There is no cart associated with the given ID")
+        return cart_id
+
+
+class BulkCartItemSerializer(serializers.Serializer):
+    product_id = serializers.UUIDField()
+    quantity = serializers.IntegerField(min_value=0, max_value=32767)
+
+    class Meta:
+        list_serializer_class = BulkCartItemListSerializer
+
+
+class CartSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     grand_total = serializers.SerializerMethodField(method_name='cart_total')
+    field_requirements = {"grand_total": []}
     
     class Meta:
         model = Cart
         fields = ["id", "items", "grand_total"]
+
+    def prepare_queryset(self, queryset):
+        if "grand_total" in self.fields:
+            queryset = queryset.with_totals()
+        return queryset
+
+    def create(self, validated_data):
+        return cart_store().create_cart()
            
     def cart_total(self, cart: Cart):
-        items = cart.items.all()
-        total = sum([item.quantity * item.product.price for item in items])
-        return total
+        return cart.get_cart_total
+
 
+class MergeCartSerializer(serializers.Serializer):
+    cart_id = serializers.UUIDField(required=False)
+    session_id = serializers.CharField(max_length=100, required=False)
 
-class OrderItemSerializer(serializers.ModelSerializer):
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError("Provide the cart_id or the session_id of the cart to merge")
+        return attrs
+
+    def save(self, **kwargs):
+        """Merge the anonymous cart into the user's cart and return the latter, or None."""
+        return merge_cart(self.context["user"], **self.validated_data)
+
+
+def merge_login_cart(data, user):
+    """
+    Merge the anonymous cart named in a login request into the user's
+    cart. Logging in never fails because of it: a missing or invalid cart
+    is ignored.
+    """
+    serializer = MergeCartSerializer(data=data, context={"user": user})
+    if not serializer.is_valid():
+        return None
+    return serializer.save()
+
+
+class OrderItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product = SimpleProductSerializer()
     class Meta:
         model = OrderItem 
-        fields = ["id", "product", "quantity"]
+        fields = ["id", "product", "quantity", "unit_price"]
         
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     class Meta:
         model = Order 
-        fields = ['id', "placed_at", "pending_status", "owner", "items"]
+        fields = ['id', "placed_at", "pending_status", "owner", "total", "items"]
         
 
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
     
-    def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
-            raise serializers.ValidationError("This cart_id is invalid")
-        
-        elif not CartItem.objects.filter(cart_id=cart_id).exists():
-            raise serializers.ValidationError("Sorry your cart is empty")
-        
-        return cart_id
-    
     def save(self, **kwargs):
+        cart_id = self.validated_data["cart_id"]
+        cart_store().flush([cart_id])
         with transaction.atomic():
-            cart_id = self.validated_data["cart_id"]
-            user_id = self.context["user_id"]
-            order = Order.objects.create(owner_id = user_id)
-            cartitems = CartItem.objects.filter(cart_id=cart_id)
-            orderitems = [
-                OrderItem(order=order, product=item.product, quantity=item.quantity)
-            for item in cartitems
-            ]
-            OrderItem.objects.bulk_create(orderitems)
+            # One LEFT JOIN loads the lines with their current price while
+            # locking the cart, so that the lines cannot change before they
+            # are ordered: no row means there is no such cart, a row of
+            # NULLs an empty one
+            rows = list(
+                Cart.objects.select_for_update(of=("self",)).filter(pk=cart_id)
+                .values_list("items__product_id", "items__quantity", "items__product__price")
+            )
+            if not rows:
+                raise serializers.ValidationError({"cart_id": ["This cart_id is invalid"]})
+            lines = [row for row in rows if row[0] is not None and row[1]]
+            if not lines:
+                raise serializers.ValidationError({"cart_id": ["Sorry your cart is empty"]})
+
+            order = Order.objects.create(
+                owner_id=self.context["user_id"],
+                total=sum(quantity * price for _, quantity, price in lines),
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=price)
+                for product_id, quantity, price in lines
+            ])
+            # Recorded once the order is committed, so that checkouts do not
+            # queue on the day's rollup row; `rebuild_sales_rollups` repairs
+            # a recording lost to a crash in between
+            transaction.on_commit(lambda: record_orders([order.pk]))
             # Cart.objects.filter(id=cart_id).delete()
             return order
 
@@ -166,6 +305,19 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
         fields = ["pending_status"]
 
 
+class SalesReportSerializer(serializers.Serializer):
+    start = serializers.DateField(required=False, help_text="First day, 29 days before the end by default")
+    end = serializers.DateField(required=False, help_text="Last day, today by default")
+    status = serializers.CharField(max_length=50, required=False, help_text="Payment status, all by default")
+
+    def validate(self, attrs):
+        attrs.setdefault("end", timezone.localdate())
+        attrs.setdefault("start", attrs["end"] - timedelta(days=29))
+        if attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError("The start of the report must not be after its end")
+        return attrs
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = Profile
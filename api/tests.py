@@ -6,6 +6,32 @@ from django.contrib.auth import get_user_model
 from FashionPlace.models import *
 from api.serializers import *
 from rest_framework.authtoken.models import Token
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.template import engines
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from FashionPlace.carts import cart_store, reap_carts
+from FashionPlace.catalog import category_cache, current_version
+from FashionPlace.sales import record_orders
+from FashionPlace import jobs, tasks
+from django.core import mail
+from django.db import IntegrityError, OperationalError, connection
+from datetime import timedelta
+from io import StringIO
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ValidationError
+from api.renderers import FastJSONRenderer
 
 
 User = get_user_model()
@@ -40,6 +66,53 @@ class CategoryViewSetTestCase(APITestCase):
         self.assertEqual(response.data, serializer.data)
 
 
+class CategoryCacheTestCase(APITestCase):
+    def setUp(self):
+        category_cache.clear()
+        self.category = Category.objects.create(name="Watches", slug="watches")
+
+    def render_links(self):
+        template = engines["django"].from_string("{% for c in categories %}{{ c.name }};{% endfor %}")
+        return template.render({}, RequestFactory().get("/"))
+
+    def test_context_processor_uses_cache(self):
+        self.assertEqual(self.render_links(), "Watches;")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render_links(), "Watches;")
+
+    def test_category_list_uses_cache(self):
+        url = reverse("category-list")
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data, CategorySerializer(Category.objects.all(), many=True).data)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_cache_is_invalidated_by_edits(self):
+        url = reverse("category-list")
+        self.render_links()
+
+        self.category.name = "Timepieces"
+        self.category.save()
+        self.assertEqual(self.render_links(), "Timepieces;")
+
+        Category.objects.create(name="Rings", slug="rings")
+        response = self.client.get(url)
+        self.assertEqual([item["name"] for item in response.data], ["Timepieces", "Rings"])
+
+        self.category.delete()
+        self.assertEqual(self.render_links(), "Rings;")
+
+    @override_settings(CATEGORY_CACHE_TTL=0)
+    def test_cache_expires(self):
+        self.render_links()
+        Category.objects.filter(pk=self.category.pk).update(name="Clocks")
+        self.assertEqual(self.render_links(), "Clocks;")
+
+
 class ProductViewSetTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -59,11 +132,73 @@ class ProductViewSetTestCase(APITestCase):
 
         url = reverse("product-list")
         response = self.client.get(url)
-        products = Product.objects.all()
+        products = Product.objects.order_by("product_id")
         serializer = ProductSerializer(products, many=True)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data["results"], serializer.data)
+
+    def test_list_products_paginates_by_price(self):
+        for price in [30, 10, 20, 10, 40]:
+            Product.objects.create(name="Product %s" % price, price=price)
+
+        url = reverse("product-list")
+        response = self.client.get(url, {"ordering": "price", "page_size": 2})
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [(item["price"], item["product_id"]) for item in response.data["results"]]
+            if response.data["next"] is None:
+                break
+            response = self.client.get(response.data["next"])
+
+        expected = [
+            (product.price, str(product.product_id))
+            for product in Product.objects.order_by("price", "product_id")
+        ]
+        self.assertEqual(seen, expected)
+
+        # Walking back from the last page returns the previous page
+        response = self.client.get(response.data["previous"])
+        self.assertEqual(
+            [(item["price"], item["product_id"]) for item in response.data["results"]],
+            expected[2:4],
+        )
+
+    def test_list_products_deep_page_uses_keyset(self):
+        for price in range(10):
+            Product.objects.create(name="Product %s" % price, price=price)
+
+        url = reverse("product-list")
+        response = self.client.get(url, {"ordering": "-price", "page_size": 3})
+        response = self.client.get(response.data["next"])
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(response.data["next"])
+
+        self.assertEqual([item["price"] for item in response.data["results"]], [3, 2, 1])
+        sql = " ".join(query["sql"] for query in context.captured_queries).upper()
+        self.assertNotIn("OFFSET", sql)
+        self.assertNotIn("COUNT(", sql)
+
+    def test_list_products_invalid_cursor(self):
+        url = reverse("product-list")
+        response = self.client.get(url, {"cursor": "not-a-cursor"})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_products_tampered_cursor_values(self):
+        def cursor(values):
+            return base64.b64encode(json.dumps({"v": values}).encode()).decode()
+
+        url = reverse("product-list")
+        for params in ({"cursor": cursor(["abc"])}, {"cursor": cursor(["abc", str(uuid.uuid4())]), "ordering": "price"},
+                       {"cursor": cursor([None])}, {"cursor": cursor([[1]])}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, params)
+        self.client.force_authenticate(user=User.objects.create_user(email="buyer@example.com", password="secret"))
+        response = self.client.get(reverse("orders-list"), {"cursor": cursor(["yesterday", 1])})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_retrieve_product(self):
         # Create a sample category
@@ -81,6 +216,770 @@ class ProductViewSetTestCase(APITestCase):
         self.assertEqual(response.data, serializer.data)
 
 
+class ProductQueryCountTestCase(APITestCase):
+    def create_catalog(self, size):
+        categories = [
+            Category.objects.create(name="Category %s" % index, slug="category-%s" % index)
+            for index in range(3)
+        ]
+        products = Product.objects.bulk_create(
+            Product(name="Product %s" % index, price=index % 100) for index in range(size)
+        )
+        Through = Product.category.through
+        Through.objects.bulk_create(
+            Through(product_id=product.pk, category_id=category.pk)
+            for product in products
+            for category in categories[:2]
+        )
+        call_command("rebuild_catalog", stdout=StringIO())
+        return products
+
+    def assert_constant_queries(self, size):
+        products = self.create_catalog(size)
+        list_url = reverse("product-list")
+        detail_url = reverse("product-detail", args=[products[0].pk])
+
+        # One catalog version lookup for the ETag, then the page itself
+        with self.assertNumQueries(2):
+            response = self.client.get(list_url, {"page_size": 100})
+        self.assertEqual(len(response.data["results"]), min(size, 100))
+        self.assertEqual(len(response.data["results"][0]["category"]), 2)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(list_url, {"category": "category-0", "page_size": 100})
+        self.assertEqual(len(response.data["results"]), min(size, 100))
+
+        with self.assertNumQueries(2):
+            response = self.client.get(detail_url)
+        self.assertEqual(len(response.data["category"]), 2)
+
+    def test_query_count_10_products(self):
+        self.assert_constant_queries(10)
+
+    def test_query_count_1000_products(self):
+        self.assert_constant_queries(1000)
+
+    def test_query_count_10000_products(self):
+        self.assert_constant_queries(10000)
+
+    def test_category_filter_returns_distinct_products(self):
+        self.create_catalog(5)
+        url = reverse("product-list")
+        response = self.client.get(url, {"category": "category-1"})
+
+        ids = [item["product_id"] for item in response.data["results"]]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+
+
+class CatalogEntryTestCase(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Dresses", slug="dresses")
+        self.product = Product.objects.create(name="Summer Dress", price=50, trending=True)
+        self.product.category.add(self.category)
+
+    def test_entry_follows_product_and_categories(self):
+        entry = CatalogEntry.objects.get(pk=self.product.pk)
+        self.assertEqual(entry.name, "Summer Dress")
+        self.assertTrue(entry.trending)
+        self.assertEqual(entry.categories, [{"id": self.category.id, "name": "Dresses", "slug": "dresses"}])
+
+        self.product.price = 45
+        self.product.save()
+        self.category.name = "Gowns"
+        self.category.save()
+        entry.refresh_from_db()
+        self.assertEqual(entry.price, 45)
+        self.assertEqual(entry.categories[0]["name"], "Gowns")
+
+        self.category.delete()
+        entry.refresh_from_db()
+        self.assertEqual(entry.categories, [])
+
+        self.product.delete()
+        self.assertFalse(CatalogEntry.objects.exists())
+
+    def test_rebuild_catalog_command(self):
+        CatalogEntry.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_catalog", chunk_size=1, stdout=out)
+
+        self.assertIn("Rebuilt 1 catalog entries", out.getvalue())
+        url = reverse("product-detail", args=[self.product.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.data, ProductSerializer(self.product, context={"request": response.wsgi_request}).data)
+
+
+class ProductSearchTestCase(APITestCase):
+    def setUp(self):
+        self.shoes = Category.objects.create(name="Shoes", slug="shoes")
+        self.jacket = Product.objects.create(name="Leather Jacket", price=120)
+        self.boots = Product.objects.create(name="Leather Boots", price=90)
+        self.boots.category.add(self.shoes)
+        self.watch = Product.objects.create(name="Gold Watch", price=300)
+
+    def search(self, query, **params):
+        response = self.client.get(reverse("product-list"), {"search": query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item["name"] for item in response.data["results"]]
+
+    def test_search_matches_prefixes(self):
+        self.assertEqual(sorted(self.search("leath")), ["Leather Boots", "Leather Jacket"])
+        self.assertEqual(self.search("leather jack"), ["Leather Jacket"])
+        self.assertEqual(self.search("silver"), [])
+
+    def test_search_matches_category_names(self):
+        self.assertEqual(self.search("shoes"), ["Leather Boots"])
+
+    def test_search_ranks_name_matches_first(self):
+        sneakers = Product.objects.create(name="Canvas Shoes", price=40)
+        self.assertEqual(self.search("shoes"), ["Canvas Shoes", "Leather Boots"])
+        self.assertEqual(self.search("shoes", ordering="-price"), ["Leather Boots", "Canvas Shoes"])
+
+    def test_search_index_follows_changes(self):
+        self.watch.name = "Silver Watch"
+        self.watch.save()
+        self.assertEqual(self.search("silver"), ["Silver Watch"])
+        self.assertEqual(self.search("gold"), [])
+
+        self.jacket.category.add(self.shoes)
+        self.assertEqual(sorted(self.search("shoes")), ["Leather Boots", "Leather Jacket"])
+
+        self.shoes.name = "Footwear"
+        self.shoes.save()
+        self.assertEqual(self.search("shoes"), [])
+        self.assertEqual(sorted(self.search("footwear")), ["Leather Boots", "Leather Jacket"])
+
+        self.shoes.products.clear()
+        self.assertEqual(self.search("footwear"), [])
+
+        self.boots.delete()
+        self.assertEqual(self.search("leather"), ["Leather Jacket"])
+
+    def test_search_results_paginate(self):
+        for index in range(5):
+            Product.objects.create(name="Leather Belt %s" % index, price=index)
+
+        response = self.client.get(reverse("product-list"), {"search": "leather", "page_size": 3})
+        names = [item["name"] for item in response.data["results"]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            names += [item["name"] for item in response.data["results"]]
+
+        self.assertEqual(len(names), 7)
+        self.assertEqual(len(set(names)), 7)
+
+    def test_search_applies_filters_before_ranking(self):
+        # Better ranked matches outside the filter must not crowd out the
+        # matches inside it
+        for index in range(600):
+            Product.objects.create(name="Leather Belt %s" % index, price=index % 50)
+
+        self.assertEqual(self.search("leather", category="shoes"), ["Leather Boots"])
+        response = self.client.get(reverse("product-facets"), {"search": "leather"})
+        self.assertEqual(response.data["count"], 602)
+
+
+class CatalogConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Bags", slug="bags")
+        self.product = Product.objects.create(name="Tote Bag", price=35)
+        self.product.category.add(self.category)
+
+    def assert_not_modified(self, url, queries=1, **headers):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    def test_products_etag_round_trip(self):
+        url = reverse("product-list")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn("Last-Modified", response)
+
+        self.assert_not_modified(url, HTTP_IF_NONE_MATCH=etag)
+        self.assert_not_modified(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+
+        # Another page or filter is another representation
+        response = self.client.get(url, {"ordering": "price"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_products_etag_changes_with_catalog(self):
+        url = reverse("product-detail", args=[self.product.pk])
+        etags = [self.client.get(url)["ETag"]]
+
+        self.product.price = 30
+        self.product.save()
+        etags.append(self.client.get(url)["ETag"])
+
+        self.product.category.remove(self.category)
+        etags.append(self.client.get(url)["ETag"])
+
+        Product.objects.create(name="Clutch", price=20).delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etags.append(response["ETag"])
+
+        self.assertEqual(len(set(etags)), 4)
+
+    def test_categories_etag_round_trip(self):
+        url = reverse("category-list")
+        etag = self.client.get(url)["ETag"]
+        self.assert_not_modified(url, queries=0, HTTP_IF_NONE_MATCH=etag)
+
+        self.category.name = "Handbags"
+        self.category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["name"], "Handbags")
+
+
+class ProductFacetsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category_cache.clear()
+        self.shirts = Category.objects.create(name="Shirts", slug="shirts")
+        self.sale = Category.objects.create(name="Sale", slug="sale")
+        for price, categories, flags in [
+            (10, [self.shirts, self.sale], {"trending": True}),
+            (30, [self.shirts], {"new_arrivals": True}),
+            (60, [self.shirts], {"trending": True, "top_rated": True}),
+            (250, [self.sale], {}),
+        ]:
+            product = Product.objects.create(name="Linen Shirt %s" % price, price=price, **flags)
+            product.category.add(*categories)
+        self.url = reverse("product-facets")
+
+    def test_facets(self):
+        response = self.client.get(self.url, {"price_buckets": "0,50,100"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual(
+            [(facet["slug"], facet["count"]) for facet in response.data["categories"]],
+            [("shirts", 3), ("sale", 2)],
+        )
+        self.assertEqual(response.data["price"], [
+            {"min": 0, "max": 50, "count": 2},
+            {"min": 50, "max": 100, "count": 1},
+            {"min": 100, "max": None, "count": 1},
+        ])
+        self.assertEqual(response.data["flags"], {"new_arrivals": 1, "top_rated": 1, "trending": 2})
+
+    def test_facets_follow_filters_and_search(self):
+        response = self.client.get(self.url, {"category": "sale", "price__lt": 100})
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(
+            [(facet["slug"], facet["count"]) for facet in response.data["categories"]],
+            [("sale", 1), ("shirts", 1)],
+        )
+
+        response = self.client.get(self.url, {"search": "shirt", "price__gt": 20})
+        self.assertEqual(response.data["count"], 3)
+        self.assertEqual(response.data["flags"]["trending"], 1)
+
+    def test_facets_use_bounded_queries_and_cache(self):
+        params = {"category": "shirts", "price_buckets": "0,20,40,60,80"}
+        category_cache.get()
+        # Category slug lookup, the aggregate and the category GROUP BY
+        with self.assertNumQueries(3):
+            first = self.client.get(self.url, params)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url, dict(params, cursor="ignored", ordering="price"))
+        self.assertEqual(first.data, second.data)
+
+    def test_facets_reject_invalid_buckets(self):
+        response = self.client.get(self.url, {"price_buckets": "cheap,dear"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductCollectionTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.first = Product.objects.create(name="Denim Jacket", price=80, trending=True)
+        self.second = Product.objects.create(name="Wool Coat", price=150, trending=True, top_rated=True)
+        self.other = Product.objects.create(name="Plain Tee", price=15, new_arrivals=True)
+
+    def names(self, url_name, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item["name"] for item in response.data]
+
+    def test_collections(self):
+        self.assertEqual(self.names("product-trending"), ["Wool Coat", "Denim Jacket"])
+        self.assertEqual(self.names("product-top-rated"), ["Wool Coat"])
+        self.assertEqual(self.names("product-new-arrivals"), ["Plain Tee"])
+        self.assertEqual(self.names("product-trending", limit=1), ["Wool Coat"])
+
+    def test_collection_is_one_lookup_plus_one_fetch(self):
+        url = reverse("product-trending")
+        # Catalog version, ranked ids from the partial index, batched fetch
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.data[0], CatalogEntrySerializer(
+            CatalogEntry.objects.get(pk=self.second.pk), context={"request": response.wsgi_request}).data)
+
+    def test_collection_refreshes_when_flags_change(self):
+        self.assertEqual(self.names("product-trending"), ["Wool Coat", "Denim Jacket"])
+
+        self.second.trending = False
+        self.second.save()
+        self.assertEqual(self.names("product-trending"), ["Denim Jacket"])
+
+        self.other.trending = True
+        self.other.save()
+        self.assertEqual(self.names("product-trending"), ["Plain Tee", "Denim Jacket"])
+
+        # Editing a product does not move it up
+        self.first.name = "Denim Shirt"
+        self.first.save()
+        self.assertEqual(self.names("product-trending"), ["Plain Tee", "Denim Shirt"])
+
+        self.first.delete()
+        self.assertEqual(self.names("product-trending"), ["Plain Tee"])
+
+    def test_collection_follows_changes_made_by_other_processes(self):
+        self.assertEqual(self.names("product-trending"), ["Wool Coat", "Denim Jacket"])
+
+        # No receiver runs here, as for a change made by another worker
+        # whose cache this process does not share
+        Product.objects.filter(pk=self.second.pk).update(trending=False, updated_at=timezone.now())
+        CatalogEntry.objects.filter(pk=self.second.pk).update(trending=False)
+        self.assertEqual(self.names("product-trending"), ["Denim Jacket"])
+
+
+class ImportProductsTestCase(APITestCase):
+    def setUp(self):
+        self.tops = Category.objects.create(name="Tops", slug="tops")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        out, self.err = StringIO(), StringIO()
+        call_command("import_products", path, stdout=out, stderr=self.err, **options)
+        return out.getvalue()
+
+    def test_import_csv(self):
+        path = self.write("products.csv", (
+            "sku,name,price,categories,trending\n"
+            "TOP-1,Silk Blouse,45,tops|new-in,true\n"
+            "TOP-2,Cotton Tee,12,tops,\n"
+            ",Mystery Box,5,,\n"
+            "TOP-3,,10,tops,\n"
+        ))
+        output = self.run_import(path, create_categories=True)
+
+        self.assertIn("Imported 3 products (1 rows skipped)", output)
+        blouse = Product.objects.get(sku="TOP-1")
+        self.assertTrue(blouse.trending)
+        self.assertEqual(sorted(blouse.category.values_list("slug", flat=True)), ["new-in", "tops"])
+        self.assertEqual(CatalogEntry.objects.count(), 3)
+        self.assertEqual(CatalogEntry.objects.get(pk=blouse.pk).categories[0]["slug"], "tops")
+
+        response = self.client.get(reverse("product-list"), {"search": "silk"})
+        self.assertEqual([item["name"] for item in response.data["results"]], ["Silk Blouse"])
+
+    def test_import_jsonl_upserts_by_sku(self):
+        existing = Product.objects.create(name="Old Name", price=1, sku="TOP-1")
+        existing.category.add(self.tops)
+        path = self.write("products.jsonl", "\n".join(json.dumps(row) for row in [
+            {"sku": "TOP-1", "name": "Linen Shirt", "price": 60, "categories": [], "top_rated": True},
+            {"sku": "TOP-2", "name": "Tank Top", "price": 15, "categories": ["tops", "unknown"]},
+        ]))
+        self.run_import(path)
+
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.price, existing.top_rated), ("Linen Shirt", 60, True))
+        self.assertFalse(existing.category.exists())
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(list(Product.objects.get(sku="TOP-2").category.all()), [self.tops])
+        self.assertFalse(Category.objects.filter(slug="unknown").exists())
+
+    def test_import_jsonl_skips_invalid_lines(self):
+        path = self.write("products.jsonl", "\n".join([
+            json.dumps({"sku": "TOP-1", "name": "Linen Shirt", "price": 60, "categories": "tops|new-in"}),
+            '{"sku": "TOP-2", "name": "Tank',
+            json.dumps({"sku": "TOP-3", "price": 15}),
+            json.dumps({"sku": "TOP-4", "name": None, "price": 15}),
+            json.dumps({"sku": "TOP-5", "name": "  ", "price": 15}),
+            json.dumps(["TOP-6", "Crop Top"]),
+            json.dumps({"sku": "TOP-7", "name": "Crop Top", "categories": {"slug": "tops"}}),
+            json.dumps({"sku": "TOP-8", "name": "Tube Top", "categories": ["tops"]}),
+        ]))
+        output = self.run_import(path, create_categories=True)
+
+        self.assertIn("Imported 2 products (6 rows skipped)", output)
+        self.assertEqual(sorted(Product.objects.values_list("name", flat=True)), ["Linen Shirt", "Tube Top"])
+        self.assertEqual(
+            sorted(Product.objects.get(sku="TOP-1").category.values_list("slug", flat=True)), ["new-in", "tops"])
+        errors = self.err.getvalue()
+        self.assertIn("Skipping line 2: invalid JSON", errors)
+        for number in (3, 4, 5):
+            self.assertIn("Skipping line %d: name is missing" % number, errors)
+        self.assertIn("Skipping line 6: expected a JSON object", errors)
+        self.assertIn("Skipping line 7: categories must be", errors)
+
+    def test_import_skips_values_the_columns_cannot_hold(self):
+        path = self.write("products.csv", (
+            "sku,name,price,image\n"
+            "%s,Long SKU,10,\n"
+            "TOP-2,Long Image,10,%s.jpg\n"
+            "TOP-3,Dear Coat,2147483648,\n"
+            "TOP-4,Cheap Coat,-2147483649,\n"
+            "TOP-5,Coat,2147483647,coat.jpg\n"
+        ) % ("S" * 65, "i" * 97))
+        output = self.run_import(path)
+
+        self.assertIn("Imported 1 products (4 rows skipped)", output)
+        self.assertEqual(Product.objects.get().price, 2147483647)
+        errors = self.err.getvalue()
+        self.assertIn("Skipping line 2: sku is longer than 64 characters", errors)
+        self.assertIn("Skipping line 3: image is longer than 100 characters", errors)
+        self.assertIn("Skipping line 4: price 2147483648 is out of range", errors)
+        self.assertIn("Skipping line 5: price -2147483649 is out of range", errors)
+
+    def test_import_queries_do_not_grow_with_chunk(self):
+        def count_queries(rows):
+            path = self.write("products-%d.csv" % rows, "sku,name,price,categories\n" + "".join(
+                "SKU-%d-%d,Product %d,%d,tops\n" % (rows, index, index, index) for index in range(rows)
+            ))
+            with CaptureQueriesContext(connection) as context:
+                self.run_import(path, chunk_size=rows)
+            return len(context.captured_queries)
+
+        count_queries(1)  # warms the category lookup
+        self.assertEqual(count_queries(5), count_queries(50))
+
+
+class ProductExportTestCase(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Scarves", slug="scarves")
+        for index in range(5):
+            product = Product.objects.create(name="Scarf %s" % index, price=10 + index)
+            if index % 2 == 0:
+                product.category.add(self.category)
+        self.url = reverse("product-export")
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_ndjson(self):
+        response = self.client.get(self.url, {"category": "scarves"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson; charset=utf-8")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(sorted(row["name"] for row in rows), ["Scarf 0", "Scarf 2", "Scarf 4"])
+        self.assertEqual(rows[0]["category"], [{"id": self.category.id, "name": "Scarves", "slug": "scarves"}])
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_csv(self):
+        response = self.client.get(self.url, {"ordering": "-price"}, HTTP_ACCEPT="text/csv")
+
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "product_id,category,name,price,image,new_arrivals,top_rated,trending,renditions")
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[1].endswith(",scarves,Scarf 4,14,,False,False,False,"))
+
+    def test_export_format_query_parameter(self):
+        response = self.client.get(self.url, {"format": "csv", "search": "scarf"})
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        self.assertEqual(len(b"".join(response.streaming_content).decode().splitlines()), 6)
+
+
+class ProductRenditionsTestCase(APITestCase):
+    def setUp(self):
+        from PIL import Image
+
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media.name, IMAGE_RENDITION_WIDTHS=[100, 400], IMAGE_RENDITION_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        Image.new("RGB", (300, 150), "red").save(os.path.join(self.media.name, "shoe.png"))
+
+    def rendition_path(self, name):
+        return os.path.join(self.media.name, "renditions", name)
+
+    def test_renditions_generated_after_commit(self):
+        from PIL import Image
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name="Shoe", image="shoe.png")
+            created_version = current_version()
+
+        self.assertNotEqual(current_version(), created_version)
+        for name in ["shoe-100w.webp", "shoe-100w.jpg", "shoe-400w.webp", "shoe-400w.jpg"]:
+            self.assertTrue(os.path.exists(self.rendition_path(name)), name)
+        with Image.open(self.rendition_path("shoe-100w.webp")) as image:
+            self.assertEqual(image.size, (100, 50))
+        # Images are never upscaled
+        with Image.open(self.rendition_path("shoe-400w.jpg")) as image:
+            self.assertEqual(image.size, (300, 150))
+
+        response = self.client.get(reverse("product-detail", args=[product.pk]))
+        self.assertEqual(response.data["renditions"], {
+            "webp": "http://testserver/image/renditions/shoe-100w.webp 100w, "
+                    "http://testserver/image/renditions/shoe-400w.webp 400w",
+            "jpeg": "http://testserver/image/renditions/shoe-100w.jpg 100w, "
+                    "http://testserver/image/renditions/shoe-400w.jpg 400w",
+        })
+        self.assertEqual(
+            ProductSerializer(product).data["renditions"],
+            CatalogEntrySerializer(product.catalog_entry).data["renditions"],
+        )
+
+    def test_products_without_image_have_no_renditions(self):
+        product = Product.objects.create(name="Shoe")
+        response = self.client.get(reverse("product-detail", args=[product.pk]))
+        self.assertIsNone(response.data["renditions"])
+
+    def test_renditions_advertised_once_generated(self):
+        product = Product.objects.create(name="Shoe", image="shoe.png")
+        url = reverse("product-detail", args=[product.pk])
+        response = self.client.get(url)
+        self.assertIsNone(response.data["renditions"])
+
+        call_command("generate_renditions", workers=0, stdout=StringIO())
+        # Clients revalidating the srcless representation get the new one
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("shoe-400w.jpg 400w", response.data["renditions"]["jpeg"])
+
+        os.remove(self.rendition_path("shoe-400w.jpg"))
+        self.assertIsNone(self.client.get(url).data["renditions"])
+
+    def test_generate_renditions_command(self):
+        Product.objects.create(name="Shoe", image="shoe.png")
+        Product.objects.create(name="Missing", image="missing.png")
+        out = StringIO()
+        call_command("generate_renditions", workers=2, stdout=out)
+
+        self.assertIn("Rendered 1 images (0 failed)", out.getvalue())
+        self.assertTrue(os.path.exists(self.rendition_path("shoe-400w.webp")))
+
+        out = StringIO()
+        call_command("generate_renditions", workers=0, stdout=out)
+        self.assertIn("Rendered 0 images", out.getvalue())
+
+
+class MediaServingTestCase(APITestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.name = default_storage.save("shoe.png", ContentFile(b"0123456789" * 10))
+        self.url = "/image/" + self.name
+
+    def test_saved_names_are_content_hashed(self):
+        self.assertRegex(self.name, r"^shoe\.[0-9a-f]{12}\.png$")
+        # Identical content maps to the same file
+        self.assertEqual(default_storage.save("shoe.png", ContentFile(b"0123456789" * 10)), self.name)
+        self.assertNotEqual(default_storage.save("shoe.png", ContentFile(b"other")), self.name)
+
+    def test_embedded_hash_is_checked_against_the_content(self):
+        # A name claiming the existing file's hash cannot replace its bytes
+        self.assertNotEqual(default_storage.save(self.name, ContentFile(b"other")), self.name)
+        with default_storage.open(self.name) as handle:
+            self.assertEqual(handle.read(), b"0123456789" * 10)
+
+        self.assertEqual(default_storage.save(self.name, ContentFile(b"0123456789" * 10)), self.name)
+        self.assertEqual(default_storage.save("shoe.000000000000.png", ContentFile(b"0123456789" * 10)), self.name)
+
+    def test_hashed_file_cached_forever(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789" * 10)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Content-Length"], "100")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(MEDIA_CACHE_MAX_AGE=60)
+    def test_unhashed_file_revalidated(self):
+        with open(os.path.join(self.media.name, "legacy.png"), "wb") as handle:
+            handle.write(b"legacy")
+        response = self.client.get("/image/legacy.png")
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+
+        response = self.client.get("/image/legacy.png", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(response["Content-Range"], "bytes 95-99/100")
+        self.assertEqual(b"".join(response.streaming_content), b"56789")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=200-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+        # A stale If-Range validator returns the whole file
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(MEDIA_SENDFILE="x-accel-redirect", MEDIA_SENDFILE_PREFIX="/protected-media/")
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/" + self.name)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response.content, b"")
+
+    @override_settings(MEDIA_SENDFILE="x-accel-redirect", MEDIA_SENDFILE_PREFIX="/protected-media/")
+    def test_accel_redirect_is_percent_encoded(self):
+        os.mkdir(os.path.join(self.media.name, "été"))
+        with open(os.path.join(self.media.name, "été", "robe #1 100%.png"), "wb") as handle:
+            handle.write(b"robe")
+
+        response = self.client.get("/image/%C3%A9t%C3%A9/robe%20%231%20100%25.png")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/%C3%A9t%C3%A9/robe%20%231%20100%25.png")
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.client.get("/image/missing.png").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/image/../settings.py").status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.post(self.url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class SparseFieldsetTestCase(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name="Shoes", slug="shoes")
+        self.products = [Product.objects.create(name="Shoe %s" % index, price=10 * index) for index in range(1, 4)]
+        for product in self.products:
+            product.category.add(self.category)
+        self.cart = Cart.objects.create()
+        self.orders = [Order.objects.create(owner=self.user) for _ in range(3)]
+        for product in self.products:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+            for order in self.orders:
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+
+    def test_unchanged_without_fields(self):
+        response = self.client.get(reverse("cart-detail", args=[self.cart.id]))
+        self.assertEqual(response.data, CartSerializer(self.cart).data)
+
+    def test_product_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("product-list"), {"fields": "product_id,price", "ordering": "-price"})
+
+        self.assertEqual(response.data["results"], [
+            {"product_id": str(product.pk), "price": product.price} for product in reversed(self.products)
+        ])
+        listing = queries.captured_queries[-1]["sql"]
+        self.assertNotIn('"name"', listing)
+        self.assertNotIn('"categories"', listing)
+
+    def test_order_items_collapsed_unless_expanded(self):
+        url = reverse("orders-list")
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"fields": "id,items"})
+        item_ids = sorted(self.orders[0].items.values_list("id", flat=True))
+        row = next(row for row in response.data["results"] if row["id"] == self.orders[0].id)
+        self.assertEqual(sorted(row["items"]), item_ids)
+        self.assertEqual(set(row), {"id", "items"})
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"fields": "id,items", "expand": "items"})
+        row = response.data["results"][0]
+        self.assertEqual(set(row["items"][0]), {"id", "product", "quantity", "unit_price"})
+        self.assertEqual(set(row["items"][0]["product"]), {"product_id", "name", "price"})
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"fields": "id,items.quantity,items.product"})
+        self.assertEqual(response.data["results"][0]["items"][0], {"product": self.products[0].pk, "quantity": 1})
+
+    def test_order_queries_constant(self):
+        url = reverse("orders-list")
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data["results"]), 3)
+        Order.objects.create(owner=self.user)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_cart_total_only(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("cart-detail", args=[self.cart.id]), {"fields": "id,grand_total"})
+        self.assertEqual(response.data, {"id": str(self.cart.id), "grand_total": 120})
+
+
+class FastListTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category_cache.clear()
+        self.category = Category.objects.create(name="Écharpes \u2028", slug="echarpes")
+        for index in range(25):
+            product = Product.objects.create(name="Scarf %s ✓" % index, price=10 + index % 7,
+                                             image="scarf-%s.png" % index if index % 2 else "",
+                                             trending=bool(index % 3))
+            product.category.add(self.category)
+
+    def assert_same_bytes(self, url, params=None):
+        fast = self.client.get(url, params)
+        with override_settings(FAST_LIST_SERIALIZATION=False):
+            slow = self.client.get(url, params)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_product_list_matches_serializer(self):
+        url = reverse("product-list")
+        response = self.assert_same_bytes(url)
+        self.assert_same_bytes(response.data["next"])
+        self.assert_same_bytes(url, {"ordering": "-price", "page_size": 7})
+        self.assert_same_bytes(url, {"search": "scarf", "category": "echarpes"})
+        self.assert_same_bytes(url, {"fields": "product_id,renditions,trending"})
+
+    def test_category_list_matches_serializer(self):
+        self.assert_same_bytes(reverse("category-list"))
+
+    def test_product_list_skips_model_instances(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("product-list"), {"fields": "product_id,price"})
+        self.assertNotIn('"name"', queries.captured_queries[-1]["sql"])
+
+    def test_fast_json_renderer_matches_json_renderer(self):
+        data = {
+            "text": "caf\u00e9 \u2028 \u2029 \"quoted\" </script>",
+            "id": Product(name="x").pk,
+            "when": timezone.now(),
+            "nested": [{"a": None, "b": True, "c": 2 ** 40}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        data["big"] = 2 ** 70
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, "application/json; indent=4"),
+            JSONRenderer().render(data, "application/json; indent=4"),
+        )
+
+
 class CartViewSetTestCase(APITestCase):
     def setUp(self):
         # Create a user
@@ -114,6 +1013,47 @@ class CartViewSetTestCase(APITestCase):
         self.assertFalse(Cart.objects.filter(id=cart.id).exists())
 
 
+class CartTotalsTestCase(APITestCase):
+    def setUp(self):
+        self.products = [Product.objects.create(name="Item %s" % index, price=index + 1) for index in range(50)]
+
+    def make_cart(self, lines):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=2) for product in self.products[:lines]
+        ])
+        return cart
+
+    def test_retrieve_queries_constant(self):
+        for lines in (1, 50):
+            cart = self.make_cart(lines)
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse("cart-detail", args=[cart.id]))
+            self.assertEqual(len(response.data["items"]), lines)
+            self.assertEqual(response.data["grand_total"], sum(2 * (index + 1) for index in range(lines)))
+            self.assertEqual(response.data["items"][0]["sub_total"], 2 * self.products[0].price)
+
+    def test_empty_cart_total(self):
+        cart = Cart.objects.create()
+        response = self.client.get(reverse("cart-detail", args=[cart.id]))
+        self.assertEqual(response.data["grand_total"], 0)
+        self.assertEqual(cart.get_cart_total, 0)
+
+    def test_reading_totals_has_no_side_effects(self):
+        cart = self.make_cart(2)
+        CartItem.objects.filter(cart=cart).update(quantity=0)
+
+        self.assertEqual(cart.get_cart_total, 0)
+        self.assertEqual([item.get_total for item in cart.items.all()], [0, 0])
+        self.assertEqual(cart.items.count(), 2)
+
+    def test_cart_item_list_queries_constant(self):
+        cart = self.make_cart(20)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("cart-items-list", args=[cart.id]))
+        self.assertEqual(sum(item["sub_total"] for item in response.data), cart.get_cart_total)
+
+
 class CartItemViewSetTestCase(APITestCase):
     def setUp(self):
         # Create a user
@@ -145,6 +1085,51 @@ class CartItemViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue("id" in response.data)
 
+    def test_add_rejects_quantities_past_the_line_limit(self):
+        url = reverse("cart-items-list", args=[self.cart.id])
+        data = {"product_id": str(self.product.product_id), "quantity": 32000}
+        self.assertEqual(self.client.post(url, data, format="json").status_code, status.HTTP_201_CREATED)
+
+        response = self.client.post(url, dict(data, quantity=1000), format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("quantity", response.data)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 32000)
+        response = self.client.post(url, dict(data, quantity=767), format="json")
+        self.assertEqual(response.data["quantity"], 32767)
+
+    def test_add_existing_product_increments_line(self):
+        url = reverse("cart-items-list", args=[self.cart.id])
+        data = {"product_id": str(self.product.product_id), "quantity": 2}
+        first = self.client.post(url, data, format="json")
+        # The upsert, then touching the cart
+        with self.assertNumQueries(2):
+            second = self.client.post(url, data, format="json")
+
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data["id"], first.data["id"])
+        self.assertEqual(second.data["quantity"], 4)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 4)
+
+    def test_add_cart_item_rejects_unknown_ids_and_zero_quantity(self):
+        url = reverse("cart-items-list", args=[self.cart.id])
+        response = self.client.post(url, {"product_id": str(uuid.uuid4()), "quantity": 1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("product_id", response.data)
+
+        response = self.client.post(url, {"product_id": str(self.product.pk), "quantity": 0}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url = reverse("cart-items-list", args=[uuid.uuid4()])
+        response = self.client.post(url, {"product_id": str(self.product.pk), "quantity": 1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_duplicate_lines_rejected(self):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        with self.assertRaises(IntegrityError):
+            CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+
     def test_update_cart_item(self):
         cart_item = CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
         url = reverse("cart-items-detail", args=[self.cart.id, cart_item.id])
@@ -165,6 +1150,450 @@ class CartItemViewSetTestCase(APITestCase):
         self.assertFalse(CartItem.objects.filter(id=cart_item.id).exists())
 
   
+
+class BulkCartItemTestCase(APITestCase):
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.products = [Product.objects.create(name="Look %s" % index, price=10 + index) for index in range(30)]
+        self.url = reverse("cart-items-bulk", args=[self.cart.id])
+
+    def test_bulk_add_update_and_remove(self):
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=5)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=5)
+        operations = [
+            {"product_id": str(self.products[0].pk), "quantity": 2},
+            {"product_id": str(self.products[1].pk), "quantity": 0},
+        ] + [{"product_id": str(product.pk), "quantity": 1} for product in self.products[2:]]
+
+        response = self.client.post(self.url, operations, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        quantities = dict(self.cart.items.values_list("product_id", "quantity"))
+        self.assertEqual(quantities[self.products[0].pk], 2)
+        self.assertNotIn(self.products[1].pk, quantities)
+        self.assertEqual(len(quantities), 29)
+        self.assertEqual(response.data["id"], str(self.cart.id))
+        self.assertEqual(len(response.data["items"]), 29)
+        self.assertEqual(response.data["grand_total"], 2 * 10 + sum(product.price for product in self.products[2:]))
+
+    def test_bulk_queries_constant(self):
+        def operations(products):
+            return [{"product_id": str(product.pk), "quantity": 3} for product in products]
+
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(self.url, operations(self.products[:2]), format="json")
+        with CaptureQueriesContext(connection) as many:
+            self.client.post(self.url, operations(self.products), format="json")
+        self.assertEqual(len(few), len(many))
+
+    def test_bulk_rejects_unknown_products_atomically(self):
+        unknown = str(uuid.uuid4())
+        operations = [
+            {"product_id": str(self.products[0].pk), "quantity": 1},
+            {"product_id": unknown, "quantity": 1},
+        ]
+        response = self.client.post(self.url, operations, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(unknown, str(response.data))
+        self.assertFalse(self.cart.items.exists())
+
+    def test_bulk_validates_operations(self):
+        self.assertEqual(self.client.post(self.url, [], format="json").status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, [{"product_id": str(self.products[0].pk), "quantity": -1}], format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(BULK_CART_MAX_ITEMS=2):
+            operations = [{"product_id": str(product.pk), "quantity": 1} for product in self.products[:3]]
+            self.assertEqual(self.client.post(self.url, operations, format="json").status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_unknown_cart(self):
+        operations = [{"product_id": str(self.products[0].pk), "quantity": 1}]
+        for cart_id in (uuid.uuid4(), "not-a-uuid"):
+            response = self.client.post(reverse("cart-items-bulk", args=[cart_id]), operations, format="json")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CartItemConcurrencyTestCase(TransactionTestCase):
+    threads = 8
+    adds_per_thread = 10
+
+    def test_concurrent_adds_lose_no_updates(self):
+        cart = Cart.objects.create()
+        product = Product.objects.create(name="Popular", price=5)
+        barrier = threading.Barrier(self.threads)
+
+        def worker():
+            barrier.wait()
+            try:
+                for _ in range(self.adds_per_thread):
+                    while True:
+                        try:
+                            CartItem.objects.add(cart.pk, product.pk, 1)
+                            break
+                        except OperationalError:
+                            # The in-memory SQLite test database locks whole
+                            # tables instead of waiting; the statement was
+                            # rolled back and is retried
+                            time.sleep(0.001)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        line = CartItem.objects.get(cart=cart, product=product)
+        self.assertEqual(line.quantity, self.threads * self.adds_per_thread)
+
+class BufferedCartStoreTestCase(APITestCase):
+    def setUp(self):
+        override = override_settings(
+            CART_STORE="FashionPlace.carts.BufferedCartStore", CART_STORE_FLUSH_INTERVAL=0)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.products = [Product.objects.create(name="Look %s" % index, price=10 + index) for index in range(3)]
+
+    def cart_writes(self, queries):
+        # Reserving a block of line ids writes to the id sequence only
+        return [query["sql"] for query in queries
+                if query["sql"].startswith(('INSERT INTO "FashionPlace_cart', 'INSERT OR IGNORE INTO "FashionPlace_cart',
+                                            'UPDATE "FashionPlace_cart', 'DELETE FROM "FashionPlace_cart'))]
+
+    def add(self, cart_id, product, quantity=1):
+        return self.client.post(reverse("cart-items-list", args=[cart_id]),
+                                {"product_id": str(product.pk), "quantity": quantity}, format="json")
+
+    def test_taps_are_buffered_until_read(self):
+        with CaptureQueriesContext(connection) as queries:
+            cart_id = self.client.post(reverse("cart-list")).data["id"]
+            first = self.add(cart_id, self.products[0])
+            self.add(cart_id, self.products[1], 2)
+            self.add(cart_id, self.products[0])
+            second = self.add(cart_id, self.products[2])
+            updated = self.client.patch(reverse("cart-items-detail", args=[cart_id, second.data["id"]]),
+                                        {"quantity": 4}, format="json")
+
+        self.assertEqual(self.cart_writes(queries), [])
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(updated.data["quantity"], 4)
+        self.assertFalse(Cart.objects.filter(pk=cart_id).exists())
+
+        response = self.client.get(reverse("cart-detail", args=[cart_id]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["grand_total"], 2 * 10 + 2 * 11 + 4 * 12)
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart_id=cart_id).values_list("product_id", "quantity")),
+            {self.products[0].pk: 2, self.products[1].pk: 2, self.products[2].pk: 4})
+        self.assertEqual(CartItem.objects.get(cart_id=cart_id, product=self.products[0]).pk, first.data["id"])
+
+    def test_flush_writes_carts_in_batches(self):
+        cart_ids = [self.client.post(reverse("cart-list")).data["id"] for _ in range(20)]
+        for cart_id in cart_ids:
+            for product in self.products:
+                self.add(cart_id, product)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(cart_store().flush(), 20)
+
+        self.assertEqual(len(self.cart_writes(queries)), 2)
+        self.assertEqual(CartItem.objects.filter(cart_id__in=cart_ids).count(), 60)
+        self.assertEqual(cart_store().flush(), 0)
+
+    def test_add_rejects_quantities_past_the_line_limit(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        self.assertEqual(self.add(cart_id, self.products[0], 32000).status_code, status.HTTP_201_CREATED)
+
+        response = self.add(cart_id, self.products[0], 1000)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("quantity", response.data)
+        self.assertEqual(cart_store().flush(), 1)
+        self.assertEqual(CartItem.objects.get(cart_id=cart_id).quantity, 32000)
+
+    def test_unwritable_cart_does_not_block_the_others(self):
+        cart_ids = [self.client.post(reverse("cart-list")).data["id"] for _ in range(3)]
+        for cart_id in cart_ids:
+            self.add(cart_id, self.products[0])
+        # A line the database rejects, whatever put it there
+        cart_store()._carts[uuid.UUID(cart_ids[1])].lines[self.products[0].pk].quantity = -1
+
+        with self.assertLogs("FashionPlace.carts", "ERROR"):
+            self.assertEqual(cart_store().flush(), 3)
+
+        self.assertEqual(set(Cart.objects.values_list("pk", flat=True)), {uuid.UUID(cart_ids[0]), uuid.UUID(cart_ids[2])})
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_flushed_carts_keep_buffering(self):
+        cart = Cart.objects.create()
+        line = CartItem.objects.create(cart=cart, product=self.products[0], quantity=1)
+        self.add(cart.id, self.products[0], 2)
+        self.add(cart.id, self.products[1])
+        response = self.client.delete(reverse("cart-items-detail", args=[cart.id, line.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.add(cart.id, self.products[0])
+        self.assertEqual(CartItem.objects.get(pk=line.pk).quantity, 1)
+
+        cart_store().flush()
+
+        self.assertFalse(CartItem.objects.filter(pk=line.pk).exists())
+        self.assertEqual(
+            dict(cart.items.values_list("product_id", "quantity")),
+            {self.products[0].pk: 1, self.products[1].pk: 1})
+
+    def test_errors_match_the_database_store(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        self.assertEqual(self.add(uuid.uuid4(), self.products[0]).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.add("not-a-uuid", self.products[0]).status_code, status.HTTP_404_NOT_FOUND)
+        missing = Product(name="Missing")
+        self.assertEqual(self.add(cart_id, missing).status_code, status.HTTP_400_BAD_REQUEST)
+        for item_id in (12345, "abc"):
+            response = self.client.delete(reverse("cart-items-detail", args=[cart_id, item_id]))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse("cart-detail", args=[cart_id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.cart_writes(queries), [])
+        self.assertEqual(self.client.delete(reverse("cart-detail", args=[cart_id])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_deleted_products_are_dropped(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        self.add(cart_id, self.products[0])
+        self.add(cart_id, self.products[1])
+        self.products[0].delete()
+
+        cart_store().flush()
+
+        self.assertEqual(list(CartItem.objects.filter(cart_id=cart_id).values_list("product_id", flat=True)),
+                         [self.products[1].pk])
+
+    def test_checkout_flushes_the_cart(self):
+        user = User.objects.create_user(email="buyer@example.com", password="secret")
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        self.add(cart_id, self.products[0], 3)
+
+        serializer = CreateOrderSerializer(data={"cart_id": cart_id}, context={"user_id": user.id})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        order = serializer.save()
+
+        self.assertEqual(list(order.items.values_list("product_id", "quantity")), [(self.products[0].pk, 3)])
+
+
+class CartReaperTestCase(APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name="Look", price=10)
+        self.old = timezone.now() - timedelta(days=40)
+
+    def make_cart(self, quantity=1, **kwargs):
+        cart = Cart.objects.create(**kwargs)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=quantity)
+        return cart
+
+    def test_item_changes_touch_the_cart(self):
+        cart = self.make_cart()
+        Cart.objects.filter(pk=cart.pk).update(updated_at=self.old)
+
+        self.client.post(reverse("cart-items-list", args=[cart.id]),
+                         {"product_id": str(self.product.pk), "quantity": 1}, format="json")
+
+        cart.refresh_from_db()
+        self.assertGreater(cart.updated_at, self.old)
+        self.assertLess(cart.created_at, cart.updated_at)
+
+    def test_reaps_abandoned_carts_and_orphaned_lines_in_batches(self):
+        abandoned = [self.make_cart() for _ in range(5)]
+        Cart.objects.filter(pk__in=[cart.pk for cart in abandoned]).update(updated_at=self.old)
+        recent = self.make_cart()
+        emptied = self.make_cart(quantity=0)
+        owned = self.make_cart(profile=Profile.objects.create(
+            user=User.objects.create_user(email="owner@example.com", password="secret"), username="owner", bio=""))
+        Cart.objects.filter(pk=owned.pk).update(updated_at=self.old)
+        CartItem.objects.create(cart=None, product=self.product, quantity=1)
+
+        batches = list(reap_carts(timezone.now() - timedelta(days=30), batch_size=2))
+
+        self.assertEqual(batches, [(2, 2), (2, 2), (1, 1), (0, 2)])
+        self.assertEqual(set(Cart.objects.values_list("pk", flat=True)), {recent.pk, emptied.pk, owned.pk})
+        self.assertEqual(set(CartItem.objects.values_list("cart_id", flat=True)), {recent.pk, owned.pk})
+
+    def test_command_reports_throughput(self):
+        cart = self.make_cart()
+        Cart.objects.filter(pk=cart.pk).update(updated_at=self.old)
+        out = StringIO()
+
+        call_command("reap_carts", "--batch-size", "10", stdout=out)
+
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+        self.assertIn("Deleted 1 carts and 1 lines", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+
+
+class CartMergeTestCase(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [Product.objects.create(name="Look %s" % index, price=10 + index) for index in range(3)]
+        self.anonymous = Cart.objects.create(session_id="visit-1")
+        CartItem.objects.create(cart=self.anonymous, product=self.products[0], quantity=1)
+        CartItem.objects.create(cart=self.anonymous, product=self.products[1], quantity=3)
+
+    def quantities(self, cart_id):
+        return dict(CartItem.objects.filter(cart_id=cart_id).values_list("product_id", "quantity"))
+
+    def test_merge_sums_quantities_in_one_upsert(self):
+        cart = Cart.objects.create(customer=self.user.customer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=2)
+        CartItem.objects.create(cart=cart, product=self.products[2], quantity=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("cart-merge"), {"cart_id": str(self.anonymous.id)}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], str(cart.id))
+        self.assertEqual(response.data["grand_total"], 3 * 10 + 3 * 11 + 1 * 12)
+        self.assertEqual(self.quantities(cart.id),
+                         {self.products[0].pk: 3, self.products[1].pk: 3, self.products[2].pk: 1})
+        self.assertFalse(Cart.objects.filter(pk=self.anonymous.pk).exists())
+        inserts = [query for query in queries if query["sql"].startswith('INSERT INTO "FashionPlace_cartitem"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_merge_caps_summed_quantities(self):
+        cart = Cart.objects.create(customer=self.user.customer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=32000)
+        other = Cart.objects.create(session_id="visit-1")
+        CartItem.objects.create(cart=other, product=self.products[0], quantity=30000)
+        # Summed with the 3 of the first anonymous cart of the session
+        CartItem.objects.create(cart=other, product=self.products[1], quantity=32767)
+
+        response = self.client.post(reverse("cart-merge"), {"session_id": "visit-1"}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.quantities(cart.id), {self.products[0].pk: 32767, self.products[1].pk: 32767})
+
+    def test_merge_by_session_creates_the_user_cart(self):
+        response = self.client.post(reverse("cart-merge"), {"session_id": "visit-1"}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cart = Cart.objects.get(customer=self.user.customer)
+        self.assertEqual(self.quantities(cart.id), {self.products[0].pk: 1, self.products[1].pk: 3})
+
+    def test_merge_only_takes_anonymous_carts(self):
+        other = User.objects.create_user(email="other@example.com", password="secret")
+        owned = Cart.objects.create(customer=other.customer)
+        url = reverse("cart-merge")
+
+        self.assertEqual(self.client.post(url, {}, format="json").status_code, status.HTTP_400_BAD_REQUEST)
+        for cart_id in (owned.id, uuid.uuid4()):
+            response = self.client.post(url, {"cart_id": str(cart_id)}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(Cart.objects.filter(pk=owned.pk).exists())
+
+        self.client.force_authenticate(user=None)
+        response = self.client.post(url, {"cart_id": str(self.anonymous.id)}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_views_merge_the_cart(self):
+        self.client.force_authenticate(user=None)
+        credentials = {"email": "test@example.com", "password": "testpassword"}
+
+        response = self.client.post(reverse("login"), dict(credentials, cart_id=str(self.anonymous.id)), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.quantities(response.data["cart_id"]), {self.products[0].pk: 1, self.products[1].pk: 3})
+
+        anonymous = Cart.objects.create(session_id="visit-2")
+        CartItem.objects.create(cart=anonymous, product=self.products[0], quantity=1)
+        response = self.client.post(reverse("jwt_create"), dict(credentials, session_id="visit-2"), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.quantities(response.data["cart_id"])[self.products[0].pk], 2)
+
+        response = self.client.post(reverse("login"), dict(credentials, cart_id="not-a-uuid"), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("cart_id", response.data)
+
+
+class OrderPlacementTestCase(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.cart = Cart.objects.create()
+        self.products = [Product.objects.create(name="Look %s" % index, price=10 + index) for index in range(20)]
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product=product, quantity=2) for product in self.products])
+
+    def place(self, cart_id):
+        serializer = CreateOrderSerializer(data={"cart_id": str(cart_id)}, context={"user_id": self.user.id})
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_order_placed_with_constant_queries(self):
+        # The cart lines, the order, its confirmation task and its items
+        # (plus the savepoints); the sales rollups are written after commit
+        with self.assertNumQueries(6):
+            order = self.place(self.cart.id)
+
+        self.assertEqual(order.items.count(), 20)
+        self.assertEqual(order.total, 2 * sum(product.price for product in self.products))
+
+    def test_prices_are_snapshotted(self):
+        order = self.place(self.cart.id)
+        Product.objects.filter(pk=self.products[0].pk).update(price=1000)
+
+        data = OrderSerializer(Order.objects.prefetch_related("items__product").get(pk=order.pk)).data
+
+        self.assertEqual(data["total"], order.total)
+        line = next(item for item in data["items"] if item["product"]["product_id"] == str(self.products[0].pk))
+        self.assertEqual(line["unit_price"], 10)
+        self.assertEqual(line["product"]["price"], 1000)
+
+    def test_invalid_and_empty_carts_are_rejected(self):
+        empty = Cart.objects.create()
+        CartItem.objects.create(cart=empty, product=self.products[0], quantity=0)
+        for cart_id, message in ((uuid.uuid4(), "This cart_id is invalid"), (empty.id, "Sorry your cart is empty")):
+            serializer = CreateOrderSerializer(data={"cart_id": str(cart_id)}, context={"user_id": self.user.id})
+            # The lines are read when the order is placed, under the cart's lock
+            self.assertTrue(serializer.is_valid())
+            with self.assertRaises(ValidationError) as context:
+                serializer.save()
+            self.assertEqual(context.exception.detail["cart_id"], [message])
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderListingTestCase(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(email="staff@example.com", password="secret", is_staff=True)
+        self.customer = User.objects.create_user(email="buyer@example.com", password="secret")
+        product = Product.objects.create(name="Look", price=10)
+        orders = Order.objects.bulk_create(
+            [Order(owner=self.staff if index % 3 else self.customer) for index in range(45)])
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=order, product=product, quantity=1, unit_price=10) for order in orders])
+        # Orders placed at the same instant are told apart by their id
+        Order.objects.filter(pk__in=[order.pk for order in orders[10:20]]).update(placed_at=timezone.now())
+
+    def page_through(self, user):
+        self.client.force_authenticate(user=user)
+        url, ids = reverse("orders-list"), []
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url, {"page_size": 20} if not ids else None)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [row["id"] for row in response.data["results"]]
+            url = response.data["next"]
+        return ids
+
+    def test_staff_page_through_every_order_newest_first(self):
+        expected = list(Order.objects.order_by("-placed_at", "-id").values_list("id", flat=True))
+        self.assertEqual(self.page_through(self.staff), expected)
+
+    def test_customers_page_through_their_orders(self):
+        expected = list(
+            Order.objects.filter(owner=self.customer).order_by("-placed_at", "-id").values_list("id", flat=True))
+        self.assertEqual(self.page_through(self.customer), expected)
+        self.assertEqual(len(expected), 15)
+
+
 class OrderViewSetTestCase(BaseAPITestCase):
     def setUp(self):
         super().setUp()
@@ -178,7 +1607,7 @@ class OrderViewSetTestCase(BaseAPITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data["results"]), 2)
 
     def test_create_order(self):
         customer = Customer.objects.create(user=self.user.customer)
@@ -328,4 +1757,397 @@ class LogInViewTestCase(BaseAPITestCase):
         }
         response = self.client.post(url, data, format="json")
 
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class IdempotencyKeyTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="buyer@example.com", password="secret")
+        self.client.force_authenticate(user=self.user)
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=Product.objects.create(name="Look", price=10), quantity=2)
+
+    def place(self, key, cart_id=None):
+        return self.client.post(reverse("orders-list"), {"cart_id": str(cart_id or self.cart.id)},
+                                format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_order_is_placed_once(self):
+        first = self.place("checkout-1")
+        retry = self.place("checkout-1")
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertFalse(first.has_header("Idempotent-Replayed"))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_another_request_is_rejected(self):
+        self.place("checkout-1")
+        other = Cart.objects.create()
+        CartItem.objects.create(cart=other, product=Product.objects.create(name="Other", price=5), quantity=1)
+
+        response = self.place("checkout-1", other.id)
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_keys_are_scoped_to_the_user(self):
+        first = self.place("checkout-1")
+        self.client.force_authenticate(user=User.objects.create_user(email="other@example.com", password="secret"))
+
+        second = self.place("checkout-1")
+
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(second.data["id"], first.data["id"])
+
+    def test_failed_request_releases_the_key(self):
+        response = self.place("checkout-1", uuid.uuid4())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self.place("checkout-1").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_key_runs_again(self):
+        self.place("checkout-1")
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+
+        response = self.place("checkout-1")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+        self.assertEqual(Order.objects.count(), 2)
+        out = StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 0 idempotency keys", out.getvalue())
+
+    def test_anonymous_keys_are_ignored(self):
+        # Anonymous keys would be shared by every client, letting one be
+        # replayed the cart of another
+        self.client.force_authenticate(user=None)
+        responses = [self.client.post(reverse("cart-list"), HTTP_IDEMPOTENCY_KEY=str(uuid.UUID(int=1)))
+                     for _ in range(2)]
+
+        self.assertNotEqual(responses[0].data["id"], responses[1].data["id"])
+        self.assertNotIn("Idempotent-Replayed", responses[1])
+        self.assertEqual(Cart.objects.exclude(pk=self.cart.pk).count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_invalid_key_is_rejected(self):
+        response = self.place("k" * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class IdempotencyConcurrencyTestCase(TransactionTestCase):
+    threads = 4
+
+    def test_concurrent_retries_place_one_order(self):
+        user = User.objects.create_user(email="buyer@example.com", password="secret")
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=Product.objects.create(name="Look", price=10), quantity=1)
+        barrier = threading.Barrier(self.threads)
+        bodies = []
+
+        def worker():
+            client = APIClient()
+            client.force_authenticate(user=user)
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        response = client.post(reverse("orders-list"), {"cart_id": str(cart.id)},
+                                               format="json", HTTP_IDEMPOTENCY_KEY="checkout-1")
+                        break
+                    except OperationalError:
+                        # SQLite fails the losing writer instead of waiting;
+                        # its whole transaction, key included, was rolled back
+                        time.sleep(0.001)
+                bodies.append(response.json())
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(len(bodies), self.threads)
+        self.assertTrue(all(body == bodies[0] for body in bodies))
+
+
+class SalesRollupTestCase(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(email="staff@example.com", password="secret", is_staff=True)
+        self.customer = User.objects.create_user(email="buyer@example.com", password="secret")
+        self.shoes = Category.objects.create(name="Shoes", slug="shoes")
+        self.bags = Category.objects.create(name="Bags", slug="bags")
+        self.boots = Product.objects.create(name="Boots", price=50)
+        self.boots.category.add(self.shoes)
+        self.tote = Product.objects.create(name="Tote", price=30)
+        self.tote.category.add(self.shoes, self.bags)
+        self.scarf = Product.objects.create(name="Scarf", price=5)
+
+    def place(self, quantities):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product=product, quantity=quantity) for product, quantity in quantities.items()])
+        serializer = CreateOrderSerializer(data={"cart_id": str(cart.id)}, context={"user_id": self.customer.id})
+        serializer.is_valid(raise_exception=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            return serializer.save()
+
+    def rollups(self):
+        return (
+            {(row.day, row.status): (row.orders, row.units, row.revenue)
+             for row in DailySales.objects.exclude(orders=0)},
+            {(row.day, row.category_id, row.status): (row.orders, row.units, row.revenue)
+             for row in CategorySales.objects.exclude(orders=0)},
+        )
+
+    def test_placed_orders_are_rolled_up(self):
+        order = self.place({self.boots: 2, self.tote: 1, self.scarf: 1})
+        self.place({self.tote: 2})
+        today, pending = timezone.localdate(), order.pending_status
+
+        daily, categories = self.rollups()
+
+        self.assertEqual(daily, {(today, pending): (2, 6, 195)})
+        self.assertEqual(categories, {
+            (today, self.shoes.id, pending): (2, 5, 190),
+            (today, self.bags.id, pending): (2, 3, 90),
+        })
+
+    def test_status_change_moves_the_order(self):
+        order = self.place({self.boots: 1})
+        self.place({self.tote: 1})
+
+        order = Order.objects.get(pk=order.pk)
+        order.pending_status = Order.PAYMENT_STATUS_COMPLETE
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+
+        today = timezone.localdate()
+        daily, categories = self.rollups()
+        self.assertEqual(daily, {(today, "PAYMENT_STATUS_PENDING"): (1, 1, 30), (today, "C"): (1, 1, 50)})
+        self.assertEqual(categories[(today, self.shoes.id, "C")], (1, 1, 50))
+        self.assertEqual(categories[(today, self.shoes.id, "PAYMENT_STATUS_PENDING")], (1, 1, 30))
+
+    def test_deleted_order_is_taken_out(self):
+        order = self.place({self.boots: 1})
+        self.client.force_authenticate(user=self.customer)
+
+        response = self.client.delete(reverse("orders-detail", kwargs={"pk": order.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.rollups(), ({}, {}))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        for index in range(5):
+            self.place({self.boots: index + 1, self.tote: 1, self.scarf: 2})
+        Order.objects.filter(pk__in=Order.objects.order_by("id").values("id")[:2]).update(
+            placed_at=timezone.now() - timedelta(days=3))
+        Order.objects.filter(pk=Order.objects.latest("id").pk).update(pending_status="F")
+        # Queryset updates bypass the incremental rollups
+        self.assertEqual(self.rollups()[0].keys(), {(timezone.localdate(), "PAYMENT_STATUS_PENDING")})
+
+        out = StringIO()
+        call_command("rebuild_sales_rollups", batch_size=2, stdout=out)
+        rebuilt = self.rollups()
+        DailySales.objects.all().delete()
+        CategorySales.objects.all().delete()
+        SalesStatus.objects.all().delete()
+        record_orders(Order.objects.values_list("id", flat=True))
+
+        self.assertIn("from 5 orders", out.getvalue())
+        self.assertEqual(rebuilt, self.rollups())
+        self.assertEqual(len(rebuilt[0]), 3)
+
+    def test_orders_are_counted_once(self):
+        order = self.place({self.boots: 1})
+        stale = Order.objects.get(pk=order.pk)
+        # A recording replayed, e.g. after a rebuild counted the order
+        record_orders([order.pk])
+
+        # Two saves of the same status change, from copies loaded before it
+        for copy in (Order.objects.get(pk=order.pk), stale):
+            copy.pending_status = Order.PAYMENT_STATUS_COMPLETE
+            with self.captureOnCommitCallbacks(execute=True):
+                copy.save()
+
+        today = timezone.localdate()
+        self.assertEqual(self.rollups()[0], {(today, "C"): (1, 1, 50)})
+
+        call_command("rebuild_sales_rollups", stdout=StringIO())
+        record_orders([order.pk])
+        self.assertEqual(self.rollups()[0], {(today, "C"): (1, 1, 50)})
+        self.assertEqual(SalesStatus.objects.get(order=order).status, "C")
+
+    def test_report_reads_the_rollups(self):
+        self.place({self.boots: 2, self.tote: 1})
+        old = self.place({self.scarf: 4})
+        Order.objects.filter(pk=old.pk).update(placed_at=timezone.now() - timedelta(days=40))
+        call_command("rebuild_sales_rollups", stdout=StringIO())
+        self.client.force_authenticate(user=self.staff)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("sales-report"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data["orders"], response.data["units"], response.data["revenue"]), (1, 3, 130))
+        self.assertEqual([day["day"] for day in response.data["days"]], [timezone.localdate()])
+        self.assertEqual([(row["name"], row["revenue"]) for row in response.data["categories"]],
+                         [("Shoes", 130), ("Bags", 30)])
+
+        start = (timezone.localdate() - timedelta(days=60)).isoformat()
+        response = self.client.get(reverse("sales-report"), {"start": start, "status": "C"})
+        self.assertEqual(response.data["orders"], 0)
+        response = self.client.get(reverse("sales-report"), {"start": start})
+        self.assertEqual((response.data["orders"], response.data["revenue"]), (2, 150))
+
+    def test_report_is_for_staff_with_a_valid_range(self):
+        self.client.force_authenticate(user=self.customer)
+        self.assertEqual(self.client.get(reverse("sales-report")).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.get(reverse("sales-report"), {"start": "2024-02-01", "end": "2024-01-01"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+RECORDED_TASKS = []
+
+
+@tasks.task
+def record_task(value):
+    RECORDED_TASKS.append(value)
+
+
+@tasks.task(max_attempts=2)
+def failing_task():
+    raise ValueError("Payment provider unavailable")
+
+
+class TaskQueueTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="buyer@example.com", password="secret")
+        del RECORDED_TASKS[:]
+
+    def claim_and_run(self):
+        task_ids = tasks.claim(10, "test-worker")
+        return [tasks.run(task_id)[:2] for task_id in task_ids]
+
+    def test_task_is_claimed_once_and_run(self):
+        queued = tasks.enqueue(record_task, value=7)
+
+        self.assertEqual(tasks.claim(10, "test-worker"), [queued.pk])
+        self.assertEqual(tasks.claim(10, "other-worker"), [])
+        name, succeeded, _ = tasks.run(queued.pk)
+
+        queued.refresh_from_db()
+        self.assertEqual((name, succeeded), ("api.tests.record_task", True))
+        self.assertEqual(RECORDED_TASKS, [7])
+        self.assertEqual((queued.status, queued.attempts, queued.locked_by), (Task.DONE, 1, ""))
+        self.assertIsNotNone(queued.duration)
+        self.assertIsNotNone(queued.finished_at)
+
+    def test_failed_task_is_retried_with_backoff_then_given_up(self):
+        queued = tasks.enqueue(failing_task)
+
+        self.assertEqual(self.claim_and_run(), [("api.tests.failing_task", False)])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.QUEUED)
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertIn("Payment provider unavailable", queued.last_error)
+        self.assertEqual(self.claim_and_run(), [])
+
+        Task.objects.update(run_at=timezone.now())
+        self.claim_and_run()
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Task.FAILED, 2))
+
+    def test_stale_tasks_are_queued_again(self):
+        queued = tasks.enqueue(record_task, value=1)
+        tasks.claim(10, "dead-worker")
+        self.assertEqual(tasks.requeue_stale(), 0)
+
+        Task.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(tasks.requeue_stale(), 1)
+        self.assertEqual(tasks.claim(10, "test-worker"), [queued.pk])
+
+    def test_stale_tasks_without_attempts_left_fail(self):
+        queued = tasks.enqueue(failing_task)
+        for _ in range(2):
+            # Each worker dies while running it
+            self.assertEqual(tasks.claim(10, "dead-worker"), [queued.pk])
+            Task.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+            tasks.requeue_stale()
+
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.locked_by), (Task.FAILED, 2, ""))
+        self.assertIsNotNone(queued.finished_at)
+        self.assertEqual(tasks.claim(10, "test-worker"), [])
+
+    def test_only_tasks_are_run(self):
+        with self.assertRaises(ValueError):
+            tasks.enqueue(len)
+        queued = Task.objects.create(name="os.remove", kwargs={"path": "/tmp/x"}, max_attempts=1)
+
+        self.claim_and_run()
+
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.FAILED)
+        self.assertIn("os.remove is not a task", queued.last_error)
+
+    def test_placed_order_is_confirmed_by_a_task(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=Product.objects.create(name="Boots", price=50), quantity=2)
+        serializer = CreateOrderSerializer(data={"cart_id": str(cart.id)}, context={"user_id": self.user.id})
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save()
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(self.claim_and_run(), [("FashionPlace.jobs.send_order_confirmation", True)])
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["buyer@example.com"])
+        self.assertIn("Your FashionPlace order #%d" % order.pk, mail.outbox[0].subject)
+        self.assertIn("2 x Boots at 50", mail.outbox[0].body)
+        self.assertIn("Total: 100", mail.outbox[0].body)
+
+    def test_profile_data_is_deleted_with_the_profile(self):
+        profile = Profile.objects.create(user=self.user, username="buyer", bio="")
+        order = Order.objects.create(owner=self.user, total=50)
+        OrderItem.objects.create(order=order, product=Product.objects.create(name="Boots", price=50),
+                                 quantity=1, unit_price=50)
+        record_orders([order.pk])
+        Task.objects.all().delete()
+
+        profile.delete()
+
+        self.assertFalse(Task.objects.exists())
+        self.assertFalse(DailySales.objects.exclude(orders=0).exists())
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Order.objects.filter(pk=order.pk).exists())
+        self.assertFalse(Customer.objects.filter(user_id=self.user.pk).exists())
+
+
+class TaskWorkerTestCase(TransactionTestCase):
+    def test_workers_drain_the_queue(self):
+        del RECORDED_TASKS[:]
+        for value in range(20):
+            tasks.enqueue(record_task, value=value)
+        tasks.enqueue(failing_task)
+        out = StringIO()
+
+        call_command("run_workers", once=True, workers=3, pool="thread", poll_interval=0, stdout=out)
+
+        self.assertEqual(sorted(RECORDED_TASKS), list(range(20)))
+        self.assertEqual(Task.objects.filter(status=Task.DONE).count(), 20)
+        self.assertEqual(Task.objects.get(name="api.tests.failing_task").status, Task.QUEUED)
+        self.assertIn("api.tests.record_task: 20 runs, 0 failed", out.getvalue())
+        self.assertIn("api.tests.failing_task: 1 runs, 1 failed", out.getvalue())
+        self.assertIn("Ran 21 tasks", out.getvalue())
+
@@ -24,7 +24,7 @@ schema_view = get_schema_view(
 
 router = routers.DefaultRouter()
 
-router.register("products", views.ProductViewSet)
+router.register("products", views.ProductViewSet, basename="product")
 router.register("categories", views.CategoryViewSet)
 router.register("carts", views.CartViewSet)
 router.register("profile", views.ProfileViewSet)
@@ -39,6 +39,7 @@ cart_router.register("items", views.CartItemViewSet, basename="cart-items")
 urlpatterns = [
     path("", include(router.urls)),
     path("", include(cart_router.urls)),
+    path("reports/sales/", views.SalesReportView.as_view(), name="sales-report"),
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
 
@@ -4,8 +4,19 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, ListModelMixin
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
-from api.filters import ProductFilter
+from api.filters import ProductFilter, ProductSearchFilter
+from api.pagination import OrderCursorPagination, ProductCursorPagination
+from api.conditional import catalog_condition, catalog_version, category_condition
+from api.facets import get_facets
+from api.fastpath import FastListMixin
+from api.fieldsets import SparseFieldsetViewMixin
+from api.idempotency import IDEMPOTENCY_KEY_PARAMETER, idempotent
+from api.renderers import CSVRenderer, NDJSONRenderer
+from FashionPlace.carts import cart_store
+from FashionPlace.catalog import category_cache, collection_ids
+from FashionPlace.sales import remove_orders, report
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -19,12 +30,21 @@ from rest_framework.request import Request
 from account.tokens import  get_tokens_for_user
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import AnonymousUser
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.permissions import AllowAny
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
+from django.conf import settings
+from django.db import transaction
+from itertools import islice
 
 
-class CategoryViewSet(ListModelMixin, GenericViewSet):
+COLLECTION_LIMIT_PARAMETER = openapi.Parameter(
+    "limit", openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+    description="Maximum number of products to return")
+
+
+class CategoryViewSet(FastListMixin, ListModelMixin, GenericViewSet):
     """
     A ViewSet for managing Category viewset.
 
@@ -41,19 +61,25 @@ class CategoryViewSet(ListModelMixin, GenericViewSet):
         operation_description="Get a list of all categories.",
         responses={200: CategorySerializer(many=True)}
     )
+    @category_condition
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        categories = category_cache.get().categories
+        plan = self.get_field_plan()
+        if plan is not None:
+            return Response(plan.render_instances(categories))
+        serializer = self.get_serializer(categories, many=True)
+        return Response(serializer.data)
 
 
-class ProductViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
+class ProductViewSet(SparseFieldsetViewMixin, FastListMixin, ListModelMixin, RetrieveModelMixin, GenericViewSet):
     """
     A ViewSet for managing Product viewset.
 
     Supported HTTP methods: GET, DELETE.
     """
 
-    queryset = Product.objects.all()
-    serializer_class = ProductSerializer
+    queryset = CatalogEntry.objects.all()
+    serializer_class = CatalogEntrySerializer
 
     permission_classes = [AllowAny]
 
@@ -62,6 +88,7 @@ class ProductViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
         operation_description="Get a list of all products.",
         responses={200: CategorySerializer(many=True)}
     )
+    @catalog_condition
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
@@ -70,17 +97,114 @@ class ProductViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
         operation_description="Retrieve a products with the given ID.",
         responses={200: CategorySerializer()}
     )
+    @catalog_condition
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    @swagger_auto_schema(
+        operation_summary="Facet counts for products",
+        operation_description="Count the products matching the given filters and search per category, "
+                              "per price bucket and per collection flag.",
+        manual_parameters=[
+            openapi.Parameter(
+                "price_buckets", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                description="Comma separated lower bounds of the price buckets, e.g. 0,50,100"),
+        ],
+        responses={200: "Facet counts", 400: "Bad Request"}
+    )
+    @action(detail=False, methods=["get"], pagination_class=None)
+    def facets(self, request, *args, **kwargs):
+        return Response(get_facets(request, self))
+
+    def collection_response(self, request, name):
+        token, _ = catalog_version(request)
+        product_ids = collection_ids(name, token)
+        try:
+            limit = int(request.query_params.get("limit", len(product_ids)))
+        except ValueError:
+            limit = len(product_ids)
+        product_ids = product_ids[:max(limit, 0)]
+
+        entries = self.sparse_queryset(CatalogEntry.objects.all()).in_bulk(product_ids)
+        products = [entries[pk] for pk in product_ids if pk in entries]
+        serializer = self.get_serializer(products, many=True)
+        return Response(serializer.data)
+
+    @swagger_auto_schema(
+        operation_summary="List new arrivals",
+        operation_description="Get the products flagged as new arrivals, most recently updated first.",
+        manual_parameters=[COLLECTION_LIMIT_PARAMETER],
+        responses={200: ProductSerializer(many=True)}
+    )
+    @action(detail=False, methods=["get"], url_path="new-arrivals", pagination_class=None)
+    @catalog_condition
+    def new_arrivals(self, request, *args, **kwargs):
+        return self.collection_response(request, "new_arrivals")
+
+    @swagger_auto_schema(
+        operation_summary="List top rated products",
+        operation_description="Get the products flagged as top rated, most recently updated first.",
+        manual_parameters=[COLLECTION_LIMIT_PARAMETER],
+        responses={200: ProductSerializer(many=True)}
+    )
+    @action(detail=False, methods=["get"], url_path="top-rated", pagination_class=None)
+    @catalog_condition
+    def top_rated(self, request, *args, **kwargs):
+        return self.collection_response(request, "top_rated")
+
+    @swagger_auto_schema(
+        operation_summary="List trending products",
+        operation_description="Get the products flagged as trending, most recently updated first.",
+        manual_parameters=[COLLECTION_LIMIT_PARAMETER],
+        responses={200: ProductSerializer(many=True)}
+    )
+    @action(detail=False, methods=["get"], pagination_class=None)
+    @catalog_condition
+    def trending(self, request, *args, **kwargs):
+        return self.collection_response(request, "trending")
+
+    @swagger_auto_schema(
+        operation_summary="Export products",
+        operation_description="Stream every product matching the given filters and search as NDJSON "
+                              "(default, or Accept: application/x-ndjson) or CSV (?format=csv or Accept: text/csv).",
+        responses={200: ProductSerializer(many=True)}
+    )
+    @action(detail=False, methods=["get"], pagination_class=None, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.query.order_by:
+            queryset = queryset.order_by("pk")
+        renderer = request.accepted_renderer
+
+        def rows():
+            header = None
+            chunk_size = settings.EXPORT_CHUNK_SIZE
+            products = queryset.iterator(chunk_size=chunk_size)
+            while True:
+                chunk = list(islice(products, chunk_size))
+                if not chunk:
+                    return
+                data = self.get_serializer(chunk, many=True).data
+                if renderer.format == "csv":
+                    if header is None:
+                        header = list(data[0])
+                        yield renderer.render_header(header)
+                    yield renderer.render_rows(header, data)
+                else:
+                    yield "".join(renderer.render_row(row) for row in data)
+
+        response = StreamingHttpResponse(rows(), content_type="%s; charset=utf-8" % renderer.media_type)
+        response["Content-Disposition"] = 'attachment; filename="products.%s"' % renderer.format
+        return response
+
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
-    search_fields = ['name']
+    search_fields = ['name', 'category__name']
     ordering_fields = ['price']
-    # pagination_class = PageNumberPagination
+    pagination_class = ProductCursorPagination
 
 
-class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
+class CartViewSet(SparseFieldsetViewMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
     """
     A ViewSet for managing Cart viewset.
 
@@ -94,9 +218,12 @@ class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, Gener
 
     @swagger_auto_schema(
         operation_summary="Create a cart",
-        operation_description="Create a cart with the given data.",
-        responses={201: CartSerializer()}
+        operation_description="Create a cart with the given data. Retries sent with the same "
+                              "Idempotency-Key replay the first response.",
+        manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
+        responses={201: CartSerializer(), 422: "Idempotency-Key reused with a different request"}
     )
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = CartSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -109,6 +236,7 @@ class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, Gener
         responses={200: CartSerializer()}
     )
     def retrieve(self, request, *args, **kwargs):
+        cart_store().flush([kwargs["pk"]])
         return super().retrieve(request, *args, **kwargs)
 
     @swagger_auto_schema(
@@ -117,7 +245,31 @@ class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, Gener
         responses={204:"No Content"}
     )
     def destroy(self, request, *args, **kwargs):
-        return super().destroy(request, *args, **kwargs)
+        try:
+            cart_store().delete_cart(kwargs["pk"])
+        except Cart.DoesNotExist:
+            raise NotFound("There is no cart associated with the given ID")
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @swagger_auto_schema(
+        operation_summary="Merge an anonymous cart",
+        operation_description="Fold an anonymous cart, given by cart_id or session_id, into the cart of the "
+                              "authenticated user. Quantities of the same product are added up and the "
+                              "anonymous cart is deleted. Returns the user's cart.",
+        request_body=MergeCartSerializer,
+        responses={200: CartSerializer(), 400: "Bad Request", 401: "Unauthorized", 404: "Not Found"}
+    )
+    @action(detail=False, methods=["post"], permission_classes=[IsAuthenticated])
+    def merge(self, request, *args, **kwargs):
+        serializer = MergeCartSerializer(data=request.data, context={"user": request.user})
+        serializer.is_valid(raise_exception=True)
+        cart = serializer.save()
+        if cart is None:
+            raise NotFound("There is no anonymous cart associated with the given ID")
+
+        cart_serializer = CartSerializer(context={"request": request})
+        cart_serializer.instance = cart_serializer.plan_queryset(Cart.objects.filter(pk=cart.pk)).get()
+        return Response(cart_serializer.data)
 
 
 class CartItemViewSet(ModelViewSet):
@@ -141,7 +293,7 @@ class CartItemViewSet(ModelViewSet):
     permission_classes = [AllowAny]
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"])
+        return CartItem.objects.filter(cart_id=self.kwargs["cart_pk"]).select_related("product").with_sub_total()
 
     def get_serializer_class(self):
         if self.request.method == "POST":
@@ -153,12 +305,35 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {"cart_id": self.kwargs["cart_pk"]}
 
+    @swagger_auto_schema(
+        operation_summary="Add, update and remove many Cartitems",
+        operation_description="Set the quantity of several products in the cart in one request. "
+                              "Missing lines are created, a quantity of 0 removes the line. "
+                              "Returns the updated cart with its totals.",
+        request_body=BulkCartItemSerializer(many=True),
+        responses={200: CartSerializer(), 400: "Bad Request", 404: "Not Found"}
+    )
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        cart_id = kwargs["cart_pk"]
+        serializer = BulkCartItemSerializer(
+            data=request.data, many=True, allow_empty=False, max_length=settings.BULK_CART_MAX_ITEMS,
+            context={"cart_id": cart_id})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        cart_store().flush([cart_id])
+        cart_serializer = CartSerializer(context={"request": request})
+        cart_serializer.instance = cart_serializer.plan_queryset(Cart.objects.filter(pk=cart_id)).get()
+        return Response(cart_serializer.data)
+
     @swagger_auto_schema(
         operation_summary="List Cartitems",
         operation_description="Retrieve a list of Cartitems for a specific cart.",
         responses={200: CartItemSerializer(many=True)}
     )
     def list(self, request, *args, **kwargs):
+        cart_store().flush([kwargs["cart_pk"]])
         return super().list(request, *args, **kwargs)
 
 
@@ -180,6 +355,7 @@ class CartItemViewSet(ModelViewSet):
         responses={200: CartItemSerializer()}
     )
     def retrieve(self, request, *args, **kwargs):
+        cart_store().flush([kwargs["cart_pk"]])
         return super().retrieve(request, *args, **kwargs)
         
     @swagger_auto_schema(
@@ -189,10 +365,17 @@ class CartItemViewSet(ModelViewSet):
         request_body=UpdateCartItemSerializer,
     )
     def partial_update(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = UpdateCartItemSerializer(instance, data=request.data, partial=True)
+        serializer = UpdateCartItemSerializer(data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        try:
+            if "quantity" in serializer.validated_data:
+                serializer.instance = cart_store().update_item(
+                    kwargs["cart_pk"], kwargs["pk"], serializer.validated_data["quantity"])
+            else:
+                cart_store().flush([kwargs["cart_pk"]])
+                serializer.instance = self.get_object()
+        except (Cart.DoesNotExist, CartItem.DoesNotExist):
+            raise NotFound("There is no cartitem associated with the given ID")
         return Response(serializer.data)
 
     @swagger_auto_schema(
@@ -201,10 +384,14 @@ class CartItemViewSet(ModelViewSet):
         responses={204: "No Content"}
     )
     def destroy(self, request, *args, **kwargs):
-        return super().destroy(request, *args, **kwargs)
+        try:
+            cart_store().remove_item(kwargs["cart_pk"], kwargs["pk"])
+        except (Cart.DoesNotExist, CartItem.DoesNotExist):
+            raise NotFound("There is no cartitem associated with the given ID")
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(SparseFieldsetViewMixin, ModelViewSet):
     # """
     # A ViewSet for managing Order viewset.
 
@@ -213,6 +400,7 @@ class OrderViewSet(ModelViewSet):
     # """
 
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
 
     http_method_names = ["get", "patch", "post", "delete", "options", "head"]
 
@@ -225,13 +413,7 @@ class OrderViewSet(ModelViewSet):
         user = request.user
         if user.is_anonymous:
             raise PermissionDenied("Authentication required to access orders.")
-        if user.is_staff:
-            queryset = Order.objects.all()
-        else:
-            queryset = Order.objects.filter(owner=user)
-
-        serializer = OrderSerializer(queryset, many=True)
-        return Response(serializer.data)
+        return super().list(request, *args, **kwargs)
 
     @swagger_auto_schema(
         operation_summary="Retrieve the customer order",
@@ -264,18 +446,25 @@ class OrderViewSet(ModelViewSet):
         user = request.user  
         order = get_object_or_404(Order, pk=kwargs['pk'], owner=user)
 
-        for item in order.items.all():
-            item.delete()
+        with transaction.atomic():
+            # The rollups are computed from the lines, so before they go
+            remove_orders([order.pk])
+            for item in order.items.all():
+                item.delete()
 
-        order.delete()
+            order.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @swagger_auto_schema(
         operation_summary="Create an order",
-        operation_description="Create an order with the given data.",
+        operation_description="Create an order with the given data. Retries sent with the same "
+                              "Idempotency-Key replay the first response instead of placing the order again.",
         request_body=CreateOrderSerializer,
-        responses={201: OrderSerializer(), 400: "Bad Request"}
+        manual_parameters=[IDEMPOTENCY_KEY_PARAMETER],
+        responses={201: OrderSerializer(), 400: "Bad Request",
+                   422: "Idempotency-Key reused with a different request"}
     )
+    @idempotent
     def create(self, request, *args, **kwargs): 
         serializer = CreateOrderSerializer(data=request.data, context={"user_id": request.user.id})
         serializer.is_valid(raise_exception=True)
@@ -302,10 +491,14 @@ class OrderViewSet(ModelViewSet):
         user = self.request.user
         if isinstance(user, AnonymousUser):
             return Order.objects.none()  
-        elif user.is_staff:
-            return Order.objects.all()
+        # Newest first, on the (owner, placed_at) and (placed_at) indexes;
+        # the items and their products are prefetched by the sparse
+        # fieldset plan with only the columns the serializer renders
+        orders = Order.objects.order_by("-placed_at", "-id")
+        if user.is_staff:
+            return orders
         else:
-            return Order.objects.filter(owner=user)
+            return orders.filter(owner=user)
        
         
 class ProfileViewSet(ModelViewSet):
@@ -447,6 +640,8 @@ class LogInView(APIView):
             properties={
                 "email": openapi.Schema(type=openapi.TYPE_STRING, description="User's email"),
                 "password": openapi.Schema(type=openapi.TYPE_STRING, description="User's password"),
+                "cart_id": openapi.Schema(type=openapi.TYPE_STRING, description="Anonymous cart to merge"),
+                "session_id": openapi.Schema(type=openapi.TYPE_STRING, description="Session of the anonymous carts to merge"),
             },
             required=["email", "password"],
         ),
@@ -466,6 +661,9 @@ class LogInView(APIView):
                 "message": "Login Successful",
                 "tokens": tokens
             }
+            cart = merge_login_cart(request.data, user)
+            if cart is not None:
+                response_data["cart_id"] = cart.pk
             return Response(data=response_data, status=status.HTTP_200_OK)
         else:
             return Response(data={"message": "Invalid email or password"}, status=status.HTTP_401_UNAUTHORIZED)
@@ -483,4 +681,28 @@ class LogInView(APIView):
             "user": str(request.user),
             "auth": str(request.auth)
         }
-        return Response(data=response_data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(data=response_data, status=status.HTTP_200_OK)
+
+
+class SalesReportView(APIView):
+    """
+    A View reporting the sales of a date range to staff.
+
+    Supported HTTP methods: GET.
+
+    """
+
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Sales report",
+        operation_description="Orders, units and revenue of the orders placed between two days, in total, by day "
+                              "and by category. A product in several categories counts in each of them.",
+        query_serializer=SalesReportSerializer,
+        responses={200: "Sales report", 400: "Bad Request", 403: "Forbidden"},
+    )
+    def get(self, request):
+        serializer = SalesReportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(data=report(**serializer.validated_data), status=status.HTTP_200_OK)
+
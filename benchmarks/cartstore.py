@@ -0,0 +1,73 @@
+"""
+Database writes of anonymous cart traffic under each cart store: every
+visitor creates a cart, adds products and changes a quantity, and only
+some of them come back to view the cart.
+
+    python -m benchmarks.cartstore [--visitors 500] [--taps 8] [--viewed 0.2]
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import setup
+
+
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--visitors', type=int, default=500)
+    parser.add_argument('--taps', type=int, default=8)
+    parser.add_argument('--viewed', type=float, default=0.2,
+                        help="Share of visitors who open their cart, which flushes it.")
+    options = parser.parse_args()
+    setup()
+
+    from django.db import connection
+    from django.db.models import Sum
+    from django.test.utils import override_settings
+
+    from FashionPlace.carts import cart_store
+    from FashionPlace.models import CartItem, Product
+
+    products = Product.objects.bulk_create(
+        [Product(name='Product %d' % index, price=index % 500) for index in range(200)])
+
+    def session(rng):
+        store = cart_store()
+        cart = store.create_cart()
+        lines = []
+        for _ in range(options.taps):
+            if lines and rng.random() < 0.25:
+                store.update_item(cart.id, rng.choice(lines), rng.randint(1, 5))
+            else:
+                lines.append(store.add_item(cart.id, rng.choice(products).pk, 1).id)
+        if rng.random() < options.viewed:
+            store.flush([cart.id])
+
+    print('%d visitors, %d taps each, %d%% view their cart' % (
+        options.visitors, options.taps, options.viewed * 100))
+    for label, store in (('database', 'DatabaseCartStore'), ('buffered', 'BufferedCartStore')):
+        with override_settings(CART_STORE='FashionPlace.carts.%s' % store, CART_STORE_FLUSH_INTERVAL=0):
+            rng = random.Random(0)
+            statements = []
+
+            def count(execute, sql, params, many, context):
+                statements.append(sql.startswith(WRITES))
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count):
+                started = time.perf_counter()
+                for _ in range(options.visitors):
+                    session(rng)
+                cart_store().flush()
+                elapsed = time.perf_counter() - started
+        print('%-10s %8d writes %8d queries %9.2f ms %8d units' % (
+            label, sum(statements), len(statements), elapsed * 1000,
+            CartItem.objects.aggregate(units=Sum('quantity'))['units']))
+        CartItem.objects.all().delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Order placement for carts of 1 to 500 lines: the previous checkout, two
+existence queries then one product query per line, against the single
+pass CreateOrderSerializer.
+
+    python -m benchmarks.checkout [--sizes 1,10,100,500]
+"""
+import argparse
+
+from benchmarks.common import measure, setup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1,10,100,500')
+    options = parser.parse_args()
+    setup()
+
+    from django.db import connection, transaction
+    from django.test.utils import CaptureQueriesContext
+
+    from FashionPlace.models import Cart, CartItem, Order, OrderItem, Product, User
+    from api.serializers import CreateOrderSerializer
+
+    user = User.objects.create_user(email='benchmark@example.com', password='benchmark')
+    sizes = [int(size) for size in options.sizes.split(',')]
+    products = Product.objects.bulk_create(
+        [Product(name='Product %d' % index, price=index % 500) for index in range(max(sizes))])
+
+    def previous(cart_id):
+        Cart.objects.filter(pk=cart_id).exists()
+        CartItem.objects.filter(cart_id=cart_id).exists()
+        with transaction.atomic():
+            order = Order.objects.create(owner_id=user.id)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=item.product, quantity=item.quantity)
+                for item in CartItem.objects.filter(cart_id=cart_id)
+            ])
+
+    def single_pass(cart_id):
+        serializer = CreateOrderSerializer(data={'cart_id': cart_id}, context={'user_id': user.id})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+    print('%-8s %-12s %9s %9s' % ('lines', 'checkout', 'queries', 'ms'))
+    for size in sizes:
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product=product, quantity=1) for product in products[:size]])
+        for label, place in (('previous', previous), ('single pass', single_pass)):
+            with CaptureQueriesContext(connection) as queries:
+                place(cart.pk)
+            seconds = measure(lambda: place(cart.pk))
+            print('%-8d %-12s %9d %9.2f' % (size, label, len(queries), seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
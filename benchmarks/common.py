@@ -0,0 +1,38 @@
+"""
+Django bootstrap shared by the benchmarks: project settings on a fresh
+in-memory SQLite database, migrated before the first measurement.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup():
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Ecommerce.settings')
+    os.environ.setdefault('DJANGO_SECRET_KEY', 'benchmark')
+    os.environ.setdefault('DEBUG', 'False')
+    os.environ['DATABASE_URL'] = 'sqlite://:memory:'
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+
+def measure(function, repeat=5):
+    """Best wall time of `repeat` calls, in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(label, seconds, rows):
+    print('%-40s %9.2f ms %9.2f us/row' % (label, seconds * 1000, seconds * 1e6 / max(rows, 1)))
@@ -0,0 +1,71 @@
+"""
+A 30 day sales report over a year of orders: aggregating OrderItem on
+every request against reading the DailySales and CategorySales rollups,
+and the time `rebuild_sales_rollups` takes to recompute them.
+
+    python -m benchmarks.sales [--orders 20000] [--lines 3]
+"""
+import argparse
+import random
+from datetime import timedelta
+
+from benchmarks.common import measure, report, setup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--lines', type=int, default=3)
+    options = parser.parse_args()
+    setup()
+
+    from django.db.models import Count, F, Sum
+    from django.db.models.functions import TruncDate
+    from django.utils import timezone
+
+    from FashionPlace.models import Category, Order, OrderItem, Product, User
+    from FashionPlace.sales import rebuild
+    from FashionPlace.sales import report as sales_report
+
+    rng = random.Random(0)
+    user = User.objects.create_user(email='benchmark@example.com', password='benchmark')
+    categories = Category.objects.bulk_create(
+        [Category(name='Category %d' % index, slug='category-%d' % index) for index in range(20)])
+    products = Product.objects.bulk_create(
+        [Product(name='Product %d' % index, price=index % 500) for index in range(500)])
+    Product.category.through.objects.bulk_create([
+        Product.category.through(product_id=product.pk, category_id=rng.choice(categories).pk)
+        for product in products
+    ])
+    now = timezone.now()
+    orders = Order.objects.bulk_create(
+        [Order(owner=user, pending_status=rng.choice('PCF')) for _ in range(options.orders)])
+    # auto_now_add overrides placed_at on insert
+    for order in orders:
+        order.placed_at = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+    Order.objects.bulk_update(orders, ['placed_at'], batch_size=1000)
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=rng.randint(1, 3), unit_price=product.price)
+        for order in orders for product in rng.sample(products, options.lines)
+    ], batch_size=5000)
+
+    end = timezone.localdate()
+    start = end - timedelta(days=29)
+
+    def scan():
+        items = OrderItem.objects.filter(order__placed_at__date__range=(start, end))
+        list(items.annotate(day=TruncDate('order__placed_at')).values('day').annotate(
+            orders=Count('order', distinct=True), units=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('unit_price'))).order_by('day'))
+        list(items.values('product__category').annotate(
+            orders=Count('order', distinct=True), units=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('unit_price'))).order_by())
+
+    rows = options.orders * options.lines
+    report('rebuild_sales_rollups', measure(lambda: list(rebuild()), repeat=1), options.orders)
+    report('30 day report, scanning OrderItem', measure(scan), rows)
+    report('30 day report, from the rollups', measure(lambda: sales_report(start, end)), rows)
+
+
+if __name__ == '__main__':
+    main()
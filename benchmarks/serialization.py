@@ -0,0 +1,73 @@
+"""
+Per-row cost of the product and category listings: DRF serializers on
+model instances against the FieldPlan fast path on `.values()` rows, and
+the stock JSONRenderer against FastJSONRenderer.
+
+    python -m benchmarks.serialization [--rows 5000]
+"""
+import argparse
+import io
+
+from benchmarks.common import measure, report, setup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    options = parser.parse_args()
+    setup()
+
+    from django.core.management import call_command
+    from rest_framework.renderers import JSONRenderer
+
+    from FashionPlace.models import CatalogEntry, Category, Product
+    from api.fastpath import FieldPlan
+    from api.renderers import FastJSONRenderer
+    from api.serializers import CatalogEntrySerializer, CategorySerializer
+
+    rows = options.rows
+    categories = Category.objects.bulk_create(
+        [Category(name='Category %d' % index, slug='category-%d' % index) for index in range(rows // 10 or 1)])
+    products = Product.objects.bulk_create([
+        Product(name='Product %d' % index, price=index % 500, image='product-%d.png' % index,
+                trending=index % 3 == 0)
+        for index in range(rows)
+    ])
+    Product.category.through.objects.bulk_create([
+        Product.category.through(product_id=product.pk, category_id=categories[index % len(categories)].pk)
+        for index, product in enumerate(products)
+    ])
+    call_command('rebuild_catalog', stdout=io.StringIO())
+
+    entries = CatalogEntry.objects.order_by('pk')
+    plan = FieldPlan.compile(CatalogEntrySerializer())
+    category_plan = FieldPlan.compile(CategorySerializer())
+
+    print('%d products, %d categories' % (rows, len(categories)))
+    report('products: serializer', measure(lambda: CatalogEntrySerializer(entries.all(), many=True).data), rows)
+    report('products: field plan', measure(lambda: plan.render(entries.values(*plan.sources))), rows)
+
+    # Image URLs cost the same storage lookups on both paths
+    plain = CatalogEntrySerializer()
+    for name in ('image', 'renditions'):
+        plain.fields.pop(name)
+    plain_plan = FieldPlan.compile(plain)
+    report('products, no images: serializer',
+           measure(lambda: [plain.to_representation(entry) for entry in entries.all()]), rows)
+    report('products, no images: field plan',
+           measure(lambda: plain_plan.render(entries.values(*plain_plan.sources))), rows)
+
+    category_list = list(Category.objects.order_by('id'))
+    report('categories: serializer',
+           measure(lambda: CategorySerializer(category_list, many=True).data), len(category_list))
+    report('categories: field plan',
+           measure(lambda: category_plan.render_instances(category_list)), len(category_list))
+
+    data = plan.render(entries.values(*plan.sources))
+    assert FastJSONRenderer().render(data) == JSONRenderer().render(data)
+    report('render: JSONRenderer', measure(lambda: JSONRenderer().render(data)), rows)
+    report('render: FastJSONRenderer', measure(lambda: FastJSONRenderer().render(data)), rows)
+
+
+if __name__ == '__main__':
+    main()